@@ -16,7 +16,7 @@ setup(
     long_description_content_type="text/markdown",
     url='https://github.com/kota7/wordleai-sql',
     packages=['wordleaisql'],
-    install_requires=['tqdm'],
+    install_requires=['tqdm', 'numpy'],
     #test_require=[],
     package_data={"wordleaisql": ["wordle-judge-all.cpp", "wordle-vocab.txt"]},
     entry_points={'console_scripts': ['wordleai-sql=wordleaisql.api:main']},
@@ -12,6 +12,7 @@ import os
 import json
 import random
 import itertools
+from functools import lru_cache
 from datetime import datetime
 from logging import basicConfig
 from concurrent.futures import ProcessPoolExecutor, as_completed
@@ -32,17 +33,23 @@ def _outfile(answer_word, metric):
 def _finished(answer_word, metric):
     return os.path.isfile(_outfile(answer_word, metric))
 
+@lru_cache(maxsize=None)
+def _get_ai(metric):
+    # AI objects are reused by the tasks in the same process,
+    # sharing the database built by the main process without locks
+    ai = WordleAISQLite("wordle", dbfile=DBFILE, read_only=True)
+    if metric == "random":
+        return WordleAI("wordle", ai.words)
+    return ai
+
 def simulate_one(answer_word, metric):
     random.seed(875)
     if _finished(answer_word, metric):
         return True
 
-    if metric == "random":
-        ai = WordleAI("wordle", default_wordle_vocab())
-    else:
-        ai = WordleAISQLite("wordle", default_wordle_vocab(), dbfile=DBFILE)
+    ai = _get_ai(metric)
+    ai.clear_info()
 
-    ai.set_candidates()
     wordlen = len(answer_word)
     out = {"answer_word": answer_word, "metric": metric, "steps": []}
     step = 0
@@ -56,11 +63,9 @@ def simulate_one(answer_word, metric):
         elif metric == "random":
             input_word = ai.pick_word()
         else:
-            if step == 1:
-                input_word = "tares" if metric=="mean_entropy" else "serai" if metric=="max_n" else "lares"
-            else:
-                res = ai.evaluate(criterion=metric)
-                input_word = res[0].input_word
+            # the first turn is looked up from the opening book
+            res = ai.evaluate(criterion=metric)
+            input_word = res[0].input_word
         
         res = wordle_judge(input_word, answer_word)
         decoded = str(decode_judgement(res)).zfill(wordlen)
@@ -80,7 +85,9 @@ def simulate_one(answer_word, metric):
 
 def main():
     words = default_wordle_vocab()
-    ai = WordleAISQLite("wordle", words, dbfile=DBFILE)  # create database if not exists
+    with WordleAISQLite("wordle", words, dbfile=DBFILE) as ai:  # create database if not exists
+        for metric in ("max_n", "mean_n", "mean_entropy"):
+            ai.opening_book(metric)  # build the opening book before the workers open the database as read-only
     metrics = ("random", "max_n", "mean_n", "mean_entropy")
 
     # test
@@ -17,7 +17,7 @@ logger = getLogger(__file__)
 
 # constants
 APP_VERSION = "0.0.9"
-WORD_PAIR_LIMIT = 500000
+WORD_PAIR_LIMIT = 20000000
 CANDIDATE_SAMPLE_SIZE = 500
 CSS = """
 td.letter {
@@ -66,7 +66,7 @@ def _init_state_if_not_exist(key: str, value):
 # Since making an AI object is trivial for typical vocabs with 10k words,
 #   I let the AI is generated again at every rerun.
 # @st.cache(allow_output_mutation=True)  # <-- this works but shows 'Running make_ai(...)' for a sec
-def make_ai(words: list or dict, word_pair_limit: int=500000, candidate_samplesize: int=500, strength: float=6):
+def make_ai(words: list or dict, word_pair_limit: int=20000000, candidate_samplesize: int=500, strength: float=6):
     logger.info("Generating AI")
     ai = WordleAIApprox(vocabname="wordle", words=words, inmemory=True, strength=strength,
                         word_pair_limit=word_pair_limit, candidate_samplesize=candidate_samplesize)
@@ -3,6 +3,9 @@
 import unittest
 import os
 import math
+import random
+import sqlite3
+import numpy as np
 from tempfile import TemporaryDirectory
 from wordleaisql.sqlite import WordleAISQLite
 
@@ -157,7 +160,7 @@ class TestApprox(unittest.TestCase):
         # we must supply words for new vocab
         with TemporaryDirectory() as d:
             def _create_ai(dbfile, words):
-                ai = WordleAIApprox("test", words, db=dbfile)
+                ai = WordleAIApprox("test", words, dbfile=dbfile)
                 return True
             dbfile = os.path.join(d, "test.db")
             self.assertRaises(Exception, _create_ai, dbfile, None, msg="new vocab requires word")  # need words for new vocab
@@ -189,7 +192,9 @@ class TestApprox(unittest.TestCase):
             dbfile2 = os.path.join(d, "test2.db")
             ai = WordleAIApprox("test", ["12", "31", "50"], dbfile=dbfile2)
             self.assertEqual(os.path.abspath(ai.dbfile), os.path.abspath(dbfile2), msg="dbfile explicit")  # specific var
-        if envval is not None:
+        if envval is None:
+            del os.environ[envname]
+        else:
             os.environ[envname] = envval
 
     def test_invalid_words(self):
@@ -219,29 +224,271 @@ class TestApprox(unittest.TestCase):
             ai = WordleAIApprox("test", words, dbfile=dbfile, word_pair_limit=10, candidate_samplesize=2)
             res = ai.evaluate(criterion="mean_entropy")
             show_word_evaluations(res)
-            # only answer words are filtered, so there should be some improvement for all rows in the candidate size
+            # only answer words are filtered, so all words are evaluated with metrics scaled to the candidate size
             n_candidates = len(words)
+            self.assertEqual(set(row.input_word for row in res), set(words))
             for row in res:
-                self.assertTrue(row.max_n < n_candidates, msg=str(row))
-                self.assertTrue(row.mean_n < n_candidates, msg=str(row))
-                self.assertTrue(row.mean_entropy < math.log2(n_candidates), msg=str(row))
+                self.assertTrue(row.max_n <= n_candidates, msg=str(row))
+                self.assertTrue(row.mean_n <= n_candidates, msg=str(row))
+                self.assertTrue(row.mean_entropy <= math.log2(n_candidates) + 1e-9, msg=str(row))
 
             # filter inputs
             ai = WordleAIApprox("test", words, dbfile=dbfile, word_pair_limit=10, candidate_samplesize=3)
             res = ai.evaluate(criterion="mean_entropy")
             show_word_evaluations(res)
-            # answer sample 3, word sample 3, so there should be 2 words not evaluated
-            n_candidates = len(words)
-            n_excluded = sum(row.max_n == n_candidates for row in res)
-            self.assertEqual(n_excluded, 2, msg="max_n")
-            n_excluded = sum(row.mean_n == n_candidates for row in res)
-            self.assertEqual(n_excluded, 2, msg="mean_n")
-            n_excluded = sum(row.mean_entropy == math.log2(n_candidates) for row in res)
-            self.assertEqual(n_excluded, 2, msg="mean_entropy")
+            # input words are narrowed down by the successive halving, so all words are evaluated
+            self.assertEqual(set(row.input_word for row in res), set(words))
 
             # for debugging, print eval result
             # assert False
 
+    def test_many_candidates(self):
+        # candidates are not passed as bound parameters, so the number of them is not limited
+        words = [a + b + c for a in "abcdef" for b in "abcdef" for c in "abcdef"]
+        ai = WordleAIApprox("test", words, inmemory=True, word_pair_limit=100000, candidate_samplesize=100)
+        ai.db.setlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER, 10)
+        res = ai.evaluate(top_k=len(words))
+        self.assertEqual(len(res), len(words))
+        ai.update("abc", "200")
+        res = ai.evaluate(top_k=len(words))
+        self.assertEqual(sum(row.is_candidate for row in res), len(ai.candidates))
+
+    def test_workers(self):
+        # parallel evaluation must be the same as the serial one given the same samples
+        words = [a + b + c for a in "abcdef" for b in "abcdef" for c in "abcdef"]
+        with TemporaryDirectory() as d:
+            dbfile = os.path.join(d, "test.db")
+            ai = WordleAIApprox("test", words, dbfile=dbfile, word_pair_limit=5000, candidate_samplesize=100, use_opening_book=False)
+            ai2 = WordleAIApprox("test", dbfile=dbfile, word_pair_limit=5000, candidate_samplesize=100, use_opening_book=False, workers=3)
+            for x in (ai, ai2):
+                x.update("abc", "200")
+            for limit in (5000, 100000):
+                ai.word_pair_limit = ai2.word_pair_limit = limit
+                random.seed(123)
+                res = ai.evaluate(top_k=len(words))
+                random.seed(123)
+                self.assertEqual(ai2.evaluate(top_k=len(words)), res)
+            ai.close()
+            ai2.close()
+
+    def test_engine(self):
+        # both engines give the same evaluation given the same samples
+        words = [a + b + c for a in "abcdef" for b in "abcdef" for c in "abcdef"]
+        ai = WordleAIApprox("test", words, inmemory=True, word_pair_limit=5000, candidate_samplesize=100, use_opening_book=False)
+        ai2 = WordleAIApprox("test", words, inmemory=True, word_pair_limit=5000, candidate_samplesize=100, use_opening_book=False,
+                             engine="sqlite")
+        for x in (ai, ai2):
+            x.update("abc", "200")
+        for limit in (5000, 100000):
+            ai.word_pair_limit = ai2.word_pair_limit = limit
+            random.seed(123)
+            res = ai.evaluate(top_k=len(words))
+            random.seed(123)
+            res2 = ai2.evaluate(top_k=len(words))
+            self.assertEqual(len(res), len(res2))
+            res2 = {row.input_word: row for row in res2}
+            for row in res:
+                row2 = res2[row.input_word]
+                self.assertEqual((row.max_n, row.is_candidate), (row2.max_n, row2.is_candidate))
+                self.assertAlmostEqual(row.mean_n, row2.mean_n)
+                self.assertAlmostEqual(row.mean_entropy, row2.mean_entropy)
+
+    def test_halving(self):
+        from wordleaisql.approx import _halving_schedule, _evaluate_halving, _evaluate_words_numpy
+        from wordleaisql.utils import encode_words
+        schedule = _halving_schedule(12972, 12972, word_pair_limit=1000000, candidate_samplesize=500)
+        self.assertEqual(schedule[0][0], 12972, msg="all words are evaluated first")
+        self.assertTrue(schedule[-1][1] >= 500, msg="the last round samples enough answers")
+        self.assertTrue(sum(n * m for n, m in schedule) <= 1000000)
+        self.assertTrue(all(n1 > n2 and m1 <= m2 for (n1, m1), (n2, m2) in zip(schedule[:-1], schedule[1:])))
+
+        words = [a + b + c for a in "abcdef" for b in "abcdef" for c in "abcdef"]
+        codes = encode_words(words)
+        evaluated = []
+        def evaluate_words(input_words, answer_words):
+            evaluated.append((len(input_words), len(answer_words)))
+            return _evaluate_words_numpy(words, codes, input_words=input_words, answer_words=answer_words)
+        rows = _evaluate_halving(evaluate_words, words, criterion="mean_n", word_pair_limit=5000, candidate_samplesize=50)
+        self.assertEqual(set(row[0] for row in rows), set(words))
+        self.assertTrue(sum(n * m for n, m in evaluated) <= 5000)
+        self.assertEqual(evaluated[0][0], len(words))
+        self.assertTrue(evaluated[-1][1] >= 50)
+
+    def test_evaluate_dispatch(self):
+        # module-level evaluation and the AI object take the same path given the same samples
+        from wordleaisql.approx import _evaluate, _sample_words
+        words = [a + b + c for a in "abcdef" for b in "abcdef" for c in "abcdef"]
+        self.assertRaises(AssertionError, _sample_words, words, None, word_pair_limit=5000, candidate_samplesize=100)
+        ai = WordleAIApprox("test", words, inmemory=True, word_pair_limit=5000, candidate_samplesize=100, use_opening_book=False,
+                            engine="sqlite")
+        ai.update("abc", "200")
+        for limit in (5000, 100000):  # with and without the successive halving
+            ai.word_pair_limit = limit
+            random.seed(123)
+            res = ai.evaluate(top_k=len(words))
+            random.seed(123)
+            res2 = _evaluate(ai.db, "test", top_k=len(words), candidates=ai.candidates, word_pair_limit=limit, candidate_samplesize=100)
+            self.assertEqual(res, res2)
+
+    def test_sampling_scale(self):
+        # metrics of all sampling modes are on the scale of the exact evaluation
+        words = [a + b + c for a in "abcdef" for b in "abcdef" for c in "abcdef"]
+        exact = WordleAIApprox("test", words, inmemory=True, use_opening_book=False)
+        expected = np.mean([row.mean_n for row in exact.evaluate(top_k=10, criterion="mean_n")])
+        for params in (dict(sampling="fixed", word_pair_limit=len(words)*50),   # answer words are sampled
+                       dict(sampling="fixed", word_pair_limit=len(words)*10),   # successive halving
+                       dict(sampling="adaptive", word_pair_limit=len(words)*50, adaptive_z=1e9)):
+            ai = WordleAIApprox("test", words, inmemory=True, use_opening_book=False, candidate_samplesize=20, seed=1, **params)
+            res = ai.evaluate(top_k=10, criterion="mean_n")  # top words are evaluated on the largest samples
+            self.assertTrue(0.5 < np.mean([row.mean_n for row in res]) / expected < 2, msg="mean_n by {}".format(params))
+            ai.close()
+        self.assertNotEqual(WordleAIApprox("test", words, inmemory=True)._cache_namespace(),
+                            WordleAIApprox("test", words, inmemory=True, sampling="adaptive")._cache_namespace())
+        exact.close()
+
+    def test_judge_cache(self):
+        from wordleaisql.approx import _JudgeCache
+        from wordleaisql.utils import encode_words, wordle_judge_batch
+        words = [a + b + c for a in "abcdef" for b in "abcdef" for c in "abcdef"]
+        codes = encode_words(words)
+        cache = _JudgeCache(codes, maxsize=20)
+        for input_ids, answer_ids in ((np.arange(len(words)), np.arange(30)), (np.arange(10), np.arange(25, 40))):
+            np.testing.assert_array_equal(cache.judges(input_ids, answer_ids), wordle_judge_batch(codes[input_ids], codes[answer_ids]))
+        self.assertEqual(len(cache._columns), 20, msg="least recently used columns are evicted")
+        self.assertEqual((cache.hits, cache.misses), (5, 40))
+
+        with TemporaryDirectory() as d:
+            dbfile = os.path.join(d, "test.db")
+            ai = WordleAIApprox("test", words, dbfile=dbfile, word_pair_limit=5000, candidate_samplesize=100, use_opening_book=False)
+            ai2 = WordleAIApprox("test", dbfile=dbfile, word_pair_limit=5000, candidate_samplesize=100, use_opening_book=False,
+                                 judge_cache_size=50, judge_cache_db_size=30)
+            for x in (ai, ai2):
+                x.update("abc", "200")
+            random.seed(123)
+            res = ai.evaluate(top_k=len(words))
+            random.seed(123)
+            self.assertEqual(ai2.evaluate(top_k=len(words)), res, msg="cache does not change the result")
+            self.assertEqual(ai2.db.execute('SELECT count(*) FROM "test_judgecache_approx"').fetchone()[0], 16)
+            ai2.update("aef", "211")
+            ai2.evaluate()
+            self.assertEqual(ai2.db.execute('SELECT count(*) FROM "test_judgecache_approx"').fetchone()[0], 16,
+                             msg="columns of the remaining candidates are reused")
+
+            ai3 = WordleAIApprox("test", dbfile=dbfile, use_opening_book=False, judge_cache_size=50, judge_cache_db_size=30)
+            ai3.update("abc", "200")
+            ai3.evaluate()
+            self.assertEqual(ai3._judge_cache[1].misses, 0, msg="columns are read from the database")
+            WordleAIApprox("test", words[:100], dbfile=dbfile, resetup=True)
+            self.assertEqual(ai3.db.execute("SELECT count(*) FROM sqlite_master WHERE name = 'test_judgecache_approx'").fetchone()[0], 0)
+            for x in (ai, ai2, ai3):
+                x.close()
+
+    def test_seed(self):
+        words = [a + b + c for a in "abcdef" for b in "abcdef" for c in "abcdef"]
+        for sampling in ("fixed", "adaptive"):
+            ai = WordleAIApprox("test", words, inmemory=True, word_pair_limit=2000, candidate_samplesize=20, use_opening_book=False,
+                                sampling=sampling, seed=1)
+            ai2 = WordleAIApprox("test", words, inmemory=True, word_pair_limit=2000, candidate_samplesize=20, use_opening_book=False,
+                                 sampling=sampling, seed=1)
+            res = ai.evaluate(top_k=len(words))
+            ai.update("abc", "000")
+            res2 = ai.evaluate(top_k=len(words))
+            ai2.update("abc", "000")
+            self.assertEqual(ai2.evaluate(top_k=len(words)), res2, msg="same state gives the same result")
+            ai2.clear_info()
+            self.assertEqual(ai2.evaluate(top_k=len(words)), res)
+            self.assertEqual(ai.pick_word(seed=2), ai.pick_word(seed=2))
+            ai.close()
+            ai2.close()
+
+    def test_opening_book_seed(self):
+        words = [a + b + c for a in "abcdef" for b in "abcdef" for c in "abcdef"]
+        with TemporaryDirectory() as d:
+            dbfile = os.path.join(d, "test.db")
+            with WordleAIApprox("test", words, dbfile=dbfile, word_pair_limit=2000, candidate_samplesize=20) as ai:
+                self.assertFalse(ai.use_opening_book, msg="no opening book for unseeded approximation")
+                ai.evaluate()
+                self.assertEqual(ai.db.execute("SELECT count(*) FROM sqlite_master WHERE name = 'test_opening_approx'").fetchone()[0], 0)
+            with WordleAIApprox("test", dbfile=dbfile, use_opening_book=True) as ai:
+                self.assertTrue(ai.use_opening_book, msg="explicitly enabled")
+
+            # opening book keeps the seeded result, and another seed has its own book
+            for seed in (1, 2):
+                ai = WordleAIApprox("test", dbfile=dbfile, word_pair_limit=2000, candidate_samplesize=20, seed=seed)
+                ai2 = WordleAIApprox("test", dbfile=dbfile, word_pair_limit=2000, candidate_samplesize=20, seed=seed,
+                                     use_opening_book=False)
+                self.assertTrue(ai.use_opening_book)
+                for _ in range(2):
+                    self.assertEqual(ai.evaluate(top_k=len(words)), ai2.evaluate(top_k=len(words)))
+                ai.close()
+                ai2.close()
+
+    def test_adaptive(self):
+        words = [a + b + c for a in "abcdef" for b in "abcdef" for c in "abcdef"]
+        with TemporaryDirectory() as d:
+            exact = WordleAISQLite("test", words, dbfile=os.path.join(d, "test.db"), use_opening_book=False)
+            exact.update("abc", "200")
+            expected = exact.evaluate(top_k=len(words), criterion="mean_n")
+            exact.close()
+        # without dropping words, all candidates are sampled and the result is exact
+        ai = WordleAIApprox("test", words, inmemory=True, candidate_samplesize=5, use_opening_book=False,
+                            sampling="adaptive", adaptive_z=1e9)
+        ai.update("abc", "200")
+        res = ai.evaluate(top_k=len(words), criterion="mean_n")
+        self.assertEqual(len(res), len(expected))
+        expected = {row.input_word: row for row in expected}
+        for row in res:
+            row2 = expected[row.input_word]
+            self.assertEqual((row.max_n, row.is_candidate), (row2.max_n, row2.is_candidate))
+            self.assertAlmostEqual(row.mean_n, row2.mean_n)
+            self.assertAlmostEqual(row.mean_entropy, row2.mean_entropy)
+
+        # with a tight budget, all input words are still evaluated
+        ai.adaptive_z = 3.0
+        ai.word_pair_limit = 2000
+        res = ai.evaluate(top_k=len(words), criterion="mean_n")
+        self.assertEqual(set(row.input_word for row in res), set(words))
+        self.assertRaises(Exception, WordleAIApprox, "test", words, inmemory=True, sampling="adaptive", engine="sqlite")
+        ai.close()
+
+    def test_time_limit(self):
+        # results cut short by the time limit are neither cached nor stored in the opening book
+        from wordleaisql.cache import EvaluationCache
+        from wordleaisql.sqlite import _read_opening_book, _opening_book_key
+        words = [a + b + c for a in "abcdef" for b in "abcdef" for c in "abcdef"]
+        for time_limit, stored in ((0, False), (None, True)):
+            cache = EvaluationCache()
+            ai = WordleAIApprox("test", words, inmemory=True, candidate_samplesize=40, sampling="adaptive", seed=1,
+                                time_limit=time_limit, evaluation_cache=cache)
+            ai.evaluate(top_k=5)
+            key = _opening_book_key(ai.nonanswer_words, *ai._evaluation_params())
+            self.assertEqual(_read_opening_book(ai.db, ai._opening_table, key, "mean_entropy") is not None, stored)
+            self.assertEqual(cache.stats["size"], 1 if stored else 0)
+            ai.close()
+
+    def test_read_only(self):
+        words = ["sheep", "shoes", "stage", "store", "style"]
+        with TemporaryDirectory() as d:
+            dbfile = os.path.join(d, "test.db")
+            WordleAIApprox("test", words, dbfile=dbfile).close()
+            with WordleAIApprox("test", dbfile=dbfile, read_only=True) as ai:
+                self.assertEqual(set(ai.words), set(words))
+                ai.update("sheep", "20100")
+                res = ai.evaluate(top_k=5)
+                self.assertEqual(sum(row.is_candidate for row in res), 3)
+
+    def test_resetup_skip(self):
+        words = {"sheep": 1, "shoes": 2, "stage": 3}
+        with TemporaryDirectory() as d:
+            dbfile = os.path.join(d, "test.db")
+            with WordleAIApprox("test", words, dbfile=dbfile) as ai:
+                meta = ai._meta
+            with WordleAIApprox("test", words, dbfile=dbfile, resetup=True) as ai:
+                self.assertEqual(ai._meta, meta, msg="unchanged vocab is not setup again")
+            with WordleAIApprox("test", {"sheep": 0, "shoes": 2, "stage": 3}, dbfile=dbfile, resetup=True) as ai:
+                self.assertEqual(ai._meta["build_seconds"], meta["build_seconds"], msg="only weights are updated")
+                self.assertTrue(all(ai.choose_answer_word() != "sheep" for _ in range(100)))
+
     def test_weight(self):
         words = {"a": 1, "b": 0, "c": 1}
         with TemporaryDirectory() as d:
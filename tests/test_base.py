@@ -5,6 +5,7 @@ import os
 from tempfile import TemporaryDirectory
 
 from wordleaisql.base import WordleAI
+from wordleaisql.utils import wordle_judge
 
 class TestBase(unittest.TestCase):
     def test_base(self):
@@ -53,4 +54,30 @@ class TestBase(unittest.TestCase):
         words = {"a": 1, "b": 0, "c": 1}
         ai = WordleAI("test", words)
         picked = set(ai.choose_answer_word() for _ in range(1000))
-        self.assertTrue("b" not in picked, msg="Picked answers: {}".format(picked))
\ No newline at end of file
+        self.assertTrue("b" not in picked, msg="Picked answers: {}".format(picked))
+        picked = ai.choose_answer_words(1000)
+        self.assertEqual(len(picked), 1000)
+        self.assertTrue("b" not in picked)
+        self.assertEqual(set(ai.choose_answer_words(1000, weighted=False)), set(words))
+        self.assertEqual(ai.choose_answer_words(10, seed=1), ai.choose_answer_words(10, seed=1))
+        self.assertEqual(ai.choose_answer_words(10, weighted=False, seed=1), ai.choose_answer_words(10, weighted=False, seed=1))
+
+    def test_candidates(self):
+        words = ["sheep", "shoes", "stage", "store", "style"]
+        ai = WordleAI("test", words)
+        self.assertEqual(ai.candidates, words)
+        ai.update("sheep", "20100")
+        self.assertEqual(ai.candidates, ["stage", "store", "style"])
+        ai.remove_from_answers(["store"])
+        self.assertEqual(ai.candidates, ["stage", "style"], msg="nonanswer words are removed")
+        ai.update("stage", "22002")
+        self.assertEqual(ai.candidates, ["style"], msg="narrowed by the newest info")
+
+        ai.clear_info()
+        self.assertEqual(ai.candidates, ["sheep", "shoes", "stage", "style"], msg="rebuilt after clear_info")
+        ai.info.append(("sheep", wordle_judge("sheep", "stage")))  # info can be modified directly
+        self.assertEqual(ai.candidates, ["stage", "style"])
+        ai.info[0] = ("style", wordle_judge("style", "sheep"))
+        self.assertEqual(ai.candidates, ["sheep", "shoes"])
+        ai.nonanswer_words.add("sheep")
+        self.assertEqual(ai.candidates, ["shoes"])
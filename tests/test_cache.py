@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import os
+from tempfile import TemporaryDirectory
+from wordleaisql.cache import EvaluationCache, evaluation_cache_key
+from wordleaisql.sqlite import WordleAISQLite
+from wordleaisql.approx import WordleAIApprox
+from wordleaisql.utils import WordEvaluation
+
+class TestCache(unittest.TestCase):
+    def test_key(self):
+        k1 = evaluation_cache_key(("a", "b"), [("sheep", 1), ("shoes", 2)], set(["stage"]), "max_n")
+        k2 = evaluation_cache_key(("a", "b"), [("shoes", 2), ("sheep", 1), ("sheep", 1)], set(["stage"]), "max_n")
+        self.assertEqual(k1, k2, msg="order and duplicates of info do not matter")
+        self.assertNotEqual(k1, evaluation_cache_key(("a", "c"), [("sheep", 1), ("shoes", 2)], set(["stage"]), "max_n"))
+        self.assertNotEqual(k1, evaluation_cache_key(("a", "b"), [("sheep", 1), ("shoes", 3)], set(["stage"]), "max_n"))
+        self.assertNotEqual(k1, evaluation_cache_key(("a", "b"), [("sheep", 1), ("shoes", 2)], set(), "max_n"))
+        self.assertNotEqual(k1, evaluation_cache_key(("a", "b"), [("sheep", 1), ("shoes", 2)], set(["stage"]), "mean_n"))
+
+    def test_lru(self):
+        rows = [WordEvaluation("w{}".format(i), i, i, i, 1) for i in range(5)]
+        cache = EvaluationCache(maxsize=2)
+        cache.put("a", 5, rows)
+        self.assertEqual(cache.get("a", top_k=3), rows[:3], msg="smaller top_k is served")
+        self.assertIsNone(cache.get("a", top_k=10), msg="larger top_k is not served")
+        cache.put("b", 10, rows[:3])
+        self.assertEqual(cache.get("b", top_k=20), rows[:3], msg="entry with all words serves any top_k")
+        cache.put("c", 5, rows)
+        self.assertIsNone(cache.get("a", top_k=3), msg="least recently used entry is evicted")
+        self.assertEqual(cache.stats, {"hits": 2, "misses": 2, "size": 2})
+
+    def test_persistent(self):
+        rows = [WordEvaluation("w{}".format(i), i, i + 0.5, i + 0.25, i % 2) for i in range(5)]
+        with TemporaryDirectory() as d:
+            dbfile = os.path.join(d, "cache.db")
+            cache = EvaluationCache(dbfile=dbfile, db_maxsize=2)
+            cache.put("a", 5, rows)
+            cache.put("b", 5, rows)
+            cache.put("c", 5, rows)
+            cache2 = EvaluationCache(dbfile=dbfile)  # e.g. another process
+            self.assertEqual(cache2.get("c", top_k=5), rows)
+            self.assertIsNone(cache2.get("a", top_k=5), msg="oldest entry is removed from the file")
+
+    def test_ai(self):
+        words = ["sheep", "shoes", "stage", "store", "style"]
+        with TemporaryDirectory() as d:
+            dbfile = os.path.join(d, "test.db")
+            cache = EvaluationCache()
+            for cls in (WordleAISQLite, WordleAIApprox):
+                ai = cls("test", words, dbfile=dbfile, evaluation_cache=cache)
+                ai2 = cls("test", dbfile=dbfile, evaluation_cache=cache)
+                ai.update("sheep", "20100")
+                res = ai.evaluate(top_k=3)
+                hits = cache.hits
+                ai2.update("sheep", "20100")
+                self.assertEqual(ai2.evaluate(top_k=3), res)
+                self.assertEqual(cache.hits, hits + 1, msg="same state in another game")
+                self.assertEqual(ai2.evaluate(top_k=3, criterion="max_n"), ai2._compute_evaluation(top_k=3, criterion="max_n"))
+                ai.close()
+                ai2.close()
+            self.assertEqual(len(cache._entries), 4, msg="backends do not share the entries")
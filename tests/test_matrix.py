@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import os
+from tempfile import TemporaryDirectory
+
+from wordleaisql.sqlite import WordleAISQLite
+from wordleaisql.matrix import WordleAIMatrix
+
+class TestMatrix(unittest.TestCase):
+    def test_matrix(self):
+        words = ["sheep", "shoes", "stage", "store", "style"]
+        with TemporaryDirectory() as d:
+            ai = WordleAIMatrix("test", words, matrixdir=d)
+
+            # words must equal
+            self.assertEqual(set(words), set(ai.words))
+
+            # initial candidates must equal all words
+            #ai.set_candidates()
+            ai.clear_info()
+            self.assertEqual(set(words), set(ai.candidates))
+
+            # initial result must be...
+            # input_word	max_n	avg_n	avg_log2n is_candidate
+            # --------------------------------------------------------------------
+            #   input_word         max_n        mean_n  mean_entropy  is_candidate
+            # --------------------------------------------------------------------
+            #        shoes             2           1.4         0.400             1
+            #        store             2           1.4         0.400             1
+            #        stage             2           1.8         0.800             1
+            #        style             2           1.8         0.800             1
+            #        sheep             3           2.2         0.951             1
+            # --------------------------------------------------------------------
+            results = ai.evaluate(criterion="max_n")
+            expected = {
+               "sheep": (3, 2.2, 0.951, 1)
+              ,"shoes": (2, 1.4, 0.400, 1)
+              ,"stage": (2, 1.8, 0.800, 1)
+              ,"store": (2, 1.4, 0.400, 1)
+              ,"style": (2, 1.8, 0.800, 1)
+            }
+            for row in results:
+                self.assertEqual(len(row), 5)
+                ans = expected[row[0]]
+                for a, b in zip(row[1:], ans):
+                    self.assertAlmostEqual(a, b, msg="Error at initial evaluation of '{}'".format(row[0]), places=3)
+            
+            # update result
+            ai.update("sheep", "20100")
+            self.assertEqual(set(["stage", "store", "style"]), set(ai.candidates))
+
+            # --------------------------------------------------------------------
+            #   input_word         max_n        mean_n  mean_entropy  is_candidate
+            # --------------------------------------------------------------------
+            #        stage             2           1.7         0.667             1
+            #        store             2           1.7         0.667             1
+            #        style             2           1.7         0.667             1
+            #        shoes             2           1.7         0.667             0
+            #        sheep             3           3.0         1.585             0
+            # --------------------------------------------------------------------
+            results = ai.evaluate(criterion="max_n")
+            expected = {
+               "sheep": (3, 3.000, 1.585, 0)
+              ,"shoes": (2, 1.667, 0.667, 0)
+              ,"stage": (2, 1.667, 0.667, 1)
+              ,"store": (2, 1.667, 0.667, 1)
+              ,"style": (2, 1.667, 0.667, 1)
+            }
+            for row in results:
+                self.assertEqual(len(row), 5)
+                ans = expected[row[0]]
+                for a, b in zip(row[1:], ans):
+                    self.assertAlmostEqual(a, b, msg="Error at the second evaluation of '{}'".format(row[0]), places=3)
+            
+
+            # ai should pick a word
+            word = ai.pick_word()
+            self.assertEqual(type(word), str)
+            self.assertTrue(word in ai.words)
+            self.assertEqual(ai.pick_word(seed=1), ai.pick_word(seed=1), msg="same word for the same seed and state")
+
+            # no database backend behind the matrix AI
+            self.assertFalse(isinstance(ai, WordleAISQLite))
+
+    def test_words_omit(self):
+        # we must supply words for new vocab
+        with TemporaryDirectory() as d:
+            def _create_ai(matrixdir, words):
+                ai = WordleAIMatrix("test", words, matrixdir=matrixdir)
+                return True
+            self.assertRaises(Exception, _create_ai, d, None, msg="new vocab requires word")  # need words for new vocab
+            self.assertTrue(_create_ai(d, ["aaa", "bbb", "acb"]))  # words supplied
+            self.assertTrue(_create_ai(d, None), msg="words can be omitted if vocab already exists")  # okay because vocab already exists
+
+    def test_matrixdir(self):
+        # delete first
+        envname = "WORDLEAISQL_MATRIXDIR"
+        envval = os.environ.get(envname)
+        if envval is not None:
+            del os.environ[envname]
+
+        with TemporaryDirectory() as d:
+            curdir = os.getcwd()
+            try:
+                os.chdir(d)
+                ai = WordleAIMatrix("test", ["12", "31", "50"], matrixdir=None)
+                self.assertEqual(os.path.abspath(ai.matrixdir), os.path.abspath("./wordleai-matrix"), msg="matrixdir in current dir")
+            finally:
+                os.chdir(curdir)
+
+        with TemporaryDirectory() as d:
+            os.environ[envname] = d
+            ai = WordleAIMatrix("test", ["12", "31", "50"], matrixdir=None)
+            self.assertEqual(os.path.abspath(ai.matrixdir), os.path.abspath(d), msg="matrixdir from envvar")  # envvar
+
+            matrixdir2 = os.path.join(d, "test2")
+            ai = WordleAIMatrix("test", ["12", "31", "50"], matrixdir=matrixdir2)
+            self.assertEqual(os.path.abspath(ai.matrixdir), os.path.abspath(matrixdir2), msg="matrixdir explicit")  # specific var
+        # clean up
+        if envval is None:
+            del os.environ[envname]
+        else:
+            os.environ[envname] = envval
+
+    def test_same_as_sqlite(self):
+        words = ["tacit", "state", "smile", "funny", "aland", "ahead", "error", "peter", "eerie", "geese", "llama", "allay"]
+        with TemporaryDirectory() as d:
+            ai = WordleAIMatrix("test", words, matrixdir=d)
+            ai2 = WordleAISQLite("test", words, dbfile=os.path.join(d, "test.db"))
+            for info in ([], [("error", "10002")], [("aland", "00000")]):
+                for a in (ai, ai2):
+                    a.clear_info()
+                    for w, r in info:
+                        a.update(w, r)
+                for criterion in ("max_n", "mean_n", "mean_entropy"):
+                    res = ai.evaluate(top_k=100, criterion=criterion)
+                    res2 = ai2.evaluate(top_k=100, criterion=criterion)
+                    self.assertEqual([row.input_word for row in res], [row.input_word for row in res2])
+                    for row, row2 in zip(res, res2):
+                        self.assertEqual(row.max_n, row2.max_n)
+                        self.assertEqual(row.is_candidate, row2.is_candidate)
+                        self.assertAlmostEqual(row.mean_n, row2.mean_n)
+                        self.assertAlmostEqual(row.mean_entropy, row2.mean_entropy)
+
+    def test_resetup(self):
+        # setup replaces the build as a whole, and the words are checked against the hash recorded at the setup
+        from wordleaisql.matrix import _current_version, _wordsfile
+        with TemporaryDirectory() as d:
+            ai = WordleAIMatrix("test", ["sheep", "shoes", "stage"], matrixdir=d)
+            old_version = _current_version(d, "test")[0]
+            ai2 = WordleAIMatrix("test", ["store", "style", "sheep", "stage"], matrixdir=d, resetup=True)
+            self.assertEqual(ai2.words, ["store", "style", "sheep", "stage"])
+            self.assertEqual(ai2.judges.shape, (4, 4))
+            self.assertEqual(ai.evaluate(top_k=10)[0].input_word, "sheep", msg="old object keeps its own matrix")
+            self.assertFalse(os.path.exists(old_version), msg="old build is removed")
+            self.assertEqual(sorted(os.listdir(d)), sorted([os.path.basename(_current_version(d, "test")[0]), "test.current"]))
+            self.assertEqual(ai2.vocabnames, ["test"])
+
+            with open(_wordsfile(_current_version(d, "test")[0]), "a") as f:
+                f.write("shoes 1.0\n")
+            self.assertRaises(ValueError, WordleAIMatrix, "test", matrixdir=d)
+
+    def test_invalid_words(self):
+        def _create_ai(words):
+            with TemporaryDirectory() as d:
+                ai = WordleAIMatrix("test", words, matrixdir=d)
+            return True
+        self.assertRaises(Exception, _create_ai, ["sheep", "shoes", "stage", "store", "style", "superb"])
+        self.assertTrue(_create_ai(["sheep", "shoes", "stage", "store", "style"]))
+        self.assertRaises(Exception, _create_ai, ["松竹梅", "大中小", "甲乙丙丁"])
+        self.assertTrue(_create_ai(["松竹梅", "大中小"]))
+        self.assertRaises(Exception, _create_ai, ["3.1415", "2.7182", "1.23456"])
+        self.assertTrue(_create_ai(["12345", "67890"]))
+
+    def test_weight(self):
+        words = {"a": 1, "b": 0, "c": 1}
+        with TemporaryDirectory() as d:
+            ai = WordleAIMatrix("test", words, matrixdir=d)
+            picked = set(ai.choose_answer_word() for _ in range(1000))
+            self.assertTrue("b" not in picked, msg="Picked answers: {}".format(picked))
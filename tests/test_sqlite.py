@@ -3,8 +3,11 @@
 import unittest
 import os
 from tempfile import TemporaryDirectory
+from concurrent.futures import ThreadPoolExecutor
 
-from wordleaisql.sqlite import WordleAISQLite
+import sqlite3
+from wordleaisql.sqlite import WordleAISQLite, _setup, _read_opening_book, _opening_book_key
+from wordleaisql.utils import wordle_judge, decode_judgement
 
 class TestSQLite(unittest.TestCase):
     def test_sqlite(self):
@@ -116,7 +119,9 @@ class TestSQLite(unittest.TestCase):
             ai = WordleAISQLite("test", ["12", "31", "50"], dbfile=dbfile2)
             self.assertEqual(os.path.abspath(ai.dbfile), os.path.abspath(dbfile2), msg="dbfile explicit")  # specific var
         # clean up
-        if envval is not None:
+        if envval is None:
+            del os.environ[envname]
+        else:
             os.environ[envname] = envval
 
     def test_invalid_words(self):
@@ -139,3 +144,230 @@ class TestSQLite(unittest.TestCase):
             ai = WordleAISQLite("test", words, dbfile=dbfile)
             picked = set(ai.choose_answer_word() for _ in range(1000))
             self.assertTrue("b" not in picked, msg="Picked answers: {}".format(picked))
+
+    def test_schema_v1(self):
+        # databases created by the older version must keep working
+        words = ["sheep", "shoes", "stage", "store", "style"]
+        with TemporaryDirectory() as d:
+            dbfile = os.path.join(d, "test.db")
+            with sqlite3.connect(dbfile) as conn:
+                c = conn.cursor()
+                c.execute('CREATE TABLE "old_words" (word TEXT PRIMARY KEY, weight FLOAT)')
+                c.executemany('INSERT INTO "old_words" VALUES (?,?)', [(w, 1) for w in words])
+                c.execute('CREATE TABLE "old_judges" (input_word TEXT, answer_word TEXT, judge INT)')
+                c.executemany('INSERT INTO "old_judges" VALUES (?,?,?)',
+                              [(a, b, wordle_judge(a, b)) for a in words for b in words])
+                conn.commit()
+            _setup(dbfile, "v2", words, schema_version=2)
+            old = WordleAISQLite("old", dbfile=dbfile)
+            v2 = WordleAISQLite("v2", dbfile=dbfile)
+            new = WordleAISQLite("new", words, dbfile=dbfile)
+            self.assertEqual(old.schema_version, 1)
+            self.assertEqual(v2.schema_version, 2)
+            self.assertEqual(new.schema_version, 3)
+            self.assertEqual(set(old.vocabnames), set(["old", "v2", "new"]))
+            self.assertEqual(old.words, new.words)
+            for ai in (old, v2, new):
+                ai.update("sheep", "20100")
+                self.assertEqual(ai.candidates, ["stage", "store", "style"])
+            res1 = old.evaluate(criterion="mean_entropy")
+            res2 = v2.evaluate(criterion="mean_entropy")
+            res3 = new.evaluate(criterion="mean_entropy")
+            self.assertEqual(res1, res2)
+            # packed judges are summed in numpy, so the entropy may differ in the last digits
+            res3 = {row.input_word: row for row in res3}
+            for row in res1:
+                self.assertEqual(row[:3] + row[4:], res3[row.input_word][:3] + res3[row.input_word][4:])
+                self.assertAlmostEqual(row.mean_entropy, res3[row.input_word].mean_entropy)
+
+    def test_connection(self):
+        words = ["sheep", "shoes", "stage", "store", "style"]
+        with TemporaryDirectory() as d:
+            dbfile = os.path.join(d, "test.db")
+            with WordleAISQLite("test", words, dbfile=dbfile, sqlite_pragmas={"cache_size": -1024}) as ai:
+                self.assertIs(ai.db, ai.db, msg="connection is reused")
+                self.assertEqual(ai.db.execute("PRAGMA cache_size").fetchone()[0], -1024)
+                res1 = ai.evaluate()
+                # other threads use their own connections
+                with ThreadPoolExecutor(2) as executor:
+                    conn, res2 = executor.submit(lambda: (ai.db, ai.evaluate())).result()
+                self.assertIsNot(conn, ai.db)
+                self.assertEqual(res1, res2)
+            self.assertEqual(len(ai._connections), 0, msg="connections are closed at exit")
+            self.assertEqual(ai.evaluate(), res1, msg="connection is opened again if needed")
+            ai.close()
+
+    def test_many_candidates(self):
+        # candidates are not passed as bound parameters, so the number of them is not limited
+        words = [a + b + c for a in "abcdef" for b in "abcdef" for c in "abcdef"]
+        with TemporaryDirectory() as d:
+            dbfile = os.path.join(d, "test.db")
+            with WordleAISQLite("test", words, dbfile=dbfile) as ai:
+                ai.db.setlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER, 10)
+                ai.update("abc", "200")
+                candidates = ai.candidates
+                self.assertTrue(len(candidates) > 10)
+                res = ai.evaluate(top_k=len(words))
+                self.assertEqual(len(res), len(words))
+                self.assertEqual(set(row.input_word for row in res if row.is_candidate), set(candidates))
+                for row in res:
+                    n = len(set(wordle_judge(row.input_word, w) for w in candidates))
+                    self.assertEqual(row.max_n == 1, n == len(candidates), msg=str(row))
+
+    def test_resetup(self):
+        # vocab is replaced as a whole, leaving no staging tables
+        with TemporaryDirectory() as d:
+            dbfile = os.path.join(d, "test.db")
+            ai = WordleAISQLite("test", ["sheep", "shoes", "stage"], dbfile=dbfile, use_opening_book=False)
+            ai.update("sheep", "20100")
+            self.assertEqual(ai.candidates, ["stage"])
+            ai.evaluate()
+            ai2 = WordleAISQLite("test", ["store", "style", "sheep", "stage"], dbfile=dbfile, resetup=True)
+            self.assertEqual(set(ai.words), set(["store", "style", "sheep", "stage"]), msg="other connections see the new vocab")
+            tables = [row[0] for row in ai2.db.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+            self.assertEqual(sorted(tables), ["test_judges", "test_words", "wordleai_meta"])
+            rows = ai2.db.execute('SELECT input_id, length(judges) FROM "test_judges"').fetchall()
+            self.assertEqual(rows, [(i, 4) for i in range(4)], msg="one row of packed judges for each input word")
+
+            # the object created before the resetup follows the new vocab
+            ai2.update("sheep", "20100")
+            self.assertEqual(ai.candidates, ai2.candidates)
+            self.assertEqual(ai.evaluate(top_k=4, criterion="mean_n"), ai2.evaluate(top_k=4, criterion="mean_n"))
+            ai.clear_info()
+            self.assertEqual(len(ai.evaluate(top_k=10)), 4)
+            ai.close()
+            ai2.close()
+
+    def test_opening_book(self):
+        words = ["sheep", "shoes", "stage", "store", "style"]
+        with TemporaryDirectory() as d:
+            dbfile = os.path.join(d, "test.db")
+            with WordleAISQLite("test", words, dbfile=dbfile) as ai:
+                for criterion in ("max_n", "mean_n", "mean_entropy"):
+                    res1 = ai.evaluate(top_k=3, criterion=criterion)
+                    self.assertEqual(res1, ai._run_evaluation(top_k=3, criterion=criterion))
+                    self.assertEqual(ai.evaluate(top_k=3, criterion=criterion), res1, msg="lookup from the book")
+                self.assertEqual(ai.db.execute('SELECT count(*) FROM "test_opening"').fetchone()[0], 3 * len(words))
+
+                ai.remove_from_answers(["sheep"])
+                res2 = ai.evaluate(top_k=len(words))
+                self.assertEqual(res2, ai._run_evaluation(top_k=len(words)), msg="book for the nonanswer words")
+                self.assertEqual(sum(row.is_candidate for row in res2), len(words) - 1)
+
+                # book is not used once information is given
+                ai.update("sheep", "20000")
+                self.assertEqual(ai.evaluate(), ai._run_evaluation())
+
+            with WordleAISQLite("test", words[:3], dbfile=dbfile, resetup=True) as ai:
+                res = ai.evaluate(top_k=len(words))
+                self.assertEqual(set(row.input_word for row in res), set(words[:3]), msg="book is invalidated by resetup")
+
+    def test_sql_candidates(self):
+        # candidates computed in SQL must be the same as the ones computed in python
+        words = [a + b + c for a in "abcdef" for b in "abcdef" for c in "abcdef"]
+        with TemporaryDirectory() as d:
+            dbfile = os.path.join(d, "test.db")
+            ai = WordleAISQLite("test", words, dbfile=dbfile)
+            ai2 = WordleAISQLite("test", dbfile=dbfile, sql_candidates=False)
+            for answer, inputs in [("fed", ["abc", "def"]), ("aaa", ["bca", "aab", "cab"]), ("bad", [])]:
+                for x in (ai, ai2):
+                    x.clear_info()
+                    for w in inputs:
+                        x.update(w, decode_judgement(wordle_judge(w, answer)))
+                self.assertEqual(ai.candidates, ai2.candidates)
+                self.assertTrue(answer in ai.candidates)
+                self.assertEqual(ai.evaluate(top_k=len(words)), ai2.evaluate(top_k=len(words)))
+            ai.remove_from_answers(["bad", "abc"])
+            ai2.remove_from_answers(["bad", "abc"])
+            self.assertEqual(ai.candidates, ai2.candidates)
+            self.assertEqual(ai.evaluate(top_k=len(words)), ai2.evaluate(top_k=len(words)))
+            self.assertEqual(ai.db.execute('SELECT count(*) FROM temp."_wordleai_candidate_ids"').fetchone()[0], len(words) - 2)
+
+            # input word out of the vocab is handled in python
+            ai.update("zzz", "000")
+            ai2.update("zzz", "000")
+            self.assertEqual(ai.candidates, ai2.candidates)
+            ai.close()
+            ai2.close()
+
+    def test_workers(self):
+        # parallel evaluation must be the same as the serial one
+        words = [a + b + c for a in "abcdef" for b in "abcdef" for c in "abcdef"]
+        with TemporaryDirectory() as d:
+            dbfile = os.path.join(d, "test.db")
+            _setup(dbfile, "v2", words, schema_version=2)
+            for vocabname in ("v2", "test"):
+                with WordleAISQLite(vocabname, words, dbfile=dbfile, use_opening_book=False) as ai, \
+                     WordleAISQLite(vocabname, dbfile=dbfile, use_opening_book=False, workers=3) as ai2:
+                    for criterion in ("mean_entropy", "max_n"):
+                        self.assertEqual(ai.evaluate(top_k=20, criterion=criterion), ai2.evaluate(top_k=20, criterion=criterion))
+                    for x in (ai, ai2):
+                        x.update("abc", decode_judgement(wordle_judge("abc", "fed")))
+                    self.assertEqual(ai.evaluate(top_k=len(words)), ai2.evaluate(top_k=len(words)))
+                    # threads are used only where SQLite computes the evaluation
+                    self.assertEqual(ai2._executor is not None, ai2.schema_version < 3)
+
+    def test_read_only(self):
+        words = ["sheep", "shoes", "stage", "store", "style"]
+        with TemporaryDirectory() as d:
+            dbfile = os.path.join(d, "test.db")
+            with WordleAISQLite("test", words, dbfile=dbfile, wal=True) as ai:
+                self.assertEqual(ai.db.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+                res = ai.evaluate(top_k=5)
+                ai.update("sheep", "20100")
+                res2 = ai.evaluate(top_k=5)
+            with WordleAISQLite("test", dbfile=dbfile, read_only=True, use_opening_book=False) as ai:
+                self.assertEqual(ai.evaluate(top_k=5), res)
+                ai.update("sheep", "20100")
+                self.assertEqual(ai.candidates, ["stage", "store", "style"])
+                self.assertEqual(ai.evaluate(top_k=5), res2)
+                self.assertRaises(sqlite3.OperationalError, ai.db.execute, 'DELETE FROM "test_words"')
+            self.assertRaises(AssertionError, WordleAISQLite, "test", words, dbfile=dbfile, read_only=True, resetup=True)
+            self.assertRaises(AssertionError, WordleAISQLite, "test2", words, dbfile=dbfile, read_only=True)
+
+    def test_meta(self):
+        words = {"sheep": 1, "shoes": 2, "stage": 0}
+        with TemporaryDirectory() as d:
+            dbfile = os.path.join(d, "test.db")
+            with WordleAISQLite("test", words, dbfile=dbfile) as ai:
+                self.assertEqual(ai._meta["schema_version"], 3)
+                self.assertEqual(ai._meta["wordlen"], 5)
+                self.assertEqual(ai._meta["n_words"], 3)
+                self.assertEqual(ai._meta["weight_defined"], 1)
+                self.assertTrue(ai._meta["build_seconds"] >= 0)
+            with WordleAISQLite("test", dbfile=dbfile) as ai2:
+                self.assertEqual(ai2._meta, ai._meta, msg="read from the metadata table")
+            with WordleAISQLite("test", {"sheep": 1, "shoes": 1, "stage": 1}, dbfile=dbfile, resetup=True) as ai3:
+                self.assertEqual(ai3._meta["words_hash"], ai._meta["words_hash"])
+                self.assertNotEqual(ai3._meta["content_hash"], ai._meta["content_hash"])
+
+            # vocab created before the metadata table is registered on first use
+            with sqlite3.connect(dbfile) as conn:
+                conn.execute('DROP TABLE "wordleai_meta"')
+            with WordleAISQLite("test", dbfile=dbfile) as ai4:
+                self.assertEqual(ai4._meta["content_hash"], ai3._meta["content_hash"])
+                self.assertIsNone(ai4._meta["build_seconds"])
+            rows = sqlite3.connect(dbfile).execute('SELECT backend, vocabname FROM "wordleai_meta"').fetchall()
+            self.assertEqual(rows, [("sqlite", "test")])
+
+    def test_resetup_skip(self):
+        # resetup compares the vocab with the one in the database
+        words = {"sheep": 1, "shoes": 2, "stage": 3}
+        with TemporaryDirectory() as d:
+            dbfile = os.path.join(d, "test.db")
+            with WordleAISQLite("test", words, dbfile=dbfile) as ai:
+                ai.opening_book()
+                meta = ai._meta
+            with WordleAISQLite("test", words, dbfile=dbfile, resetup=True) as ai:
+                self.assertEqual(ai._meta, meta, msg="unchanged vocab is not setup again")
+                self.assertIsNotNone(_read_opening_book(ai.db, ai._opening_table, _opening_book_key(set()), "mean_entropy"))
+            words2 = {"sheep": 0, "shoes": 2, "stage": 3}
+            with WordleAISQLite("test", words2, dbfile=dbfile, resetup=True) as ai:
+                self.assertEqual(ai._meta["build_seconds"], meta["build_seconds"], msg="only weights are updated")
+                self.assertNotEqual(ai._meta["content_hash"], meta["content_hash"])
+                self.assertEqual(dict(ai.db.execute('SELECT word, weight FROM "test_words"').fetchall()), words2)
+                self.assertIsNotNone(_read_opening_book(ai.db, ai._opening_table, _opening_book_key(set()), "mean_entropy"))
+                self.assertTrue(all(ai.choose_answer_word() != "sheep" for _ in range(100)))
+            with WordleAISQLite("test", ["sheep", "shoes", "store"], dbfile=dbfile, resetup=True) as ai:
+                self.assertEqual(ai.words, ["sheep", "shoes", "store"], msg="word list is changed")
+                self.assertIsNone(_read_opening_book(ai.db, ai._opening_table, _opening_book_key(set()), "mean_entropy"))
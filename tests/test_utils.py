@@ -2,9 +2,13 @@
 
 import unittest
 import os
+from unittest import mock
 from tempfile import TemporaryDirectory
 
-from wordleaisql.utils import wordle_judge, decode_judgement, _read_vocabfile, default_wordle_vocab
+from wordleaisql import utils
+
+from wordleaisql.utils import wordle_judge, decode_judgement, _read_vocabfile, default_wordle_vocab, encode_words, wordle_judge_batch, _prep_cpp, _all_wordle_judges_cpp, _load_cpp_lib
+from wordleaisql.utils import judge_stats, _AliasSampler
 
 class TestUtils(unittest.TestCase):
     def test_judge(self):
@@ -21,6 +25,90 @@ class TestUtils(unittest.TestCase):
             r = int(r)
             self.assertEqual(r, int(c[2]), msg="Judge error for {}".format(c))
 
+    def test_judge_batch(self):
+        cases = [
+            ["tacit", "state", "smile", "funny", "aland", "ahead", "error", "peter", "eerie", "geese", "llama", "allay"]
+           ,["一日一善", "一朝一夕", "日日是好", "善善善日"]
+           ,["12", "31", "50", "11"]
+        ]
+        for words in cases:
+            codes = encode_words(words)
+            self.assertEqual(codes.shape, (len(words), len(words[0])))
+            judges = wordle_judge_batch(codes, codes[::-1])
+            self.assertEqual(judges.shape, (len(words), len(words)))
+            for i, input_word in enumerate(words):
+                for j, answer_word in enumerate(words[::-1]):
+                    self.assertEqual(judges[i, j], wordle_judge(input_word, answer_word),
+                                     msg="Batch judge error for ({}, {})".format(input_word, answer_word))
+        # result must not depend on the block size
+        codes = encode_words(cases[0])
+        self.assertTrue((wordle_judge_batch(codes, codes, max_block_size=1) == wordle_judge_batch(codes, codes)).all())
+
+        # the C++ library is not compiled unless requested
+        with mock.patch.object(utils, "_cpp_lib", None), mock.patch.object(utils, "_cpp_lib_failed", False), \
+             mock.patch.object(utils, "_prep_cpp_lib", side_effect=AssertionError("must not compile")):
+            self.assertTrue((wordle_judge_batch(codes, codes) == wordle_judge_batch(codes, codes, use_cpp=False)).all())
+
+    def test_alias_sampler(self):
+        weights = {"a": 1, "b": 0, "c": 3, "d": 0.5, "e": 1.5}
+        sampler = _AliasSampler(weights)
+        # probability of each word is the total of its slots
+        n = len(sampler.words)
+        prob = {w: 0.0 for w in sampler.words}
+        for i, w in enumerate(sampler.words):
+            prob[w] += sampler.prob[i] / n
+            prob[sampler.words[sampler.alias[i]]] += (1 - sampler.prob[i]) / n
+        for w, p in prob.items():
+            self.assertAlmostEqual(p, weights[w] / 6)
+        picked = sampler.sample(1000)
+        self.assertEqual(len(picked), 1000)
+        self.assertTrue("b" not in picked)
+        self.assertRaises(AssertionError, _AliasSampler, {"a": 0})
+
+    def test_judge_cpp(self):
+        words = ["tacit", "state", "smile", "funny", "aland", "ahead", "error", "peter", "eerie", "geese"]
+        execfile = _prep_cpp(words)
+        if execfile is None:
+            return  # c++ enhancement not available in this environment
+        if _load_cpp_lib() is not None:
+            for w in (words, ["一日一善", "一朝一夕", "日日是好", "善善善日"]):
+                codes = encode_words(w)
+                self.assertTrue((wordle_judge_batch(codes, codes, use_cpp=True) == wordle_judge_batch(codes, codes, use_cpp=False)).all(),
+                                msg="C++ library and numpy judges differ for {}".format(w))
+        for binary in (True, False):
+            results = list(_all_wordle_judges_cpp(words, execfile, binary=binary))
+            self.assertEqual(len(results), len(words)**2)
+            for input_word, answer_word, judge in results:
+                self.assertEqual(int(judge), wordle_judge(input_word, answer_word),
+                                 msg="C++ judge error for ({}, {}), binary={}".format(input_word, answer_word, binary))
+
+    def test_judge_cpp_output(self):
+        import io
+        from wordleaisql.utils import _readinto_full, _wordle_judge_blocks_cpp
+        class _ShortReader(io.RawIOBase):
+            # returns at most 3 bytes at a time, like a pipe
+            def __init__(self, data):
+                self.data = data
+            def readinto(self, b):
+                n = min(3, len(b), len(self.data))
+                b[:n], self.data = self.data[:n], self.data[n:]
+                return n
+        buf = bytearray(10)
+        self.assertEqual(_readinto_full(_ShortReader(b"0123456789abc"), memoryview(buf)), 10)
+        self.assertEqual(bytes(buf), b"0123456789")
+        self.assertEqual(_readinto_full(_ShortReader(b"01234"), memoryview(buf)), 5)
+
+        # truncated output is reported with the stderr of the script
+        if os.name != "posix":
+            return
+        with TemporaryDirectory() as d:
+            execfile = os.path.join(d, "fake")
+            with open(execfile, "w") as f:
+                f.write("#!/bin/sh\necho 'out of memory' >&2\nprintf 'abc'\n")
+            os.chmod(execfile, 0o755)
+            with self.assertRaisesRegex(RuntimeError, "out of memory"):
+                list(_wordle_judge_blocks_cpp(["ab", "cd"], execfile))
+
     def test_default_vocab(self):
         x = default_wordle_vocab()  # okay if this works with no error
         #raise
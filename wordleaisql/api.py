@@ -11,6 +11,7 @@ from .base import WordleAI
 from .utils import show_word_evaluations, default_wordle_vocab, _timereport, wordle_judge, decode_judgement, _read_vocabfile
 from .sqlite import WordleAISQLite
 from .approx import WordleAIApprox
+from .cache import EvaluationCache
 from . import __version__
 
 def interactive(ai: WordleAI, num_suggest: int=10, default_criterion: str="mean_entropy"):
@@ -290,18 +291,45 @@ def challenge(ai: WordleAI, answer_weight: bool=True, max_round: int=20, visible
 
 def main():
     parser = ArgumentParser(description="Wordle AI with SQL backend", formatter_class=ArgumentDefaultsHelpFormatter)
-    parser.add_argument("-b", "--backend", type=str, default="approx", choices=["sqlite", "approx", "bq", "random"], help="AI type")
+    parser.add_argument("-b", "--backend", type=str, default="approx", choices=["sqlite", "approx", "matrix", "bq", "random"], help="AI type")
     parser.add_argument("--vocabname", default=None, type=str, help="Name of vocabulary")
     parser.add_argument("--vocabfile", type=str, help="Text file containing words. If not supplied, default wordle vocab is used")
-    parser.add_argument("--resetup", action="store_true", help="Setup the vocabulary if already exists")
+    parser.add_argument("--resetup", action="store_true", help="Setup the vocabulary again if already exists and the words have changed")
     parser.add_argument("--sqlitefile", type=str, 
                         help=("SQLite database file. If not supplied, we first search env variable 'WORDLEAISQL_DBFILE'. "
                               "If the env variable is not defined, then ./wordleai.db is used"))
+    parser.add_argument("--matrixdir", type=str,
+                        help=("Directory of the judge matrix files for `-b matrix`. If not supplied, we first search env variable "
+                              "'WORDLEAISQL_MATRIXDIR'. If the env variable is not defined, then ./wordleai-matrix is used"))
     parser.add_argument("--inmemory", action="store_true", help="Use in-memory database. Only applicable with `-b approx`")
-    parser.add_argument("--word_pair_limit", type=int, default=500000,
+    parser.add_argument("--sqlite_pragma", type=str, action="append", metavar="KEY=VALUE",
+                        help="SQLite pragma applied to the database connections, e.g. `--sqlite_pragma cache_size=-131072`. Can be repeated")
+    parser.add_argument("--read_only", action="store_true",
+                        help="Open the prebuilt database as a read-only immutable file, to be shared by many processes. Only applicable with `-b sqlite` and `-b approx`")
+    parser.add_argument("--wal", action="store_true",
+                        help="Use the write-ahead log for the database, so that readers are not blocked by a writer. Only applicable with `-b sqlite` and `-b approx`")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of threads to evaluate input words in parallel. Only applicable with `-b approx` and `-b sqlite`, "
+                             "where it has no effect for the default packed schema (version 3)")
+    parser.add_argument("--word_pair_limit", type=int, default=20000000,
                         help="Maximum number of (input word, answer word) pairs computed for approximate evaluation")
+    parser.add_argument("--approx_engine", type=str, default="numpy", choices=("numpy", "sqlite"),
+                        help="Where the judges are computed for approximate evaluation, in process by numpy or in SQLite")
     parser.add_argument("--candidate_samplesize", type=int, default=500,
                         help="Sample size of answer word for approximate evaluation")
+    parser.add_argument("--approx_sampling", type=str, default="fixed", choices=("fixed", "adaptive"),
+                        help=("How word pairs are sampled for approximate evaluation. "
+                              "'adaptive' samples answer words in increments until the top words are separated from the others"))
+    parser.add_argument("--time_limit", type=float, help="Time limit of an evaluation in seconds for `--approx_sampling adaptive`")
+    parser.add_argument("--seed", type=int,
+                        help="Seed of the word sampling for approximate evaluation, so that the same state gives the same evaluation")
+    parser.add_argument("--judge_cache_size", type=int, default=0,
+                        help="Number of answer words whose judges are kept in memory and reused for approximate evaluation. If 0, not cached")
+    parser.add_argument("--judge_cache_db_size", type=int, default=0,
+                        help="Number of answer words whose judges are also kept in the database for approximate evaluation. If 0, not stored")
+    parser.add_argument("--eval_cache_file", type=str,
+                        help="SQLite database file to keep evaluation results across sessions. If not supplied, results are not cached")
+    parser.add_argument("--eval_cache_size", type=int, default=256, help="Number of evaluation results cached in memory")
     parser.add_argument("--bq_credential", type=str, help="Credential json file for a GCP service client")
     parser.add_argument("--bq_project", type=str, help="GCP project id (if not supplied, inferred from the credential default)")
     parser.add_argument("--bq_location", type=str, default="US", help="GCP location")
@@ -327,6 +355,7 @@ def main():
     parser.add_argument("--no_cpp", action="store_true", help="Not to use C++ script even if available")
     parser.add_argument("--cpp_recompile", action="store_true", help="Compile the C++ script again even if the source script is not updated")
     parser.add_argument("--cpp_compiler", type=str, help="Command name of the C++ compiler")
+    parser.add_argument("--cpp_threads", type=int, help="Number of threads for the C++ precomputation. If not supplied, all hardware threads are used")
 
     parser.add_argument("--debug", action="store_true", help="Show debug messages")
     parser.add_argument("--version", action="store_true", help="Show the program version")
@@ -362,22 +391,45 @@ def main():
                 print("Thank you!")
                 return
 
+    sqlite_pragmas = None
+    if args.sqlite_pragma is not None:
+        sqlite_pragmas = dict(p.split("=", 1) for p in args.sqlite_pragma)
+
+    evaluation_cache = None
+    if args.eval_cache_file is not None:
+        evaluation_cache = EvaluationCache(maxsize=args.eval_cache_size, dbfile=args.eval_cache_file)
+
     if args.backend == "sqlite":
         if args.inmemory:
             logger.warning("`--inmemory` only applicable with `-b approx`")
-        ai = WordleAISQLite(vocabname, words, dbfile=args.sqlitefile, resetup=args.resetup,
+        ai = WordleAISQLite(vocabname, words, dbfile=args.sqlitefile, sqlite_pragmas=sqlite_pragmas, resetup=args.resetup,
+                            evaluation_cache=evaluation_cache, workers=args.workers,
+                            read_only=args.read_only, wal=args.wal,
                             decision_metric=args.decision_metric, candidate_weight=args.candidate_weight, strength=args.ai_strength,
-                            use_cpp=(not args.no_cpp), cpp_recompile=args.cpp_recompile, cpp_compiler=args.cpp_compiler)
+                            use_cpp=(not args.no_cpp), cpp_recompile=args.cpp_recompile, cpp_compiler=args.cpp_compiler,
+                            cpp_threads=args.cpp_threads)
         logger.info("SQLite database: '%s', vocabname: '%s'", ai.dbfile, ai.vocabname)
     elif args.backend == "approx":
-        ai = WordleAIApprox(vocabname, words, dbfile=args.sqlitefile, inmemory=args.inmemory, resetup=args.resetup,
-                            word_pair_limit=args.word_pair_limit, candidate_samplesize=args.candidate_samplesize,
+        ai = WordleAIApprox(vocabname, words, dbfile=args.sqlitefile, inmemory=args.inmemory, sqlite_pragmas=sqlite_pragmas,
+                            resetup=args.resetup, evaluation_cache=evaluation_cache, workers=args.workers,
+                            read_only=args.read_only, wal=args.wal,
+                            word_pair_limit=args.word_pair_limit, candidate_samplesize=args.candidate_samplesize, engine=args.approx_engine,
+                            sampling=args.approx_sampling, time_limit=args.time_limit,
+                            judge_cache_size=args.judge_cache_size, judge_cache_db_size=args.judge_cache_db_size, seed=args.seed,
+                            use_cpp=(not args.no_cpp), cpp_recompile=args.cpp_recompile, cpp_compiler=args.cpp_compiler,
                             decision_metric=args.decision_metric, candidate_weight=args.candidate_weight, strength=args.ai_strength)
         logger.info("SQLite database: '%s', word pair limit: %d, answer word sample size: %d, vocabname: '%s'",
                     ai.dbfile, ai.word_pair_limit, ai.candidate_samplesize, ai.vocabname)
+    elif args.backend == "matrix":
+        from .matrix import WordleAIMatrix
+        ai = WordleAIMatrix(vocabname, words, matrixdir=args.matrixdir, resetup=args.resetup, evaluation_cache=evaluation_cache,
+                            decision_metric=args.decision_metric, candidate_weight=args.candidate_weight, strength=args.ai_strength,
+                            use_cpp=(not args.no_cpp), cpp_recompile=args.cpp_recompile, cpp_compiler=args.cpp_compiler,
+                            cpp_threads=args.cpp_threads)
+        logger.info("Matrix directory: '%s', vocabname: '%s'", ai.matrixdir, ai.vocabname)
     elif args.backend == "bq":
         from .bigquery import WordleAIBigquery
-        ai = WordleAIBigquery(vocabname, words, resetup=args.resetup,
+        ai = WordleAIBigquery(vocabname, words, resetup=args.resetup, evaluation_cache=evaluation_cache,
                               credential_jsonfile=args.bq_credential, project=args.bq_project,
                               location=args.bq_location, partition_size=args.partition_size,
                               decision_metric=args.decision_metric, candidate_weight=args.candidate_weight, strength=args.ai_strength)
@@ -4,9 +4,14 @@
 SQLite backend with no precomputation.
 
 A quick version where the judge results are not precomputed.
+Judges of the sampled word pairs are computed in process by the vectorized kernel,
+or in SQLite by the registered judge function.
 
-Only table created:
+Tables created:
     {vocabname}_words_approx   : contains all words
+    {vocabname}_opening_approx : opening book, evaluation results of all words at the first turn (created on first use)
+    {vocabname}_judgecache_approx : judges of answer words against all input words, computed on demand (created on first use)
+    wordleai_meta              : metadata of the vocabs, shared with the other SQLite backends
 """
 
 import os
@@ -14,19 +19,33 @@ import sys
 import math
 import random
 import sqlite3
+import time
+import threading
+from collections import OrderedDict
 from contextlib import contextmanager
 from logging import getLogger
 logger = getLogger(__name__)
 
-from .utils import WordEvaluation, wordle_judge, _read_vocabfile, _dedup
-from .sqlite import WordleAISQLite
+import numpy as np
+
+from .utils import WordEvaluation, wordle_judge, _read_vocabfile, _dedup, \
+                   encode_words, wordle_judge_batch, judge_stats, _load_cpp_lib
+from .cache import EvaluationCache
+from .sqlite import WordleAISQLite, _init_connection as _init_sqlite_connection, _fill_temp_words, _vocab_meta, _write_meta, \
+                    _vocab_change, _update_weights, _packed_dtype
+
+def _init_connection(conn: sqlite3.Connection, pragmas: dict=None)-> sqlite3.Connection:
+    # judge function is computed on the fly in this backend
+    _init_sqlite_connection(conn, pragmas)
+    conn.create_function("WordleJudge", 2, wordle_judge)
+    return conn
 
 @contextmanager
 def _connect(db: str or sqlite3.Connection)-> sqlite3.Connection:
     if type(db) == sqlite3.Connection:
         yield db
     elif type(db) == str:
-        conn = sqlite3.connect(db)
+        conn = _init_connection(sqlite3.connect(db))
         try:
             yield conn
         finally:
@@ -38,10 +57,13 @@ def _setup(db: str or sqlite3.Connection, vocabname: str, words: list or dict):
     assert len(words) == len(set(words)), "input_words must be unique"
     wordlens = set(len(w) for w in words)
     assert len(wordlens) == 1, "word length must be equal, but '{}'".format(wordlens)
+    starttime = time.time()
     #with sqlite3.connect(dbfile) as conn:
     with _connect(db) as conn:
         c = conn.cursor()
         c.execute('DROP TABLE IF EXISTS "{name}_words_approx"'.format(name=vocabname))
+        c.execute('DROP TABLE IF EXISTS "{name}_opening_approx"'.format(name=vocabname))  # opening book is no longer valid
+        c.execute('DROP TABLE IF EXISTS "{name}_judgecache_approx"'.format(name=vocabname))  # word ids are no longer valid
         c.execute('CREATE TABLE "{name}_words_approx" (word TEXT PRIMARY KEY, weight FLOAT)'.format(name=vocabname))
         params = (
             words.items() if isinstance(words, dict) else
@@ -52,6 +74,7 @@ def _setup(db: str or sqlite3.Connection, vocabname: str, words: list or dict):
             raise TypeError("Unsupported type of `words`, '{}'".format(type(words)))
         c.executemany('INSERT INTO "{name}_words_approx" VALUES (?,?)'.format(name=vocabname), params)
         c.execute('CREATE INDEX "{name}_words_approx_idx" ON "{name}_words_approx" (word)'.format(name=vocabname))
+        _write_meta(conn, _vocab_meta("approx", vocabname, 1, dict(params), build_seconds=time.time()-starttime))
         conn.commit()
 
 # def _ensure_word_weight_column(dbfile: str, vocabname: str):
@@ -68,84 +91,184 @@ def _setup(db: str or sqlite3.Connection, vocabname: str, words: list or dict):
 #             logger.info('Filled `"%s_words_approx".weight` with ones', vocabname)
 #         conn.commit()
 
-def _evaluate(db: str or sqlite3.Connection, vocabname: str, top_k: int=20, criterion: str="mean_entropy", candidates: list=None,
-              word_pair_limit: int=500000, candidate_samplesize: int=500)-> list:
+def _read_judge_columns(db: str or sqlite3.Connection, tablename: str, answer_ids: list, dtype: np.dtype)-> dict:
+    # judge columns stored in the judge cache table, as {answer_id: judges of all input words}
+    out = {}
+    with _connect(db) as conn:
+        c = conn.cursor()
+        c.execute("SELECT count(*) FROM sqlite_master WHERE type = 'table' AND name = ?", (tablename,))
+        if c.fetchone()[0] == 0:
+            return out
+        for start in range(0, len(answer_ids), 500):  # not to exceed the limit of bound parameters
+            ids = answer_ids[start:(start+500)]
+            c.execute('SELECT answer_id, judges FROM "{name}" WHERE answer_id IN ({params})'.format(
+                name=tablename, params=",".join("?" * len(ids))), ids)
+            out.update((a, np.frombuffer(blob, dtype=dtype)) for a, blob in c)
+        if out:
+            c.executemany('UPDATE "{name}" SET last_used = ? WHERE answer_id = ?'.format(name=tablename),
+                          ((time.time(), a) for a in out))
+        conn.commit()
+    return out
+
+def _write_judge_columns(db: str or sqlite3.Connection, tablename: str, columns: dict, dtype: np.dtype, maxsize: int):
+    # store judge columns into the judge cache table, removing the least recently used ones beyond `maxsize`
+    with _connect(db) as conn:
+        c = conn.cursor()
+        c.execute('CREATE TABLE IF NOT EXISTS "{name}" (answer_id INTEGER PRIMARY KEY, judges BLOB NOT NULL, last_used FLOAT)'.format(
+            name=tablename))
+        now = time.time()
+        c.executemany('INSERT OR REPLACE INTO "{name}" VALUES (?,?,?)'.format(name=tablename),
+                      ((a, col.astype(dtype).tobytes(), now) for a, col in columns.items()))
+        c.execute('SELECT count(*) FROM "{name}"'.format(name=tablename))
+        n = c.fetchone()[0]
+        if n > maxsize:
+            c.execute('DELETE FROM "{name}" WHERE answer_id IN (SELECT answer_id FROM "{name}" ORDER BY last_used LIMIT ?)'.format(
+                name=tablename), (n - maxsize,))
+            logger.debug("Removed %d columns from the judge cache", n - maxsize)
+        conn.commit()
+
+class _JudgeCache:
+    """
+    Judges of answer words against all input words, computed on demand
+
+    Judges are kept by answer word, as a column of the judges of all input words.
+    Columns are computed when all or most input words are evaluated, and reused for any subset of input words.
+
+    Args:
+        codes (2-D integer array):
+            All words encoded by `encode_words`, where the word id is the row index
+        maxsize (int):
+            Maximum number of columns kept in the process
+        db (callable):
+            Function returning the database connection for the persistent tier. If None, columns are only kept in the process
+        tablename (str):
+            Table of the persistent tier
+        db_maxsize (int):
+            Maximum number of columns kept in the table
+    """
+    def __init__(self, codes: np.ndarray, maxsize: int=2000, db=None, tablename: str=None, db_maxsize: int=20000):
+        assert maxsize > 0, "maxsize must be positive"
+        self.codes = codes
+        self.maxsize = maxsize
+        self.db = db
+        self.tablename = tablename
+        self.db_maxsize = db_maxsize
+        self.dtype = _packed_dtype(codes.shape[1])
+        self._columns = OrderedDict()  # answer_id -> judges of all input words
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def judges(self, input_ids: np.ndarray, answer_ids: np.ndarray)-> np.ndarray:
+        """Judge matrix of shape (len(input_ids), len(answer_ids))"""
+        # computing the full columns costs at most twice if most input words are involved
+        answer_list = answer_ids.tolist()
+        columns = self.fill(answer_ids) if 2 * len(input_ids) >= self.codes.shape[0] else self._get(answer_list)
+        missing = [j for j, a in enumerate(answer_list) if a not in columns]
+        out = np.empty((len(input_ids), len(answer_ids)), dtype=self.dtype)
+        for j, a in enumerate(answer_list):
+            if a in columns:
+                out[:, j] = columns[a][input_ids]
+        if len(missing) > 0:
+            # only a few input words are involved, so the missing judges are computed for them and not kept
+            out[:, missing] = wordle_judge_batch(self.codes[input_ids], self.codes[answer_ids[missing]])
+        return out
+
+    def fill(self, answer_ids: np.ndarray)-> dict:
+        """Compute and keep the columns of the answer words not in the cache, and return the columns of all of them"""
+        columns = self._get(answer_ids.tolist())
+        ids = np.array(sorted(set(answer_ids.tolist()) - set(columns)), dtype=np.int64)
+        if len(ids) > 0:
+            computed = wordle_judge_batch(self.codes, self.codes[ids])
+            new = {a: computed[:, j].copy() for j, a in enumerate(ids.tolist())}
+            self._put(new)
+            columns.update(new)
+        return columns
+
+    def _get(self, answer_ids: list)-> dict:
+        with self._lock:
+            out = {a: self._columns[a] for a in answer_ids if a in self._columns}
+            for a in out:
+                self._columns.move_to_end(a)
+        if self.db is not None and len(out) < len(answer_ids):
+            stored = _read_judge_columns(self.db(), self.tablename, [a for a in answer_ids if a not in out], self.dtype)
+            with self._lock:
+                self._put_memory(stored)
+            out.update(stored)
+        with self._lock:
+            self.hits += len(out)
+            self.misses += len(set(answer_ids)) - len(out)
+        return out
+
+    def _put(self, columns: dict):
+        with self._lock:
+            self._put_memory(columns)
+        if self.db is not None:
+            _write_judge_columns(self.db(), self.tablename, columns, self.dtype, self.db_maxsize)
+
+    def _put_memory(self, columns: dict):
+        for a, col in columns.items():
+            self._columns[a] = col
+            self._columns.move_to_end(a)
+        while len(self._columns) > self.maxsize:
+            self._columns.popitem(last=False)  # least recently used
+
+def _sample_words(allwords: list, candidates: list, word_pair_limit: int=20000000, candidate_samplesize: int=500,
+                  rng: random.Random=None)-> tuple:
+    # choose input and answer words to conduct approx, smaller optimization
+    # returns (input_words, answer_words), where None means all words are used
+    # words are sampled by `rng` if given, otherwise by the global random module
+    rng = random if rng is None else rng
     assert candidate_samplesize > 0
     assert word_pair_limit > candidate_samplesize
-    allwords = _words(db, vocabname)  # get all words
-
     n_words = len(allwords)
     n_candidates = n_words if candidates is None else len(candidates)
     candidate_samplesize = min(candidate_samplesize, n_candidates)  # can only upto the population size
-    # make filters to input and answer words to conduct approx, smaller optimization
     if n_words * n_candidates <= word_pair_limit:
         # within the size limit, no need for approximation
         logger.debug("No approximation needed (input words: %d, candidates: %d)", n_words, n_candidates)
-        inputfilter = ""
-        params1 = ()
-        if candidates is None:
-            answerfiler = ""
-            params2 = ()
-        else:
-            answerfilter = "WHERE word IN ({})".format(",".join("?" * n_candidates))
-            params2 = tuple(candidates)
-        params = tuple(params1) + tuple(params2)
-    elif n_words * candidate_samplesize <= word_pair_limit:
+        input_words = None
+        answer_words = candidates
+    else:
         # need approximation, and
         # we can reduce the problem size by sampling the answer words only
+        # larger problems are handled by the successive halving, see `_evaluate_sampled`
+        assert n_words * candidate_samplesize <= word_pair_limit, \
+            "input words cannot be sampled, use the successive halving instead"
         n_candidates2 = int(word_pair_limit / n_words)  # candidate sample size
         logger.debug("Approximation with candidate sampling (input words: %d, candidates: %d -> %d)",
                      n_words, n_candidates, n_candidates2)
-        answerfilter = "WHERE word IN ({})".format(",".join("?" * n_candidates2))
-        params2 = random.sample(allwords if candidates is None else candidates, n_candidates2)
-        inputfilter = ""
-        params1 = ()
-        params = tuple(params1) + tuple(params2)
-    else:
-        # need approximation, and need input words sampling
-        n_words2 = int(word_pair_limit / candidate_samplesize)
-        inputfilter = "WHERE word IN ({})".format(",".join("?" * n_words2))
-        params1 = random.sample(allwords, n_words2)
-        if candidate_samplesize == n_candidates:
-            logger.debug("Approximation with input word sampling (input words: %d -> %d, candidates: %d)",
-                         n_words, n_words2, candidate_samplesize)
-            if candidates is None:
-                answerfiler = ""
-                params2 = ()
-            else:
-                answerfilter = "WHERE word IN ({})".format(",".join("?" * n_candidates))
-                params2 = tuple(candidates)
-        else:
-            logger.debug("Approximation with input word and candidate sampling (input words: %d -> %d, candidates: %d -> %d)",
-                         n_words, n_words2, n_candidates, candidate_samplesize)
-            answerfilter = "WHERE word IN ({})".format(",".join("?" * candidate_samplesize))
-            params2 = random.sample(allwords if candidates is None else candidates, candidate_samplesize)
-        params = tuple(params1) + tuple(params2)
+        input_words = None
+        answer_words = rng.sample(allwords if candidates is None else candidates, n_candidates2)
+    return input_words, answer_words
 
+def _evaluate_words(db: str or sqlite3.Connection, vocabname: str, input_words: list=None, answer_words: list=None,
+                    candidates: list=None)-> list:
+    # evaluation rows of the input words against the answer words, where None means all words
 #    with sqlite3.connect(dbfile) as conn:
     with _connect(db) as conn:
-        conn.create_function("log2", 1, math.log2)
-        conn.create_function("WordleJudge", 2, wordle_judge)
         c = conn.cursor()
+        # filter words by the temporary tables, so the query size does not grow with the number of words
+        inputfilter = ""
+        answerfilter = ""
+        if input_words is not None:
+            _fill_temp_words(conn, "_wordleai_inputs", input_words)
+            inputfilter = 'WHERE word IN (SELECT word FROM temp."_wordleai_inputs")'
+        if answer_words is not None:
+            _fill_temp_words(conn, "_wordleai_answers", answer_words)
+            answerfilter = 'WHERE word IN (SELECT word FROM temp."_wordleai_answers")'
 
+        # judges are computed once for each word pair and counted by SQLite,
+        # so that the metrics are returned as native numbers
         q = """
-        with judges AS (
+        with tmp AS (
           SELECT
             a.word AS input_word,
-            b.word AS answer_word,
-            WordleJudge(a.word, b.word) AS judge
+            WordleJudge(a.word, b.word) AS judge,
+            count(*) AS n
           FROM
             (SELECT word FROM {vocabname}_words_approx {inputfilter}) AS a,
             (SELECT word FROM {vocabname}_words_approx {answerfilter}) AS b
-        ),
-        tmp AS (
-          SELECT
-            input_word,
-            judge,
-            count(*) AS n,
-            log2(count(*)) AS entropy
-          FROM
-            "judges"
           GROUP BY
             input_word, judge
         )
@@ -153,21 +276,195 @@ def _evaluate(db: str or sqlite3.Connection, vocabname: str, top_k: int=20, crit
           input_word,
           max(n) AS max_n,
           1.0 * sum(n*n) / sum(n) AS mean_n,
-          sum(n*entropy) / sum(n) AS mean_entropy
+          sum(n*log2(n)) / sum(n) AS mean_entropy
         FROM
           tmp
         GROUP BY
-          input_word    
+          input_word
         """.format(vocabname=vocabname, inputfilter=inputfilter, answerfilter=answerfilter)
         #print(q)
-        #print(len(params1), len(params2))
-        #print(s)
-        if len(params)==0:
-            c.execute(q)
-        else:
-            c.execute(q, params)
+        c.execute(q)
         candidate_set = None if candidates is None else set(candidates)
-        out = {row[0]: row + (1 if candidate_set is None else int(row[0] in candidate_set),) for row in c}
+        out = [row + (1 if candidate_set is None else int(row[0] in candidate_set),) for row in c]
+    return out
+
+def _evaluate_words_numpy(allwords: list, codes: np.ndarray, input_words: list=None, answer_words: list=None,
+                          candidates: list=None, block_size: int=2**22, judge_cache: _JudgeCache=None)-> list:
+    # same as `_evaluate_words`, where the judges are computed in process by the vectorized kernel
+    # and counted by bincount for each input word
+    # codes are the output of `encode_words(allwords)`
+    # if judge_cache is given, judges are looked up from it for all input words at once
+    index = {w: i for i, w in enumerate(allwords)}
+    input_ids = np.arange(len(allwords)) if input_words is None else np.array([index[w] for w in input_words], dtype=np.int64)
+    answer_ids = np.arange(len(allwords)) if answer_words is None else np.array([index[w] for w in answer_words], dtype=np.int64)
+    if len(answer_ids) == 0:
+        return []
+    answer_codes = codes[answer_ids]
+    n_codes = 3**codes.shape[1]
+    candidate_set = None if candidates is None else set(candidates)
+    out = []
+    if judge_cache is not None:
+        blocks = [(input_ids, judge_cache.judges(input_ids, answer_ids))]
+    else:
+        rows = max(1, block_size // len(answer_ids))  # input words judged at once, to limit the memory usage
+        blocks = ((input_ids[start:(start+rows)], None) for start in range(0, len(input_ids), rows))
+    for block, judges in blocks:
+        if judges is None:
+            judges = wordle_judge_batch(codes[block], answer_codes)
+        max_n, mean_n, mean_entropy = judge_stats(judges, n_codes)
+        for i, a, b, e in zip(block.tolist(), max_n, mean_n, mean_entropy):
+            w = allwords[i]
+            out.append((w, int(a), float(b), float(e), 1 if candidate_set is None else int(w in candidate_set)))
+    return out
+
+def _count_metrics(counts: np.ndarray, m: np.ndarray, n_candidates: int)-> tuple:
+    # metrics estimated from the judge counts of each input word over its `m` sampled answers,
+    # scaled to `n_candidates` answers so that words with different sample sizes are comparable
+    # returns (estimates, variances), each a tuple of max_n, mean_n and mean_entropy arrays
+    m = np.asarray(m, dtype=np.float64)
+    logm = np.log2(np.maximum(m, 1))
+    log_table = np.log2(np.maximum(np.arange(int(m.max()) + 1), 1))  # log2 of counts by lookup
+    c = counts.astype(np.float64)
+    logc = log_table[counts]
+    max_p = counts.max(axis=1) / m
+    sum_p2 = (c * c).sum(axis=1) / m**2
+    sum_p3 = (c * c * c).sum(axis=1) / m**3
+    clogc = c * logc
+    sum_plogp = clogc.sum(axis=1) / m - logm
+    sum_plogp2 = (clogc * logc).sum(axis=1) / m - 2 * logm * (sum_plogp + logm) + logm**2
+    # each sampled answer contributes the share (or log share) of its judge, so the variance is that of the contributions
+    # finite population correction makes the variance zero when all candidates are sampled
+    fpc = np.maximum(n_candidates - m, 0) / max(n_candidates - 1, 1) / np.maximum(m, 1)
+    var_max = max_p * (1 - max_p) * fpc
+    var_mean = np.maximum(sum_p3 - sum_p2**2, 0) * fpc
+    var_entropy = np.maximum(sum_plogp2 - sum_plogp**2, 0) * fpc
+    estimates = (n_candidates * max_p, n_candidates * sum_p2, math.log2(n_candidates) + sum_plogp)
+    variances = (n_candidates**2 * var_max, n_candidates**2 * var_mean, var_entropy)
+    return estimates, variances
+
+def _evaluate_words_adaptive(allwords: list, codes: np.ndarray, candidates: list=None, criterion: str="mean_entropy",
+                             top_k: int=10, word_pair_limit: int=20000000, batch_size: int=500, z: float=3.0,
+                             time_limit: float=None, min_samples: int=30, block_size: int=2**22,
+                             judge_cache: _JudgeCache=None, rng: random.Random=None)-> tuple:
+    # evaluate all input words against answers sampled in increments of `batch_size`
+    # returns (rows, whether stopped by the time limit)
+    # after each increment, input words whose lower confidence bound is worse than the top_k-th best upper bound are dropped
+    # stops when only top_k words remain, all candidates are sampled, or the pair or time budget is used up
+    # words are not dropped until `min_samples` answers are sampled, since the variances are unreliable for tiny samples
+    starttime = time.time()
+    rng = random if rng is None else rng
+    candidates = allwords if candidates is None else candidates
+    n_words = len(allwords)
+    n_candidates = len(candidates)
+    n_codes = 3**codes.shape[1]
+    if n_candidates == 0:
+        return [], False
+    index = {w: i for i, w in enumerate(allwords)}
+    answer_ids = np.array([index[w] for w in rng.sample(candidates, n_candidates)], dtype=np.int64)  # order of sampling
+    counts = np.zeros((n_words, n_codes), dtype=np.int32)
+    m = np.zeros(n_words, dtype=np.int64)  # number of sampled answers of each input word
+    active = np.arange(n_words)
+    metric = {"max_n": 0, "mean_n": 1, "mean_entropy": 2}[criterion]
+    top_k = min(top_k, n_words)
+    n_sampled = 0
+    pairs = 0
+    timeout = False
+    step = max(1, batch_size // 4)
+    while True:
+        # increments start small so that clear winners are found quickly, and double up to batch_size
+        size = min(step, n_candidates - n_sampled, (word_pair_limit - pairs) // len(active))
+        if size <= 0:
+            break
+        batch = answer_ids[n_sampled:(n_sampled+size)]
+        rows = max(1, block_size // max(size, n_codes))
+        for start in range(0, len(active), rows):
+            block = active[start:(start+rows)]
+            judges = (wordle_judge_batch(codes[block], codes[batch]) if judge_cache is None else
+                      judge_cache.judges(block, batch)).astype(np.int64)
+            keys = (judges + (np.arange(len(block), dtype=np.int64) * n_codes)[:, None]).ravel()
+            counts[block] += np.bincount(keys, minlength=len(block)*n_codes).reshape(len(block), n_codes).astype(np.int32)
+        m[active] += size
+        n_sampled += size
+        pairs += len(active) * size
+        step = min(step * 2, batch_size)
+        if n_sampled >= n_candidates:
+            break
+        if n_sampled < min_samples:
+            continue
+        estimates, variances = _count_metrics(counts[active], m[active], n_candidates)
+        se = z * np.sqrt(variances[metric])
+        threshold = np.partition(estimates[metric] + se, top_k - 1)[top_k - 1]
+        active = active[estimates[metric] - se <= threshold]
+        logger.debug("Adaptive sampling: %d answers sampled, %d input words remain", n_sampled, len(active))
+        if len(active) <= top_k:
+            break
+        if time_limit is not None and time.time() - starttime > time_limit:
+            logger.debug("Adaptive sampling stopped by the time limit")
+            timeout = True
+            break
+    logger.debug("Adaptive sampling finished with %d answers sampled and %d word pairs judged", n_sampled, pairs)
+    if n_sampled == 0:
+        return [], timeout  # budget is too small to judge all input words once
+
+    estimates, _ = _count_metrics(counts, m, n_candidates)
+    candidate_set = set(candidates)
+    out = [(w, int(round(a)), float(b), float(e), int(w in candidate_set))
+           for w, a, b, e in zip(allwords, *(x.tolist() for x in estimates))]
+    return out, timeout
+
+def _halving_schedule(n_words: int, n_candidates: int, word_pair_limit: int=20000000, candidate_samplesize: int=500)-> list:
+    # rounds of the successive halving, as the list of (number of input words, answer sample size)
+    # the budget is split equally into the rounds, and the number of rounds is the smallest
+    # such that the last round samples at least `candidate_samplesize` answers
+    candidate_samplesize = min(candidate_samplesize, n_candidates)
+    n_rounds = 1
+    while True:
+        sizes = [-(-n_words // 2**r) for r in range(n_rounds)]
+        samplesizes = [min(n_candidates, max(1, word_pair_limit // n_rounds // n)) for n in sizes]
+        if samplesizes[-1] >= candidate_samplesize or sizes[-1] == 1:
+            return list(zip(sizes, samplesizes))
+        n_rounds += 1
+
+def _scale_row(row: tuple, samplesize: int, n_candidates: int)-> tuple:
+    # metrics computed on the answer sample, scaled to the number of candidates
+    # same scale as the estimates of the adaptive sampling by `_count_metrics`
+    if samplesize == n_candidates:
+        return tuple(row)
+    r = n_candidates / samplesize
+    return (row[0], int(round(row[1] * r)), row[2] * r, row[3] + math.log2(r), row[4])
+
+def _evaluate_halving(evaluate_words, allwords: list, candidates: list=None, criterion: str="mean_entropy",
+                      word_pair_limit: int=20000000, candidate_samplesize: int=500, rng: random.Random=None)-> list:
+    # successive halving over all input words
+    # all words are evaluated on a small answer sample, then the better half are evaluated again on a larger sample, and so on
+    # answer samples are nested, and words are compared across rounds
+    # `evaluate_words(input_words, answer_words)` returns the evaluation rows scaled to the number of candidates
+    rng = random if rng is None else rng
+    n_candidates = len(allwords) if candidates is None else len(candidates)
+    if n_candidates == 0:
+        return []
+    answers = rng.sample(allwords if candidates is None else candidates, n_candidates)  # samples are the prefixes
+    metric = WordEvaluation._fields.index(criterion)
+    out = {}
+    survivors = allwords
+    for n_words, samplesize in _halving_schedule(len(allwords), n_candidates, word_pair_limit=word_pair_limit,
+                                                 candidate_samplesize=candidate_samplesize):
+        if n_words < len(survivors):
+            ranked = sorted((out[w] for w in survivors), key=lambda row: (row[metric], -row[4]))
+            survivors = [row[0] for row in ranked[:n_words]]
+        logger.debug("Successive halving (input words: %d, candidates: %d -> %d)", len(survivors), n_candidates, samplesize)
+        for row in evaluate_words(survivors, answers[:samplesize]):
+            out[row[0]] = row
+        if samplesize == n_candidates:
+            break  # survivors are evaluated exactly
+    return list(out.values())
+
+def _top_evaluations(rows: list, allwords: list, candidates: list=None, top_k: int=20, criterion: str="mean_entropy")-> list:
+    if top_k is None:
+        top_k = len(allwords)
+    n_candidates = len(allwords) if candidates is None else len(candidates)
+    candidate_set = None if candidates is None else set(candidates)
+    out = {row[0]: row for row in sorted(rows)}  # in the order of input words regardless of how rows are computed
     # we pad random evals is there are insufficient rows
     # for padded words, we assign the worst possible values for max_n, mean_n, mean_entropy
     defaults = (n_candidates, n_candidates, math.log2(n_candidates))
@@ -176,12 +473,40 @@ def _evaluate(db: str or sqlite3.Connection, vocabname: str, top_k: int=20, crit
             break
         if w in out:
             continue
-        out[w] = (w,) + defaults + (int(w in candidate_set),)
+        out[w] = (w,) + defaults + (1 if candidate_set is None else int(w in candidate_set),)
     out = [WordEvaluation(*row) for row in out.values()]
     out.sort(key=lambda row: (getattr(row, criterion), -row.is_candidate))
     out = out[:top_k]
     return out
 
+def _evaluate_sampled(evaluate_words, allwords: list, candidates: list=None, criterion: str="mean_entropy",
+                      word_pair_limit: int=20000000, candidate_samplesize: int=500, rng: random.Random=None)-> list:
+    # evaluation rows within `word_pair_limit`, by the successive halving or by sampling the answer words
+    # `evaluate_words(input_words, answer_words)` returns the evaluation rows, where None means all words
+    # metrics are scaled to the number of candidates in both cases, the same as the adaptive sampling
+    n_candidates = len(allwords) if candidates is None else len(candidates)
+    def _evaluate_scaled(input_words: list, answer_words: list)-> list:
+        samplesize = n_candidates if answer_words is None else len(answer_words)
+        return [_scale_row(row, samplesize, n_candidates) for row in evaluate_words(input_words, answer_words)]
+
+    if len(allwords) * min(candidate_samplesize, n_candidates) > word_pair_limit:
+        # input words are narrowed down by the successive halving rather than sampled
+        return _evaluate_halving(_evaluate_scaled, allwords, candidates=candidates, criterion=criterion,
+                                 word_pair_limit=word_pair_limit, candidate_samplesize=candidate_samplesize, rng=rng)
+    # words are sampled once, so the parallel evaluation is the same as the serial one
+    input_words, answer_words = _sample_words(allwords, candidates, word_pair_limit=word_pair_limit,
+                                              candidate_samplesize=candidate_samplesize, rng=rng)
+    return _evaluate_scaled(input_words, answer_words)
+
+def _evaluate(db: str or sqlite3.Connection, vocabname: str, top_k: int=20, criterion: str="mean_entropy", candidates: list=None,
+              word_pair_limit: int=20000000, candidate_samplesize: int=500, rng: random.Random=None)-> list:
+    allwords = _words(db, vocabname)  # get all words
+    evaluate_words = lambda input_words, answer_words: _evaluate_words(db, vocabname, input_words=input_words,
+                                                                       answer_words=answer_words, candidates=candidates)
+    rows = _evaluate_sampled(evaluate_words, allwords, candidates=candidates, criterion=criterion,
+                             word_pair_limit=word_pair_limit, candidate_samplesize=candidate_samplesize, rng=rng)
+    return _top_evaluations(rows, allwords, candidates=candidates, top_k=top_k, criterion=criterion)
+
 def _vocabnames(db: str or sqlite3.Connection)-> list:
 #    with sqlite3.connect(dbfile) as conn:
     with _connect(db) as conn:
@@ -200,39 +525,26 @@ def _words(db: str or sqlite3.Connection, vocabname: str)-> list:
         words = [row[0] for row in c]
     return words
 
-def _choose_word_with_weight(db: str or sqlite3.Connection, vocabname: str)-> str:    
+def _legacy_meta(db: str or sqlite3.Connection, vocabname: str)-> dict:
+    # metadata of a vocab created before the metadata table, read from the words table
+    # returns None if the vocab does not exist
     with _connect(db) as conn:
-        sqlite3.enable_callback_tracebacks(True)
-        conn.create_function("log", 1, math.log)
         c = conn.cursor()
-        # The query below uses the fact that
-        # Prob{ u_i^(1/w_i) > u_j^(1/w_j) } = w_i / (w_i + w_j),
-        #   where u_i, u_j ~ uniform(0, 1).
-        #
-        # References: 
-        #   https://utopia.duth.gr/~pefraimi/research/data/2007EncOfAlg.pdf
-        #   https://stackoverflow.com/questions/1398113/how-to-select-one-row-randomly-taking-into-account-a-weight
-        # 
-        # On SQLite, random() generate an integer from [-9223372036854775808, +9223372036854775808]
-        # Remove the sign and take mod n to make them roughly uniform on [0, n-1]
-        # Then plus 0.5 to avoid zero, i.e. uniform on [0.5, ..., n-0.5]
-        # Dividing by n, uniform on [0.5/n, ... 1-0.5/n]
-        # With n large enough, the retult is roughly uniform on (0, 1)
-        q = """
-        SELECT
-          word,
-          -log((abs(random()) % 1000000 + 0.5) / 1000000.0) / weight  AS priority
-        FROM
-          "{name}_words_approx"
-        WHERE
-          weight > 0
-        ORDER BY priority
-        LIMIT 1
-        """.format(name=vocabname)
-        c.execute(q)
-        ans = c.fetchall()
-    #print(ans)
-    return ans[0][0]
+        c.execute("SELECT count(*) FROM sqlite_master WHERE type = 'table' AND name = ?", ("{}_words_approx".format(vocabname),))
+        if c.fetchone()[0] == 0:
+            return None
+        weight_defined = _weight_defined(conn, vocabname)
+        c.execute('SELECT word, {weight} FROM "{name}_words_approx" ORDER BY rowid'.format(
+            weight=("weight" if weight_defined else "1.0"), name=vocabname))
+        words = dict(c.fetchall())
+    return _vocab_meta("approx", vocabname, 1, words, weight_defined=weight_defined)
+
+def _word_weights(db: str or sqlite3.Connection, vocabname: str)-> dict:
+    with _connect(db) as conn:
+        c = conn.cursor()
+        c.execute('SELECT word, weight FROM "{name}_words_approx" ORDER BY rowid'.format(name=vocabname))
+        weights = dict(c.fetchall())
+    return weights
 
 def _weight_defined(db: str or sqlite3.Connection, vocabname: str)-> bool:
     with _connect(db) as conn:
@@ -267,12 +579,56 @@ class WordleAIApprox(WordleAISQLite):
             otherwise './wordleai.db' in the current directory is used
         inmemory (bool):
             If true, ignore `dbfile` and use ':memory:' instead, so the in-memory database is used.
+        sqlite_pragmas (dict):
+            Pragmas applied to the database connections
+            Given values are added to or override `wordleaisql.sqlite.DEFAULT_PRAGMAS`
 
         word_pair_limit (int):
             Limit of the len(input_words) * len(candidates) to compute the evaluation.
             The larger, the more accurate approximation.
         candidate_samplesize (int):
             Sample size for the answer words for approximation.
+            If `word_pair_limit` does not allow evaluating all input words on this sample size,
+            input words are narrowed down by the successive halving: all words are evaluated on a small answer sample,
+            then the better half are evaluated on a larger sample, and so on until the sample size reaches this value.
+        engine (str):
+            Where the judges of the sampled word pairs are computed
+            'numpy' computes them in process by the vectorized kernel,
+            'sqlite' computes them in the database by the registered judge function, which is much slower
+        sampling (str):
+            How the word pairs are sampled
+            'fixed' samples the input and answer words once within `word_pair_limit`
+            'adaptive' samples the answer words in increments of `candidate_samplesize`, and drops the input words
+            whose confidence interval of the metric is behind the top ones.
+            Stops when the top `adaptive_top_k` words are separated from the others, all candidates are sampled,
+            or `word_pair_limit` or `time_limit` is reached. Requires the numpy engine
+            In both modes, metrics computed on the answer samples are scaled to the number of candidates,
+            so that max_n and mean_n are on the same scale as the exact evaluation
+        adaptive_top_k (int):
+            Number of top words to be separated from the others in the adaptive sampling
+        adaptive_z (float):
+            Width of the confidence intervals in the adaptive sampling, in the number of standard errors
+        time_limit (float):
+            Time limit of an evaluation in seconds for the adaptive sampling. If None, no limit
+            Results cut short by the time limit are not stored in the opening book nor in `evaluation_cache`
+        judge_cache_size (int):
+            Number of answer words whose judges against all input words are kept in the process and reused across turns
+            If 0, judges are computed every time. Only applicable to the numpy engine
+        judge_cache_db_size (int):
+            Number of answer words whose judges are also kept in the database and reused across games and processes,
+            the least recently used ones are removed when exceeded
+            If 0, judges are not stored in the database. Requires `judge_cache_size` > 0
+        use_cpp (bool):
+            Load the C++ judge library on construction, compiling it if needed, so that the numpy engine judges words by it
+            If False, the library is used only if it is already loaded in the process
+        cpp_recompile (bool):
+            Compile the C++ code again if the source code has no change
+        cpp_compiler (str):
+            Command name of the C++ compiler. If None, 'g++' and 'clang++' are searched
+        seed (int):
+            Seed of the word sampling. If given, samples are derived from the seed and the game state,
+            so that the same state gives the same evaluation, except when stopped by `time_limit`
+            If None, samples differ at each evaluation
 
         decision_metric (str):
             The criteria to pick a word
@@ -283,13 +639,40 @@ class WordleAIApprox(WordleAISQLite):
             AI strength in [0, 10]
 
         resetup (bool):
-            Setup again if the vocabname already exists
+            Setup again if the vocabname already exists and `words` differ from the vocab in the database
+            Words and weights are compared by the hashes recorded at the setup,
+            and only the weights are updated if the word list is unchanged
+        use_opening_book (bool):
+            Look up the first turn evaluation from the opening book, building it if not available
+            The book is keyed by `seed` among other parameters, so that it keeps the same result as the seeded evaluation
+            If None, the opening book is used only if `seed` is given, since otherwise it would freeze one random approximation
+        evaluation_cache (EvaluationCache):
+            Cache of evaluation results, which can be shared by AI objects
+            If None, evaluation results are not cached
+            Note that the cache keeps the approximation result computed first
+        workers (int):
+            Number of threads to evaluate the sampled input words in parallel, each with its own database connection
+            Words are sampled once, and the result is the same as the serial evaluation
+            Not applicable to the in-memory database
+        read_only (bool):
+            Open the database as an immutable file, so that many processes can share a prebuilt database without locks
+            The vocab must already exist, `words` is ignored and the opening book is not stored
+            The file must not be modified while the AI object is alive
+        wal (bool):
+            Use the write-ahead log, so that readers are not blocked while another connection writes to the database
     """
-    def __init__(self, vocabname: str, words: list or str=None, dbfile: str=None, inmemory: bool=False,
-                 word_pair_limit: int=500000, candidate_samplesize: int=500,
+    _meta_backend = "approx"  # backend name in the metadata table
+
+    def __init__(self, vocabname: str, words: list or str=None, dbfile: str=None, inmemory: bool=False, sqlite_pragmas: dict=None,
+                 word_pair_limit: int=20000000, candidate_samplesize: int=500, engine: str="numpy",
+                 sampling: str="fixed", adaptive_top_k: int=10, adaptive_z: float=3.0, time_limit: float=None,
+                 judge_cache_size: int=0, judge_cache_db_size: int=0, seed: int=None,
+                 use_cpp: bool=False, cpp_recompile: bool=False, cpp_compiler: str=None,
                  decision_metric: str="mean_entropy", candidate_weight: float=0.3, strength: float=6,
-                 resetup: bool=False, **kwargs):
+                 resetup: bool=False, use_opening_book: bool=None,
+                 evaluation_cache: EvaluationCache=None, workers: int=1, read_only: bool=False, wal: bool=False, **kwargs):
         if inmemory:
+            assert not read_only, "in-memory database cannot be read-only"
             dbfile = ":memory:"  # ignore dbfile supplied and use in-memory database
         else:
             if dbfile is None:
@@ -297,22 +680,41 @@ class WordleAIApprox(WordleAISQLite):
                 if dbfile is None:
                     dbfile = "./wordleai.db"
             os.makedirs(os.path.dirname(os.path.abspath(dbfile)), exist_ok=True)
-        self.dbfile = dbfile
-        self.db = sqlite3.connect(self.dbfile)
+        self._init_db(dbfile, sqlite_pragmas, read_only=read_only, wal=wal)
         assert word_pair_limit > candidate_samplesize
         assert candidate_samplesize > 0
+        assert engine in ("numpy", "sqlite"), "engine must be either 'numpy' or 'sqlite', but '{}'".format(engine)
+        assert sampling in ("fixed", "adaptive"), "sampling must be either 'fixed' or 'adaptive', but '{}'".format(sampling)
+        assert sampling == "fixed" or engine == "numpy", "sampling '{}' requires the numpy engine".format(sampling)
+        assert adaptive_top_k > 0, "adaptive_top_k must be positive"
+        assert judge_cache_size >= 0 and judge_cache_db_size >= 0, "judge cache sizes must be non-negative"
+        assert judge_cache_db_size == 0 or judge_cache_size > 0, "judge_cache_db_size requires judge_cache_size"
+        assert workers >= 1, "workers must be positive"
+        self.engine = engine
+        self.sampling = sampling
+        self.adaptive_top_k = adaptive_top_k
+        self.adaptive_z = adaptive_z
+        self.time_limit = time_limit
+        self.judge_cache_size = judge_cache_size
+        self.judge_cache_db_size = judge_cache_db_size
+        self._judge_cache = None  # judge cache for the numpy engine, as (words, cache)
+        self._time_limited = False  # whether the last evaluation was cut short by the time limit
+        self.seed = seed
+        if use_cpp and engine == "numpy" and _load_cpp_lib(recompile=cpp_recompile, compiler=cpp_compiler) is None:
+            logger.warning("C++ judge library is not available, numpy implementation is used instead")
+        self._codes = None  # encoded words for the numpy engine, as (words, codes)
+        self.workers = workers
         self.word_pair_limit = word_pair_limit
         self.candidate_samplesize = candidate_samplesize
         self.vocabname = vocabname
-        self.decision_metric = decision_metric
-        self.candidate_weight = candidate_weight
-        self.strength = min(max(strength, 0), 10)  # clip to [0, 10]
-        # strength is linearly converted to the power of noise: 0 -> +5, 10 -> -5
-        # larger noise, close to random decision
-        self.decision_noise = math.pow(10, 5-self.strength)
+        self._set_decision_params(decision_metric, candidate_weight, strength)
 
         #print("vocabnames", self.vocabnames)
-        if resetup or (vocabname not in self.vocabnames):
+        if read_only:
+            assert not resetup, "read-only database cannot be setup"
+        self._meta = self._load_meta()
+        if self._meta is None or resetup:
+            assert not read_only, "vocab '{}' is not found".format(vocabname)
             assert words is not None, "`words` must be supplied to setup the vocab '{}'".format(vocabname)
             _words = (
                 words if isinstance(words, dict) else
@@ -322,21 +724,30 @@ class WordleAIApprox(WordleAISQLite):
             )
             if _words is None:
                 raise TypeError("Unsupported type 'words': '{}'".format(type(words)))
-            logger.info("Setup tables for vocabname '%s'", vocabname)
-            _setup(db=self.db, vocabname=vocabname, words=words)
+            change = "words" if self._meta is None else _vocab_change(self._meta, _words, 1)
+            if change == "words":
+                logger.info("Setup tables for vocabname '%s'", vocabname)
+                _setup(db=self.db, vocabname=vocabname, words=_words)
+            elif change == "weights":
+                logger.info("Word list of vocabname '%s' is unchanged, only the weights are updated", vocabname)
+                _update_weights(self.db, "{}_words_approx".format(vocabname), self._meta, _words)
+            else:
+                logger.info("Vocabname '%s' is unchanged, setup is skipped", vocabname)
+            self._meta = self._load_meta()
         # else:
         #     _ensure_word_weight_column(dbfile, vocabname)  # make sure previously created words table has the weight column
+        self.use_opening_book = (seed is not None) if use_opening_book is None else use_opening_book
+        self.evaluation_cache = evaluation_cache
 
         self._info = []                  # infomation of the judge results
         self._nonanswer_words = set([])  # words that cannot become an answer
         #self.set_candidates()
 
-    def __del__(self):
-        try:
-            self.db.close()
-            logger.debug("Database connection closed")
-        except Exception as e:
-            logger.warning("Failed to close the database connection: '%s'".format(e))
+    def _init_connection(self, conn: sqlite3.Connection)-> sqlite3.Connection:
+        return _init_connection(conn, self.sqlite_pragmas)
+
+    def _legacy_meta(self)-> dict:
+        return _legacy_meta(self.db, self.vocabname)
 
     @property
     def name(self)-> str:
@@ -354,21 +765,89 @@ class WordleAIApprox(WordleAISQLite):
         #return _words(self.dbfile, self.vocabname)
         return _words(self.db, self.vocabname)
 
-    def evaluate(self, top_k: int=20, criterion: str="mean_entropy")-> list:
-        """
-        Evaluate input words and return the top ones in accordance with the given criterion
-        """
+    @property
+    def _opening_table(self)-> str:
+        return "{}_opening_approx".format(self.vocabname)
+
+    def _evaluation_params(self)-> tuple:
+        out = (self.sampling, self.word_pair_limit, self.candidate_samplesize)
+        if self.sampling == "adaptive":
+            out += (self.adaptive_top_k, self.adaptive_z)
+        if self.seed is not None:
+            out += ("seed", self.seed)
+        return out
+
+    def _compute_evaluation(self, top_k: int=20, criterion: str="mean_entropy")-> list:
+        self._time_limited = False  # stays False if found in the opening book
+        return super()._compute_evaluation(top_k=top_k, criterion=criterion)
+
+    def _evaluation_complete(self)-> bool:
+        # results cut short by the time limit are not stored, since they depend on the machine load
+        return not self._time_limited
+
+    def _word_codes(self, allwords: list)-> np.ndarray:
+        # words are encoded once and kept in the object
+        if self._codes is None or self._codes[0] != allwords:
+            self._codes = (allwords, encode_words(allwords))
+        return self._codes[1]
+
+    def _judges(self, allwords: list)-> _JudgeCache:
+        # judge cache is created on first use, and recreated if the words are changed
+        if self.judge_cache_size == 0 or self.engine != "numpy":
+            return None
+        if self._judge_cache is None or self._judge_cache[0] != allwords:
+            use_db = self.judge_cache_db_size > 0 and not self.read_only
+            cache = _JudgeCache(self._word_codes(allwords), maxsize=self.judge_cache_size,
+                                db=(lambda: self.db) if use_db else None, tablename="{}_judgecache_approx".format(self.vocabname),
+                                db_maxsize=self.judge_cache_db_size)
+            self._judge_cache = (allwords, cache)
+        return self._judge_cache[1]
+
+    def _run_evaluation(self, top_k: int=20, criterion: str="mean_entropy")-> list:
         # return _evaluate(self.dbfile, self.vocabname, top_k=top_k, criterion=criterion, candidates=self.candidates,
         #                  word_pair_limit=self.word_pair_limit, candidate_samplesize=self.candidate_samplesize)
-        return _evaluate(self.db, self.vocabname, top_k=top_k, criterion=criterion, candidates=self.candidates,
-                         word_pair_limit=self.word_pair_limit, candidate_samplesize=self.candidate_samplesize)
-
-    def choose_answer_word(self, weighted: bool=True)-> str:
-        """Randomly choose an answer word in accordance with the given weight"""
-        if not weighted:
-            return random.choice(self.words)
-            
-        if not _weight_defined(self.db, self.vocabname):
+        meta = self._refresh_meta()
+        allwords = self.words
+        candidates = self.candidates
+        rng = self._rng(self.seed, "evaluate")
+        self._time_limited = False
+        if self.sampling == "adaptive":
+            if len(allwords) * 3**meta["wordlen"] <= 2**26:
+                rows, self._time_limited = _evaluate_words_adaptive(
+                    allwords, self._word_codes(allwords), candidates=candidates, criterion=criterion,
+                    top_k=min(self.adaptive_top_k, top_k or len(allwords)),
+                    word_pair_limit=self.word_pair_limit, batch_size=self.candidate_samplesize,
+                    z=self.adaptive_z, time_limit=self.time_limit, judge_cache=self._judges(allwords), rng=rng)
+                return _top_evaluations(rows, allwords, candidates=candidates, top_k=top_k, criterion=criterion)
+            # judge counts of all input words do not fit in memory for long words
+            logger.warning("Adaptive sampling is not available for the word length %d, fixed sampling is used", meta["wordlen"])
+        codes = self._word_codes(allwords) if self.engine == "numpy" else None
+        judge_cache = self._judges(allwords)
+        def _evaluate_chunk(chunk: list, answer_words: list)-> list:
+            if self.engine == "numpy":
+                return _evaluate_words_numpy(allwords, codes, input_words=chunk, answer_words=answer_words, candidates=candidates,
+                                             judge_cache=judge_cache)
+            return _evaluate_words(self.db, self.vocabname, input_words=chunk, answer_words=answer_words, candidates=candidates)
+
+        def _evaluate_rows(input_words: list, answer_words: list)-> list:
+            if not self._parallel:
+                return _evaluate_chunk(input_words, answer_words)
+            # input words are split into chunks evaluated by each thread, against the same answer words
+            chunk_words = allwords if input_words is None else input_words
+            if judge_cache is not None and 2 * len(chunk_words) >= len(allwords):
+                # missing columns are computed at once before splitting, since each chunk involves only a part of the input words
+                index = {w: i for i, w in enumerate(allwords)}
+                judge_cache.fill(np.array([index[w] for w in (allwords if answer_words is None else answer_words)], dtype=np.int64))
+            chunksize = -(-len(chunk_words) // self.workers)
+            chunks = [chunk_words[i:(i+chunksize)] for i in range(0, len(chunk_words), chunksize)]
+            return [row for shard in self._map_workers(lambda chunk: _evaluate_chunk(chunk, answer_words), chunks) for row in shard]
+
+        rows = _evaluate_sampled(_evaluate_rows, allwords, candidates=candidates, criterion=criterion,
+                                 word_pair_limit=self.word_pair_limit, candidate_samplesize=self.candidate_samplesize, rng=rng)
+        return _top_evaluations(rows, allwords, candidates=candidates, top_k=top_k, criterion=criterion)
+
+    def _answer_weights(self)-> dict:
+        if not self._refresh_meta()["weight_defined"]:
             print("Word weight is not defined. Please call `WordleAIApprox` with `resetup=True` next time", file=sys.stderr)
-            return random.choice(self.words)
-        return _choose_word_with_weight(self.db, self.vocabname)
+            return {w: 1.0 for w in self.words}
+        return _word_weights(self.db, self.vocabname)
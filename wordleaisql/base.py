@@ -1,8 +1,11 @@
 # -*- coding: utf-8 -*-
 
+import math
 import random
+import hashlib
 from typing import Type
-from .utils import wordle_judge, encode_judgement, WordEvaluation, _dedup, _read_vocabfile
+from .utils import wordle_judge, encode_judgement, WordEvaluation, _dedup, _read_vocabfile, encode_words, wordle_judge_batch, _AliasSampler
+from .cache import EvaluationCache, evaluation_cache_key
 
 class WordleAI:
     """
@@ -19,9 +22,15 @@ class WordleAI:
             If str, the path to a vocabulary file
             If list, the list of words
             If dict, mapping from word to the weight
+        evaluation_cache (EvaluationCache):
+            Cache of evaluation results, which can be shared by AI objects
+            If None, evaluation results are not cached
     """
-    def __init__(self, vocabname: str, words: str or list or dict=None, **kwargs):
+    evaluation_cache = None
+
+    def __init__(self, vocabname: str, words: str or list or dict=None, evaluation_cache: EvaluationCache=None, **kwargs):
         self.vocabname = vocabname
+        self.evaluation_cache = evaluation_cache
         self._vocabnames = [vocabname]  # no storage of other vocabs
         assert words is not None, "`words` must be supplied to setup the vocab '{}'".format(vocabname)
         if isinstance(words, dict):
@@ -59,15 +68,24 @@ class WordleAI:
     @property
     def candidates(self)-> list:
         """Subset of answer words filtered by given information"""
-        candidates = [w for w in self.words if w not in self.nonanswer_words]
-        def _keep(candidate):
-            for input_word, encoded_result in self.info:
-                if wordle_judge(input_word, candidate) != int(encoded_result):
-                    return False
-            return True
-        candidates = [c for c in candidates if _keep(c)]
-        return candidates
-        #return self._candidates
+        # candidates are materialized and narrowed by the info entries added since the last call
+        # rebuilt from all words when the info or the nonanswer words are changed otherwise
+        state = getattr(self, "_candidate_state", None)
+        info = self.info
+        if (state is None or state["info"] != info[:len(state["info"])]
+                or state["nonanswer_words"] != self.nonanswer_words):
+            candidates = [w for w in self.words if w not in self.nonanswer_words]
+            state = {"candidates": candidates, "codes": encode_words(candidates) if len(candidates) > 0 else None,
+                     "info": [], "nonanswer_words": set(self.nonanswer_words)}
+            self._candidate_state = state
+        for input_word, encoded_result in info[len(state["info"]):]:
+            if len(state["candidates"]) > 0:
+                # judge the input word against the remaining candidates at once
+                keep = (wordle_judge_batch(encode_words([input_word]), state["codes"])[0] == int(encoded_result))
+                state["candidates"] = [c for c, k in zip(state["candidates"], keep) if k]
+                state["codes"] = state["codes"][keep]
+            state["info"].append((input_word, encoded_result))
+        return state["candidates"].copy()
 
     @property
     def info(self)-> list:
@@ -76,6 +94,7 @@ class WordleAI:
 
     def clear_info(self):
         self.info.clear()
+        self._candidate_state = None
 
     @property
     def nonanswer_words(self)-> set:
@@ -84,6 +103,14 @@ class WordleAI:
 
     def remove_from_answers(self, excluded_words: list):
         self._nonanswer_words |= set(excluded_words)
+        state = getattr(self, "_candidate_state", None)
+        if state is not None:
+            # narrow the current candidates rather than rebuilding them
+            keep = [c not in self._nonanswer_words for c in state["candidates"]]
+            state["candidates"] = [c for c, k in zip(state["candidates"], keep) if k]
+            if state["codes"] is not None:
+                state["codes"] = state["codes"][keep]
+            state["nonanswer_words"] = set(self._nonanswer_words)
 
     # def set_candidates(self, candidates: list=None):
     #     """
@@ -95,10 +122,35 @@ class WordleAI:
     #     else:
     #         self._candidates = self.words.copy()
 
+    def _evaluation_params(self)-> tuple:
+        # parameters other than the game state that affect the evaluation result
+        return ()
+
+    def _cache_namespace(self)-> tuple:
+        # identifies the AI for the evaluation cache, where the vocab is identified by the hash of the words
+        if getattr(self, "_vocab_hash", None) is None:
+            self._vocab_hash = hashlib.md5("\n".join(self.words).encode("utf-8")).hexdigest()
+        return (self.name, self.vocabname, self._vocab_hash) + tuple(self._evaluation_params())
+
     def evaluate(self, top_k: int=20, criterion: str="mean_entropy")-> list:
         """
         Evaluate input words and return the top ones in accordance with the given criterion
         """
+        if self.evaluation_cache is None:
+            return self._compute_evaluation(top_k=top_k, criterion=criterion)
+        key = evaluation_cache_key(self._cache_namespace(), self.info, self.nonanswer_words, criterion)
+        out = self.evaluation_cache.get(key, top_k=top_k)
+        if out is None:
+            out = self._compute_evaluation(top_k=top_k, criterion=criterion)
+            if self._evaluation_complete():
+                self.evaluation_cache.put(key, top_k, out)
+        return out
+
+    def _evaluation_complete(self)-> bool:
+        # whether the last computed evaluation can be stored in the cache and the opening book
+        return True
+
+    def _compute_evaluation(self, top_k: int=20, criterion: str="mean_entropy")-> list:
         # this class picks a random candidate word
         n = min(top_k, len(self.candidates))
         results = {c: WordEvaluation(c, 1, 1, 1, 1) for c in random.sample(self.candidates, n)}
@@ -125,23 +177,98 @@ class WordleAI:
         #                      if wordle_judge(input_word, c) == encode_judgement(int(judge_result))])
         self.info.append((input_word, encode_judgement(int(judge_result))))
 
-    def pick_word(self, criterion: str="mean_entropy")-> str:
-        """Pick an input word"""
+    def _rng(self, seed: int, *salt)-> random.Random:
+        # random number generator derived from the seed and the game state, so that the same state gives the same result
+        # returns the global random module if seed is None
+        if seed is None:
+            return random
+        key = evaluation_cache_key(self._cache_namespace() + (seed,) + salt, self.info, self.nonanswer_words, "")
+        return random.Random(int(key, 16))
+
+    def pick_word(self, criterion: str="mean_entropy", seed: int=None)-> str:
+        """
+        Pick an input word
+
+        If seed is given, the same word is picked for the same game state
+        """
+        rng = self._rng(seed, "pick_word")
         if len(self.candidates) > 0:
-            return random.choice(self.candidates)
+            return rng.choice(self.candidates)
         print("Warning: There is no answer candidates remaining")
-        return random.choice(self.words)
+        return rng.choice(self.words)
     
-    def choose_answer_word(self, weighted: bool=True):
-        """Randomly choose an answer word in accordance with the given weight"""
+    def _answer_weights(self)-> dict:
+        # mapping from word to the weight, for the answer sampler
+        return self._words
+
+    @property
+    def _answer_sampler(self)-> _AliasSampler:
+        # built on first use and kept in the object
+        sampler = getattr(self, "_sampler", None)
+        if sampler is None:
+            sampler = self._sampler = _AliasSampler(self._answer_weights())
+        return sampler
+
+    def choose_answer_word(self, weighted: bool=True, seed: int=None):
+        """Randomly choose an answer word in accordance with the given weight, reproducible if seed is given"""
+        return self.choose_answer_words(1, weighted=weighted, seed=seed)[0]
+
+    def choose_answer_words(self, k: int, weighted: bool=True, seed: int=None)-> list:
+        """Randomly choose k answer words with replacement, e.g. for simulations, reproducible if seed is given"""
+        rng = self._rng(seed, "choose_answer_words")
         if not weighted:
-            return random.choice(self.words)
-
-        vals = []
-        weights = []
-        for w, p in self._words.items():
-            if p > 0:
-                vals.append(w)
-                weights.append(p)
-        assert len(vals) > 0, "There is no word with positive weight"
-        return random.choices(vals, weights, k=1)[0]
\ No newline at end of file
+            words = self.words
+            return [rng.choice(words) for _ in range(k)]
+        return self._answer_sampler.sample(k, rng=rng)
+
+
+class _NoisyDecisionMixin:
+    """
+    Decision logic shared by the AI classes that pick a word by the evaluation with a noise given by the strength
+
+    Subclasses call `_set_decision_params` in the constructor
+    """
+    def _set_decision_params(self, decision_metric: str, candidate_weight: float, strength: float):
+        self.decision_metric = decision_metric
+        self.candidate_weight = candidate_weight
+        self.strength = min(max(strength, 0), 10)  # clip to [0, 10]
+        # strength is linearly converted to the power of noise: 0 -> +5, 10 -> -5
+        # larger noise, close to random decision
+        self.decision_noise = math.pow(10, 5-self.strength)
+
+    def pick_word(self, seed: int=None):
+        """
+        Pick an input word in accordance with the decision metric, with the randomness given by the strength
+
+        If seed is given, the same word is picked for the same game state
+        """
+        rng = self._rng(seed, "pick_word")
+        candidates = self.candidates
+        num_remain = len(candidates)
+        #print(count, candidates)
+        if num_remain == 1:
+            return candidates[0]
+        elif num_remain == 0:
+            print("Warning: No candidates left. This is a random choice")
+            return rng.choice(self.words)
+
+        results = self.evaluate(top_k=10000, criterion=self.decision_metric)
+        #print(results[:10], len(results))        
+        words = [row.input_word for row in results]
+        scores = [getattr(row, self.decision_metric) for row in results]  # score of eadch word, the smaller the better
+        if self.decision_metric in ("mean_n", "max_n"):
+            # we take log of the score to adjust for the scale
+            # add 1p just in case to avoid the zero error
+            scores = [math.log1p(s) for s in scores]
+        
+        # Flip the sign and adjust for the candidates
+        for i, row in enumerate(results):
+            scores[i] = row.is_candidate * self.candidate_weight - scores[i]
+        # Subtract the maximum to avoid overflow
+        maxscore = max(scores)
+        scores = [s - maxscore for s in scores]
+        # Add randomness
+        weights = [math.exp(s / self.decision_noise) for s in scores]
+        
+        out = rng.choices(words, weights=weights, k=1)
+        return out[0]
@@ -12,7 +12,6 @@ i.e. {vocabname} corresponds to the dataset name
 """
 
 import time
-import math
 import sys
 import random
 from logging import getLogger
@@ -26,6 +25,7 @@ except (ModuleNotFoundError, ImportError) as e:
     raise RuntimeError("Import failed: '{}'. Please install bigquery module by `pip install google-cloud-bigquery`".format(e))
 
 from .utils import _timereport, WordEvaluation, _read_vocabfile, _dedup
+from .cache import EvaluationCache
 from .sqlite import WordleAISQLite
 
 def _make_client(credential_jsonfile: str=None, **kwargs):
@@ -294,32 +294,10 @@ def _words(client: bigquery.Client, vocabname: str, project: str)-> list:
     words = [row[0] for row in rows]
     return words
 
-def _choose_word_with_weight(client: bigquery.Client, vocabname: str, project: str)-> str:
-    # The query below uses the fact that
-    # Prob{ u_i^(1/w_i) > u_j^(1/w_j) } = w_i / (w_i + w_j),
-    #   where u_i, u_j ~ uniform(0, 1).
-    #
-    # References: 
-    #   https://stackoverflow.com/questions/1398113/how-to-select-one-row-randomly-taking-into-account-a-weight
-    #   http://utopia.duth.gr/~pefraimi/research/data/2007EncOfAlg.pdf
-    # 
-    # On Bigquery, rand() is uniform on [0, 1)
-    # We use 1 - rand() to make it to (0, 1] to avoid log(0).
-    #   note. log(1) is okay because it is zero.
-    q = """
-    SELECT
-        word,
-        -log(1 - rand()) / weight AS priority
-    FROM
-        {project}.{dataset}.words
-    WHERE
-        weight > 0
-    ORDER BY priority
-    LIMIT 1
-    """.format(project=project, dataset=vocabname)
-    job = client.query(q)
+def _word_weights(client: bigquery.Client, vocabname: str, project: str)-> dict:
+    job = client.query('SELECT word, weight FROM `{project}.{dataset}.words`'.format(project=project, dataset=vocabname))
     rows = job.result()
-    return next(rows)[0]
+    return {row[0]: row[1] for row in rows}
 
 def _weight_defined(client: bigquery.Client, vocabname: str, project: str=None)-> bool:
     """If weight column is missing in the words table, add it with a constant 1"""
@@ -370,23 +348,21 @@ class WordleAIBigquery(WordleAISQLite):
 
         resetup (bool):
             Setup again if the vocabname already exists        
+        evaluation_cache (EvaluationCache):
+            Cache of evaluation results, which can be shared by AI objects
+            If None, evaluation results are not cached
     """
     def __init__(self, vocabname: str, words: str or list or dict=None,
                  credential_jsonfile: str=None, project: str=None, location: str="US", partition_size: int=200,
                  decision_metric: str="mean_entropy", candidate_weight: float=0.3, strength: float=6,
-                 resetup: bool=False, **kwargs):
+                 resetup: bool=False, evaluation_cache: EvaluationCache=None, **kwargs):
         self.client = _make_client(credential_jsonfile, project=project, location=location)
         self.project = self.client.project
         self.location = self.client.location
         logger.info("GCP project: '%s', location: '%s'", self.project, self.location)
 
         self.vocabname = vocabname
-        self.decision_metric = decision_metric
-        self.candidate_weight = candidate_weight
-        self.strength = min(max(strength, 0), 10)  # clip to [0, 10]
-        # strength is linearly converted to the power of noise: 0 -> +5, 10 -> -5
-        # larger noise, close to random decision
-        self.decision_noise = math.pow(10, 5-self.strength)
+        self._set_decision_params(decision_metric, candidate_weight, strength)
 
         if resetup or vocabname not in self.vocabnames:
             assert words is not None, "`words` must be supplied to setup the vocab '{}'".format(vocabname)
@@ -406,6 +382,7 @@ class WordleAIBigquery(WordleAISQLite):
         #     _ensure_word_weight_column(client=self.client, vocabname=self.vocabname, project=self.project)
 
         #self.set_candidates()
+        self.evaluation_cache = evaluation_cache
         self._info = []                  # infomation of the judge results
         self._nonanswer_words = set([])  # words that cannot become an answer
 
@@ -423,19 +400,12 @@ class WordleAIBigquery(WordleAISQLite):
         """All words that can be inputted"""
         return _words(client=self.client, vocabname=self.vocabname, project=self.project)
     
-    def evaluate(self, top_k: int=20, criterion: str="mean_entropy")-> list:
-        """
-        Evaluate input words and return the top ones in accordance with the given criterion
-        """
+    def _compute_evaluation(self, top_k: int=20, criterion: str="mean_entropy")-> list:
         return _evaluate(self.client, self.vocabname, self.project,
                          top_k=top_k, criterion=criterion, candidates=self.candidates)
 
-    def choose_answer_word(self, weighted: bool=True)-> str:
-        """Randomly choose an answer word in accordance with the given weight"""
-        if not weighted:
-            return random.choice(self.words)
-
+    def _answer_weights(self)-> dict:
         if not _weight_defined(self.client, self.vocabname, self.project):
             print("Word weight is not defined. Please call `WordleAIBigquery` with `resetup=True` next time", file=sys.stderr)
-            return random.choice(self.words)
-        return _choose_word_with_weight(self.client, self.vocabname, self.project)
\ No newline at end of file
+            return {w: 1.0 for w in self.words}
+        return _word_weights(self.client, self.vocabname, self.project)
\ No newline at end of file
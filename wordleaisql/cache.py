@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+
+"""
+Cache of evaluation results.
+
+Evaluation result depends only on the vocab, the information given so far, the nonanswer words and the criterion,
+so games reaching the same state can share the result.
+
+Results are kept in an in-process LRU cache, and optionally in a SQLite database file
+so that they are shared across processes and sessions.
+
+Table created in the database file:
+    wordleai_evaluation_cache : evaluation results with the last access time
+"""
+
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from logging import getLogger
+logger = getLogger(__name__)
+
+from .utils import WordEvaluation
+
+CACHE_TABLE = "wordleai_evaluation_cache"
+
+def evaluation_cache_key(namespace: tuple, info: list, nonanswer_words: set, criterion: str)-> str:
+    """
+    Canonical hash of a game state
+
+    Args:
+        namespace (tuple):
+            Values identifying the AI, e.g. backend, vocab and parameters affecting the evaluation
+        info (list):
+            List of (input_word, judge), where the order and duplicates do not matter
+        nonanswer_words (set):
+            Words that cannot become an answer
+        criterion (str):
+            Evaluation criterion
+    """
+    state = [list(namespace), sorted(set((w, int(r)) for w, r in info)), sorted(nonanswer_words), criterion]
+    return hashlib.sha1(json.dumps(state, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+class EvaluationCache:
+    """
+    Cache of evaluation results with an in-process LRU tier and an optional persistent SQLite tier
+
+    An entry stores the top `top_k` evaluations, and serves requests with the same or smaller `top_k`.
+
+    Args:
+        maxsize (int):
+            Maximum number of entries kept in the process
+        dbfile (str):
+            SQLite database file for the persistent tier. If None, results are only kept in the process
+        db_maxsize (int):
+            Maximum number of entries kept in the database file.
+            Least recently used entries are removed when exceeded
+    """
+    def __init__(self, maxsize: int=256, dbfile: str=None, db_maxsize: int=10000):
+        assert maxsize >= 0, "maxsize must be non-negative"
+        assert db_maxsize > 0, "db_maxsize must be positive"
+        self.maxsize = maxsize
+        self.dbfile = dbfile
+        self.db_maxsize = db_maxsize
+        self._entries = OrderedDict()  # key -> (top_k, evaluations)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if self.dbfile is not None:
+            with sqlite3.connect(self.dbfile) as conn:
+                conn.execute("""
+                CREATE TABLE IF NOT EXISTS "{name}" (
+                  cache_key TEXT PRIMARY KEY,
+                  top_k INTEGER,
+                  evaluations TEXT,
+                  last_used FLOAT
+                )
+                """.format(name=CACHE_TABLE))
+                conn.execute('CREATE INDEX IF NOT EXISTS "{name}_last_used_idx" ON "{name}" (last_used)'.format(name=CACHE_TABLE))
+
+    @property
+    def stats(self)-> dict:
+        """Numbers of hits and misses, and the current number of entries in the process"""
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
+
+    @staticmethod
+    def _serves(entry: tuple, top_k: int)-> bool:
+        # an entry serves the request if it has enough rows, or it already contains all words
+        entry_top_k, evaluations = entry
+        return entry_top_k is None or (top_k is not None and top_k <= entry_top_k) or len(evaluations) < entry_top_k
+
+    def get(self, key: str, top_k: int=None)-> list:
+        """Return the top evaluations of the state if available, None otherwise"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._serves(entry, top_k):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1][:top_k]
+        entry = self._db_get(key)
+        with self._lock:
+            if entry is not None and self._serves(entry, top_k):
+                self._put_memory(key, entry)
+                self.hits += 1
+                return entry[1][:top_k]
+            self.misses += 1
+        return None
+
+    def put(self, key: str, top_k: int, evaluations: list):
+        """Store the top evaluations of the state"""
+        entry = (top_k, [WordEvaluation(*row) for row in evaluations])
+        with self._lock:
+            self._put_memory(key, entry)
+        self._db_put(key, entry)
+
+    def clear(self):
+        """Remove all entries and reset the counters"""
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+        if self.dbfile is not None:
+            with sqlite3.connect(self.dbfile) as conn:
+                conn.execute('DELETE FROM "{name}"'.format(name=CACHE_TABLE))
+
+    def _put_memory(self, key: str, entry: tuple):
+        if self.maxsize == 0:
+            return
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)  # least recently used
+
+    def _db_get(self, key: str)-> tuple:
+        if self.dbfile is None:
+            return None
+        with sqlite3.connect(self.dbfile) as conn:
+            c = conn.cursor()
+            c.execute('SELECT top_k, evaluations FROM "{name}" WHERE cache_key = ?'.format(name=CACHE_TABLE), (key,))
+            row = c.fetchone()
+            if row is None:
+                return None
+            c.execute('UPDATE "{name}" SET last_used = ? WHERE cache_key = ?'.format(name=CACHE_TABLE), (time.time(), key))
+        return (row[0], [WordEvaluation(*r) for r in json.loads(row[1])])
+
+    def _db_put(self, key: str, entry: tuple):
+        if self.dbfile is None:
+            return
+        top_k, evaluations = entry
+        with sqlite3.connect(self.dbfile) as conn:
+            c = conn.cursor()
+            c.execute('INSERT OR REPLACE INTO "{name}" VALUES (?,?,?,?)'.format(name=CACHE_TABLE),
+                      (key, top_k, json.dumps([list(row) for row in evaluations], ensure_ascii=False), time.time()))
+            c.execute('SELECT count(*) FROM "{name}"'.format(name=CACHE_TABLE))
+            n = c.fetchone()[0]
+            if n > self.db_maxsize:
+                c.execute("""
+                DELETE FROM "{name}" WHERE cache_key IN (
+                  SELECT cache_key FROM "{name}" ORDER BY last_used LIMIT ?
+                )""".format(name=CACHE_TABLE), (n - self.db_maxsize,))
+                logger.debug("Removed %d entries from the evaluation cache", n - self.db_maxsize)
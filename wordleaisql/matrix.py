@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+
+"""
+Dense judge matrix backend.
+
+Files are stored in a directory by the following convention:
+
+{vocabname}.current             : name of the current version directory and the SHA-1 of its words file
+{vocabname}.{version}/words.txt  : contains all words and their weights
+{vocabname}.{version}/judges.npy : N x N judge matrix, rows for input words and columns for answer words
+
+A version directory is never modified once built. Setup builds a new one and replaces the `.current` file
+in a single rename, so that readers always see a words file and a judge matrix of the same build.
+
+The judge matrix is opened as a memory-mapped file, so that several processes can share it
+through the page cache.
+"""
+
+import os
+import shutil
+import hashlib
+import tempfile
+from logging import getLogger
+logger = getLogger(__name__)
+
+import numpy as np
+from tqdm import tqdm
+
+from .utils import _timereport, WordEvaluation, _read_vocabfile, encode_words, wordle_judge_batch, judge_stats, _judge_dtype, _load_cpp_lib
+from .base import WordleAI, _NoisyDecisionMixin
+from .cache import EvaluationCache
+
+
+def _currentfile(matrixdir: str, vocabname: str)-> str:
+    return os.path.join(matrixdir, "{}.current".format(vocabname))
+
+def _wordsfile(versiondir: str)-> str:
+    return os.path.join(versiondir, "words.txt")
+
+def _judgesfile(versiondir: str)-> str:
+    return os.path.join(versiondir, "judges.npy")
+
+def _file_hash(filepath: str)-> str:
+    with open(filepath, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+def _current_version(matrixdir: str, vocabname: str)-> tuple:
+    # (version directory, hash of the words file) of the current build, or None if the vocab does not exist
+    currentfile = _currentfile(matrixdir, vocabname)
+    if not os.path.isfile(currentfile):
+        return None
+    with open(currentfile) as f:
+        version, words_hash = f.read().split()
+    return os.path.join(matrixdir, version), words_hash
+
+def _setup(matrixdir: str, vocabname: str, words: dict, use_cpp: bool=True, recompile: bool=False, compiler: str=None,
+           threads: int=None, block_size: int=2**22):
+    assert len(words) == len(set(words)), "input_words must be unique"
+    wordlens = set(len(w) for w in words)
+    assert len(wordlens) == 1, "word length must be equal, but '{}'".format(wordlens)
+    assert all(len(w.split()) == 1 for w in words), "words must not contain spaces"
+    os.makedirs(matrixdir, exist_ok=True)
+    # build in a new version directory, invisible until the current file points to it
+    versiondir = tempfile.mkdtemp(prefix="{}.".format(vocabname), dir=matrixdir)
+    try:
+        wordsfile = _wordsfile(versiondir)
+        wordlist = list(words)
+        with open(wordsfile, "w") as f:
+            for w in wordlist:
+                f.write("{} {}\n".format(w, words[w]))
+
+        if use_cpp and _load_cpp_lib(recompile=recompile, compiler=compiler) is None:
+            logger.warning("C++ enhancement is not available, numpy implementation is used instead")
+        with _timereport("Precomputing wordle judges"):
+            codes = encode_words(wordlist)
+            n = len(wordlist)
+            judges = np.lib.format.open_memmap(_judgesfile(versiondir), mode="w+", dtype=_judge_dtype(codes.shape[1]), shape=(n, n))
+            rows = max(1, block_size // n)
+            with tqdm(total=n*n) as pbar:
+                for start in range(0, n, rows):
+                    block = wordle_judge_batch(codes[start:(start+rows)], codes, max_block_size=block_size,
+                                               use_cpp=use_cpp, threads=threads)
+                    judges[start:(start+block.shape[0])] = block
+                    pbar.update(block.size)
+            judges.flush()
+            del judges
+
+        # commit by a single rename of the current file
+        previous = _current_version(matrixdir, vocabname)
+        tmpfile = os.path.join(versiondir, "current.tmp")  # unique to this build
+        with open(tmpfile, "w") as f:
+            f.write("{} {}\n".format(os.path.basename(versiondir), _file_hash(wordsfile)))
+        os.replace(tmpfile, _currentfile(matrixdir, vocabname))
+    except BaseException:
+        shutil.rmtree(versiondir, ignore_errors=True)
+        raise
+    if previous is not None and os.path.abspath(previous[0]) != os.path.abspath(versiondir):
+        # readers that have opened the old matrix keep their memory map
+        # the directory may be left on platforms that do not allow removing open files
+        shutil.rmtree(previous[0], ignore_errors=True)
+
+def _load(matrixdir: str, vocabname: str, retries: int=3)-> tuple:
+    # words and the memory-mapped judge matrix of the current build, as (words, judges)
+    # loading is retried if the build is replaced by another setup in the meantime
+    for i in range(retries):
+        current = _current_version(matrixdir, vocabname)
+        assert current is not None, "vocab '{}' is not found in '{}'".format(vocabname, matrixdir)
+        versiondir, words_hash = current
+        try:
+            if _file_hash(_wordsfile(versiondir)) != words_hash:
+                raise ValueError("Words file of '{}' does not match the hash recorded at the setup".format(versiondir))
+            words = _read_vocabfile(_wordsfile(versiondir))
+            judges = np.load(_judgesfile(versiondir), mmap_mode="r")
+        except (FileNotFoundError, AssertionError):
+            if i == retries - 1:
+                raise
+            logger.debug("Build of vocab '%s' has been replaced while loading, retry", vocabname)
+            continue
+        if judges.shape != (len(words), len(words)):
+            raise ValueError("Judge matrix shape {} does not match the number of words {}".format(judges.shape, len(words)))
+        return words, judges
+
+def _evaluate(judges: np.ndarray, words: list, top_k: int=20, criterion: str="mean_entropy", candidates: list=None)-> list:
+    n_words = len(words)
+    wordlen = len(words[0])
+    if candidates is None or len(candidates) >= n_words:  # all words are in the candidates
+        columns = None
+        candidate_set = None
+    else:
+        candidate_set = set(candidates)
+        columns = np.array(sorted(i for i, w in enumerate(words) if w in candidate_set), dtype=np.int64)
+    max_n, mean_n, mean_entropy = judge_stats(judges, 3**wordlen, columns=columns)
+
+    out = [WordEvaluation(w, int(a), float(b), float(c), 1 if candidate_set is None else int(w in candidate_set))
+           for w, a, b, c in zip(words, max_n, mean_n, mean_entropy)]
+    out.sort(key=lambda row: row.input_word)  # same order as the GROUP BY result of the SQL backends
+    out.sort(key=lambda row: (getattr(row, criterion), -row.is_candidate))
+    return out[:top_k]
+
+def _vocabnames(matrixdir: str)-> list:
+    if not os.path.isdir(matrixdir):
+        return []
+    return [f[:-8] for f in os.listdir(matrixdir) if f.endswith(".current")]
+
+class WordleAIMatrix(_NoisyDecisionMixin, WordleAI):
+    """
+    Wordle AI with dense judge matrix backend
+
+    Vocab information is stored in a version directory {matrixdir}/{vocabname}.{version},
+    pointed by {matrixdir}/{vocabname}.current
+
+    Args:
+        vocabname (str):
+            Name of vocaburary
+        words (str or list or dict):
+            If str, the path to a vocabulary file
+            If list, the list of words
+            If dict, mapping from word to the weight
+            Can be omitted if the vocabname is already in the directory and resetup=False
+        matrixdir (str):
+            Directory to store the judge matrix files
+            If not supplied, use environment variable `WORDLEAISQL_MATRIXDIR` if exists,
+            otherwise './wordleai-matrix' in the current directory is used
+
+        decision_metric (str):
+            The criteria to pick a word
+            Either 'max_n', 'mean_n', of 'mean_entropy'
+        candidate_weight (float):
+            The weight added to the answer candidate word when picking a word
+        strength (float):
+            AI strength in [0, 10]
+
+        use_cpp (bool):
+            Use C++ code to precompute wodle judgements when available
+        cpp_recompile (bool):
+            Compile the C++ code again if the source code has no change
+        cpp_compiler (str):
+            Command name of the C++ compiler. If None, 'g++' and 'clang++' are searched
+        cpp_threads (int):
+            Number of threads for the C++ precomputation. If None, all hardware threads are used
+
+        resetup (bool):
+            Setup again if the vocabname already exists
+        evaluation_cache (EvaluationCache):
+            Cache of evaluation results, which can be shared by AI objects
+            If None, evaluation results are not cached
+    """
+    def __init__(self, vocabname: str, words: str or list or dict=None, matrixdir: str=None,
+                 decision_metric: str="mean_entropy", candidate_weight: float=0.3, strength: float=6,
+                 use_cpp: bool=True, cpp_recompile: bool=False, cpp_compiler: str=None, cpp_threads: int=None,
+                 resetup: bool=False, evaluation_cache: EvaluationCache=None, **kwargs):
+        if matrixdir is None:
+            matrixdir = os.environ.get("WORDLEAISQL_MATRIXDIR")
+            if matrixdir is None:
+                matrixdir = "./wordleai-matrix"
+        self.matrixdir = matrixdir
+        logger.info("Matrix directory: '%s'", self.matrixdir)
+        self.vocabname = vocabname
+        self._set_decision_params(decision_metric, candidate_weight, strength)
+
+        if resetup or (vocabname not in self.vocabnames):
+            assert words is not None, "`words` must be supplied to setup the vocab '{}'".format(vocabname)
+            _words = (
+                words if isinstance(words, dict) else
+                {w:1.0 for w in words} if isinstance(words, list) else
+                _read_vocabfile(words) if isinstance(words, str) else
+                None
+            )
+            if _words is None:
+                raise TypeError("Unsupported type 'words': '{}'".format(type(words)))
+            with _timereport("Setup judge matrix for vocabname '%s'" % vocabname):
+                _setup(matrixdir=self.matrixdir, vocabname=vocabname, words=_words,
+                       use_cpp=use_cpp, recompile=cpp_recompile, compiler=cpp_compiler, threads=cpp_threads)
+
+        self._words, self.judges = _load(self.matrixdir, vocabname)
+        self._wordlist = list(self._words)
+
+        self.evaluation_cache = evaluation_cache
+        self._info = []                  # infomation of the judge results
+        self._nonanswer_words = set([])  # words that cannot become an answer
+
+    @property
+    def name(self)-> str:
+        return "Wordle AI (dense matrix backend)"
+
+    @property
+    def vocabnames(self)-> list:
+        """Available vocab names"""
+        return _vocabnames(self.matrixdir)
+
+    @property
+    def words(self)-> list:
+        """All words that can be inputted"""
+        return self._wordlist.copy()
+
+    def _compute_evaluation(self, top_k: int=20, criterion: str="mean_entropy")-> list:
+        return _evaluate(self.judges, self._wordlist, top_k=top_k, criterion=criterion, candidates=self.candidates)
@@ -5,53 +5,366 @@ SQLite backend.
 
 Tables are named by the following convention:
 
-{vocabname}_words   : contains all words
+{vocabname}_words   : contains all words, with the integer word IDs
 {vocabname}_judges  : contains judge results for all word pairs
+{vocabname}_opening : opening book, evaluation results of all words at the first turn (created on first use)
+wordleai_meta       : metadata of the vocabs, shared with the other SQLite backends
+
+Schema versions:
+
+1 : {vocabname}_words (word, weight), {vocabname}_judges (input_word, answer_word, judge)
+2 : {vocabname}_words (word_id, word, weight), {vocabname}_judges (input_id, judge, answer_id)
+    The judges table is a WITHOUT ROWID table clustered on (input_id, judge, answer_id)
+3 : {vocabname}_words (word_id, word, weight), {vocabname}_judges (input_id, judges)
+    The judges table has one row for each input word, where judges is a BLOB of the packed judge codes
+    against all answer words in the order of word_id (little-endian unsigned integers of the size by `_judge_dtype`)
+
+New vocabs are created in the latest version, and databases created in older versions are still supported.
 """
 
 import os
 import sys
+import json
+import time
 import sqlite3
+import hashlib
 import math
 import random
+import threading
+from urllib.request import pathname2url
 from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from logging import getLogger
 logger = getLogger(__name__)
 
-from .utils import all_wordle_judges, _timereport, _dedup, WordEvaluation, wordle_judge, encode_judgement, _read_vocabfile
-from .base import WordleAI
-
-
-def _setup(dbfile: str, vocabname: str, words: list or dict, use_cpp: bool=True, recompile: bool=False, compiler: str=None):
+import numpy as np
+
+from .utils import all_wordle_judge_blocks, _timereport, _dedup, WordEvaluation, wordle_judge, encode_judgement, _read_vocabfile, \
+                   _judge_dtype, judge_stats
+from .base import WordleAI, _NoisyDecisionMixin
+from .cache import EvaluationCache
+
+
+SCHEMA_VERSION = 3
+
+# Pragmas applied to every connection held by the AI object
+DEFAULT_PRAGMAS = {
+    "cache_size": -65536,    # 64MB of page cache (negative value is in KiB)
+    "mmap_size": 268435456,  # 256MB of memory-mapped I/O
+}
+
+# Pragmas applied with `wal=True`, so that readers are not blocked by a writer
+WAL_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",  # WAL is durable enough without syncing on every commit
+}
+
+def _open(dbfile: str, read_only: bool=False)-> sqlite3.Connection:
+    # connection shared with the threads of the AI object
+    if not read_only:
+        return sqlite3.connect(dbfile, check_same_thread=False)
+    # immutable database is read without any lock or change detection,
+    # so the file must not be modified while it is open
+    uri = "file:{}?mode=ro&immutable=1".format(pathname2url(os.path.abspath(dbfile)))
+    return sqlite3.connect(uri, uri=True, check_same_thread=False)
+
+def _has_math_functions(conn: sqlite3.Connection)-> bool:
+    # SQLite 3.35+ may be built with the native math functions
+    try:
+        conn.execute("SELECT log2(2)")
+        return True
+    except sqlite3.OperationalError:
+        return False
+
+def _init_connection(conn: sqlite3.Connection, pragmas: dict=None)-> sqlite3.Connection:
+    # register the functions used in the queries and apply pragmas
+    # native log2 is preferred, since it is called for every (input word, judge) group
+    if not _has_math_functions(conn):
+        conn.create_function("log2", 1, math.log2)
+    conn.create_function("log", 1, math.log)  # natural log, while the native log is base 10
+    if pragmas is not None:
+        for key, value in pragmas.items():
+            conn.execute("PRAGMA {}={}".format(key, value))
+    return conn
+
+@contextmanager
+def _connect(db: str or sqlite3.Connection)-> sqlite3.Connection:
+    if type(db) == sqlite3.Connection:
+        yield db
+    elif type(db) == str:
+        conn = _init_connection(sqlite3.connect(db))
+        try:
+            yield conn
+        finally:
+            conn.close()
+    else:
+        raise TypeError("`db` must be either str or sqlite3.Connection, but '{}'".format(type(db)))
+
+def _fill_temp_words(conn: sqlite3.Connection, tablename: str, words: list):
+    # put words into a temporary table of the connection, so that queries can filter by joining it
+    # instead of binding one parameter per word
+    c = conn.cursor()
+    c.execute('CREATE TEMP TABLE IF NOT EXISTS "{name}" (word TEXT PRIMARY KEY) WITHOUT ROWID'.format(name=tablename))
+    c.execute('DELETE FROM temp."{name}"'.format(name=tablename))
+    c.executemany('INSERT OR IGNORE INTO temp."{name}" VALUES (?)'.format(name=tablename), ((w,) for w in words))
+    conn.commit()  # not to keep the database locked
+
+# Pragmas applied during the bulk loading, restored afterwards
+BULKLOAD_PRAGMAS = {
+    "journal_mode": "OFF",   # disable rollback to save time
+    "synchronous": "OFF",    # no need to wait for the disk, since the staging tables are discarded on failure
+    "cache_size": -1048576,  # 1GB of page cache
+    "temp_store": "MEMORY",
+}
+
+def _sorted_judge_rows(start: int, judges: np.ndarray):
+    # yields (input_id, judge, answer_id) of a row block in the order of the primary key,
+    # so that rows are always appended to the end of the clustered index
+    order = np.argsort(judges, axis=1, kind="stable")  # answer ids sorted by judge, then by id
+    sorted_judges = np.take_along_axis(judges, order, axis=1)
+    for i, (row_judges, row_answers) in enumerate(zip(sorted_judges.tolist(), order.tolist()), start):
+        yield from zip([i] * len(row_judges), row_judges, row_answers)
+
+def _packed_dtype(wordlen: int)-> np.dtype:
+    # judge codes in the BLOB of schema version 3, fixed to little-endian to be portable across machines
+    return np.dtype(_judge_dtype(wordlen)).newbyteorder("<")
+
+def _packed_judge_rows(start: int, judges: np.ndarray, dtype: np.dtype):
+    # yields (input_id, judges) of a row block, with the judges packed into a BLOB
+    judges = judges.astype(dtype, copy=False)
+    for i, row in enumerate(judges, start):
+        yield i, row.tobytes()
+
+def _setup(db: str or sqlite3.Connection, vocabname: str, words: list or dict, use_cpp: bool=True, recompile: bool=False, compiler: str=None,
+           threads: int=None, batch_size: int=2**22, schema_version: int=SCHEMA_VERSION):
+    assert schema_version in (2, 3), "vocab can be setup in schema version 2 or 3, but {}".format(schema_version)
+    starttime = time.time()
     assert len(words) == len(set(words)), "input_words must be unique"
     wordlens = set(len(w) for w in words)
     assert len(wordlens) == 1, "word length must be equal, but '{}'".format(wordlens)
-    with sqlite3.connect(dbfile) as conn:
+    if isinstance(words, dict):
+        params = words.items()
+    elif isinstance(words, list):
+        params = [(w, 1) for w in words]
+    else:
+        raise TypeError("Unsupported type of `words`, '{}'".format(type(words)))
+    # word ID is the position in the vocab
+    params = [(i, w, p) for i, (w, p) in enumerate(params)]
+
+    # tables are built under staging names and renamed at the end,
+    # so that readers never see a half-built vocab
+    words_table = "{}_words".format(vocabname)
+    judges_table = "{}_judges".format(vocabname)
+    staging_words_table = "{}_words_staging".format(vocabname)
+    staging_judges_table = "{}_judges_staging".format(vocabname)
+    with _connect(db) as conn:
         c = conn.cursor()
-        c.execute("PRAGMA journal_mode=OFF")  # disable rollback to save time        
-        
-        c.execute('DROP TABLE IF EXISTS "{name}_words"'.format(name=vocabname))
-        c.execute('CREATE TABLE "{name}_words" (word TEXT PRIMARY KEY, weight FLOAT)'.format(name=vocabname))
-        if isinstance(words, dict):
-            params = words.items()
-        elif isinstance(words, list):
-            params = [(w, 1) for w in words]
-        else:
-            raise TypeError("Unsupported type of `words`, '{}'".format(type(words)))
-        c.executemany('INSERT INTO "{name}_words" VALUES (?,?)'.format(name=vocabname), params)
-        c.execute('CREATE INDEX "{name}_words_idx" ON "{name}_words" (word)'.format(name=vocabname))
-
-        with _timereport("Precomputing wordle judges"):
-            c.execute('DROP TABLE IF EXISTS "{name}_judges"'.format(name=vocabname))
-            c.execute('CREATE TABLE "{name}_judges" (input_word TEXT, answer_word TEXT, judge INT)'.format(name=vocabname))
-            params = all_wordle_judges(words, use_cpp=use_cpp, recompile=recompile, compiler=compiler)
-            c.executemany('INSERT INTO "{name}_judges" VALUES (?,?,?)'.format(name=vocabname), params)
-
-        with _timereport("Creating indices"):
-            c.execute('CREATE INDEX "{name}_judge_idx" ON "{name}_judges" (input_word, judge)'.format(name=vocabname))
-            c.execute('CREATE INDEX "{name}_judge_idx2" ON "{name}_judges" (answer_word)'.format(name=vocabname))
+        original_pragmas = {key: c.execute("PRAGMA {}".format(key)).fetchone()[0] for key in BULKLOAD_PRAGMAS}
+        for key, value in BULKLOAD_PRAGMAS.items():
+            c.execute("PRAGMA {}={}".format(key, value))
+        try:
+            c.execute('DROP TABLE IF EXISTS "{}"'.format(staging_words_table))
+            c.execute('DROP TABLE IF EXISTS "{}"'.format(staging_judges_table))
+            c.execute('CREATE TABLE "{}" (word_id INTEGER PRIMARY KEY, word TEXT NOT NULL UNIQUE, weight FLOAT)'.format(staging_words_table))
+            c.executemany('INSERT INTO "{}" VALUES (?,?,?)'.format(staging_words_table), params)
+            if schema_version >= 3:
+                c.execute('CREATE TABLE "{}" (input_id INTEGER PRIMARY KEY, judges BLOB NOT NULL)'.format(staging_judges_table))
+            else:
+                c.execute("""
+                CREATE TABLE "{}" (
+                  input_id INTEGER NOT NULL,
+                  judge INTEGER NOT NULL,
+                  answer_id INTEGER NOT NULL,
+                  PRIMARY KEY (input_id, judge, answer_id)
+                ) WITHOUT ROWID
+                """.format(staging_judges_table))
+            conn.commit()
+
+            with _timereport("Precomputing wordle judges", total=len(words)**2) as report:
+                blocks = all_wordle_judge_blocks(words, use_cpp=use_cpp, recompile=recompile, compiler=compiler, threads=threads)
+                dtype = _packed_dtype(len(params[0][1]))
+                batch_rows = 0  # judges inserted in the current transaction
+                for start, judges in blocks:
+                    if schema_version >= 3:
+                        c.executemany('INSERT INTO "{}" VALUES (?,?)'.format(staging_judges_table), _packed_judge_rows(start, judges, dtype))
+                    else:
+                        c.executemany('INSERT INTO "{}" VALUES (?,?,?)'.format(staging_judges_table), _sorted_judge_rows(start, judges))
+                    batch_rows += judges.size
+                    if batch_rows >= batch_size:
+                        conn.commit()
+                        report.update(batch_rows)
+                        batch_rows = 0
+                conn.commit()
+                report.update(batch_rows)
+        except BaseException:
+            c.execute('DROP TABLE IF EXISTS "{}"'.format(staging_words_table))
+            c.execute('DROP TABLE IF EXISTS "{}"'.format(staging_judges_table))
+            raise
+        finally:
+            for key, value in original_pragmas.items():
+                c.execute("PRAGMA {}={}".format(key, value))
+
+        # swap the tables in a single transaction
+        c.execute("BEGIN")
+        c.execute('DROP TABLE IF EXISTS "{}"'.format(words_table))
+        c.execute('DROP TABLE IF EXISTS "{}"'.format(judges_table))
+        c.execute('DROP TABLE IF EXISTS "{}"'.format(_opening_table(vocabname)))  # opening book is no longer valid
+        c.execute('ALTER TABLE "{}" RENAME TO "{}"'.format(staging_words_table, words_table))
+        c.execute('ALTER TABLE "{}" RENAME TO "{}"'.format(staging_judges_table, judges_table))
+        _write_meta(conn, _vocab_meta("sqlite", vocabname, schema_version, {w: p for _, w, p in params},
+                                      build_seconds=time.time()-starttime))
+        conn.commit()
+
+META_TABLE = "wordleai_meta"
+META_COLUMNS = ("backend", "vocabname", "schema_version", "wordlen", "n_words", "weight_defined",
+                "words_hash", "content_hash", "build_seconds")
+
+def _vocab_hashes(words: dict)-> tuple:
+    # hashes of the word list, and of the words with the weights, in the order of word IDs
+    words_hash = hashlib.sha1(json.dumps(list(words), ensure_ascii=False).encode("utf-8")).hexdigest()
+    content = [[w, float(p)] for w, p in words.items()]
+    content_hash = hashlib.sha1(json.dumps(content, ensure_ascii=False).encode("utf-8")).hexdigest()
+    return words_hash, content_hash
+
+def _vocab_meta(backend: str, vocabname: str, schema_version: int, words: dict, weight_defined: bool=True,
+                build_seconds: float=None)-> dict:
+    words_hash, content_hash = _vocab_hashes(words)
+    values = (backend, vocabname, schema_version, len(next(iter(words))), len(words), int(weight_defined),
+              words_hash, content_hash, build_seconds)
+    return dict(zip(META_COLUMNS, values))
+
+def _write_meta(conn: sqlite3.Connection, meta: dict):
+    # caller commits, so that the metadata is updated together with the vocab tables
+    c = conn.cursor()
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS "{name}" (
+      backend TEXT NOT NULL,
+      vocabname TEXT NOT NULL,
+      schema_version INTEGER,
+      wordlen INTEGER,
+      n_words INTEGER,
+      weight_defined INTEGER,
+      words_hash TEXT,
+      content_hash TEXT,
+      build_seconds FLOAT,
+      PRIMARY KEY (backend, vocabname)
+    ) WITHOUT ROWID
+    """.format(name=META_TABLE))
+    c.execute('INSERT OR REPLACE INTO "{name}" ({cols}) VALUES ({placeholder})'.format(
+        name=META_TABLE, cols=",".join(META_COLUMNS), placeholder=",".join("?" * len(META_COLUMNS))),
+        tuple(meta[col] for col in META_COLUMNS))
+
+def _read_meta(db: str or sqlite3.Connection, backend: str, vocabname: str)-> dict:
+    # returns None if the vocab is not registered
+    with _connect(db) as conn:
+        c = conn.cursor()
+        c.execute("SELECT count(*) FROM sqlite_master WHERE type = 'table' AND name = ?", (META_TABLE,))
+        if c.fetchone()[0] == 0:
+            return None
+        c.execute('SELECT {cols} FROM "{name}" WHERE backend = ? AND vocabname = ?'.format(
+            cols=",".join(META_COLUMNS), name=META_TABLE), (backend, vocabname))
+        row = c.fetchone()
+    return None if row is None else dict(zip(META_COLUMNS, row))
+
+def _legacy_meta(db: str or sqlite3.Connection, vocabname: str)-> dict:
+    # metadata of a vocab created before the metadata table, read from the vocab tables
+    # returns None if the vocab does not exist
+    with _connect(db) as conn:
+        c = conn.cursor()
+        c.execute("SELECT count(*) FROM sqlite_master WHERE type = 'table' AND name IN (?, ?)",
+                  ("{}_words".format(vocabname), "{}_judges".format(vocabname)))
+        if c.fetchone()[0] < 2:
+            return None
+        weight_defined = _weight_defined(conn, vocabname)
+        c.execute('SELECT word, {weight} FROM "{name}_words" ORDER BY rowid'.format(
+            weight=("weight" if weight_defined else "1.0"), name=vocabname))
+        words = dict(c.fetchall())
+        schema_version = _schema_version(conn, vocabname)
+    return _vocab_meta("sqlite", vocabname, schema_version, words, weight_defined=weight_defined)
+
+def _vocab_change(meta: dict, words: dict, schema_version: int)-> str:
+    # compare the vocab with the one set up in the database, by the hashes recorded in the metadata
+    # returns 'none' if unchanged, 'weights' if only the weights differ, and 'words' if the vocab has to be rebuilt
+    words_hash, content_hash = _vocab_hashes(words)
+    if meta["words_hash"] != words_hash or meta["schema_version"] != schema_version or not meta["weight_defined"]:
+        return "words"
+    if meta["content_hash"] != content_hash:
+        return "weights"
+    return "none"
+
+def _update_weights(db: str or sqlite3.Connection, words_table: str, meta: dict, words: dict):
+    # update the weights of the words in place, when the word list is unchanged
+    # judges and opening books do not depend on the weights, so they are kept
+    with _connect(db) as conn:
+        c = conn.cursor()
+        c.executemany('UPDATE "{name}" SET weight = ? WHERE word = ?'.format(name=words_table), [(p, w) for w, p in words.items()])
+        _write_meta(conn, _vocab_meta(meta["backend"], meta["vocabname"], meta["schema_version"], words,
+                                      build_seconds=meta["build_seconds"]))
+        conn.commit()
+
+def _vocab_size(conn: sqlite3.Connection, vocabname: str, n_words: int=None, wordlen: int=None)-> tuple:
+    # number of words and the word length, queried only if not known
+    if n_words is None or wordlen is None:
+        n_words, wordlen = conn.execute('SELECT count(*), max(length(word)) FROM "{name}_words"'.format(name=vocabname)).fetchone()
+    return n_words, wordlen
+
+def _opening_table(vocabname: str)-> str:
+    return "{}_opening".format(vocabname)
+
+def _opening_book_key(nonanswer_words: set, *params)-> str:
+    # opening book is identified by the nonanswer words and other parameters affecting the evaluation
+    h = hashlib.md5()
+    h.update("\n".join(sorted(nonanswer_words)).encode("utf-8"))
+    h.update(repr(params).encode("utf-8"))
+    return h.hexdigest()
+
+def _read_opening_book(db: str or sqlite3.Connection, tablename: str, key: str, criterion: str)-> list:
+    # returns None if the book is not available
+    with _connect(db) as conn:
+        c = conn.cursor()
+        c.execute("SELECT count(*) FROM sqlite_master WHERE type = 'table' AND name = ?", (tablename,))
+        if c.fetchone()[0] == 0:
+            return None
+        c.execute("""
+        SELECT input_word, max_n, mean_n, mean_entropy, is_candidate FROM "{name}"
+        WHERE book_key = ? AND criterion = ? ORDER BY rank
+        """.format(name=tablename), (key, criterion))
+        out = [WordEvaluation(*row) for row in c]
+    return out if len(out) > 0 else None
+
+def _write_opening_book(db: str or sqlite3.Connection, tablename: str, key: str, criterion: str, evaluations: list):
+    with _connect(db) as conn:
+        c = conn.cursor()
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS "{name}" (
+          book_key TEXT NOT NULL,
+          criterion TEXT NOT NULL,
+          rank INTEGER NOT NULL,
+          input_word TEXT NOT NULL,
+          max_n INTEGER,
+          mean_n FLOAT,
+          mean_entropy FLOAT,
+          is_candidate INTEGER,
+          PRIMARY KEY (book_key, criterion, rank)
+        ) WITHOUT ROWID
+        """.format(name=tablename))
+        c.execute('DELETE FROM "{name}" WHERE book_key = ? AND criterion = ?'.format(name=tablename), (key, criterion))
+        c.executemany('INSERT INTO "{name}" VALUES (?,?,?,?,?,?,?,?)'.format(name=tablename),
+                      [(key, criterion, i) + tuple(row) for i, row in enumerate(evaluations)])
         conn.commit()
 
+def _schema_version(db: str or sqlite3.Connection, vocabname: str)-> int:
+    with _connect(db) as conn:
+        c = conn.cursor()
+        c.execute('PRAGMA table_info("{name}_judges")'.format(name=vocabname))
+        columns = set(row[1] for row in c)
+    assert len(columns) > 0, "vocab '{}' is not found".format(vocabname)
+    if "judges" in columns:
+        return 3
+    if "input_id" in columns:
+        return 2
+    return 1
+
 # def _ensure_word_weight_column(dbfile: str, vocabname: str):
 #     """If weight column is missing in the words table, add it with a constant 1"""
 #     with sqlite3.connect(dbfile) as conn:
@@ -66,60 +379,238 @@ def _setup(dbfile: str, vocabname: str, words: list or dict, use_cpp: bool=True,
 #             logger.info('Filled `"%s_words_approx".weight` with ones', vocabname)
 #         conn.commit()
 
-def _evaluate(dbfile: str, vocabname: str, top_k: int=20, criterion: str="mean_entropy", candidates: list=None)-> list:
-    with sqlite3.connect(dbfile) as conn:
-        conn.create_function("log2", 1, math.log2)
+def _candidate_table(schema_version: int)-> tuple:
+    # temporary table and its column to keep the candidates of the connection
+    # word IDs in the latest schema, and words in schema version 1
+    if schema_version >= 2:
+        return "_wordleai_candidate_ids", "word_id"
+    return "_wordleai_candidates", "word"
+
+def _create_candidate_table(conn: sqlite3.Connection, schema_version: int):
+    tablename, column = _candidate_table(schema_version)
+    coltype = "INTEGER" if column == "word_id" else "TEXT"
+    conn.execute('CREATE TEMP TABLE IF NOT EXISTS "{name}" ({col} {coltype} PRIMARY KEY) WITHOUT ROWID'.format(
+        name=tablename, col=column, coltype=coltype))
+    conn.execute('DELETE FROM temp."{name}"'.format(name=tablename))
+
+def _fill_candidates(db: str or sqlite3.Connection, vocabname: str, info: list, nonanswer_words: set, schema_version: int,
+                     n_words: int=None, wordlen: int=None):
+    """
+    Compute the answer candidates in SQL and keep them in the temporary table of the connection
+
+    Words consistent with each info entry are a range of the judges table index on (input, judge),
+    and the candidates are their intersection, except for the nonanswer words.
+    In schema version 3, the packed judges row of each input word is looked up by the primary key,
+    and the answer words are filtered by the judge code sliced from the BLOB at their word IDs.
+    """
+    tablename, column = _candidate_table(schema_version)
+    with _connect(db) as conn:
+        c = conn.cursor()
+        if schema_version >= 3:
+            n_words, wordlen = _vocab_size(conn, vocabname, n_words, wordlen)
+            dtype = _packed_dtype(wordlen)
+            # the judges row is an uncorrelated subquery, so it is read once for each info entry
+            conditions = ['substr((SELECT j.judges FROM "{name}_judges" AS j INNER JOIN "{name}_words" AS v ON j.input_id = v.word_id '
+                          'WHERE v.word = ?), w.word_id * {size} + 1, {size}) = ?'.format(name=vocabname, size=dtype.itemsize)
+                          for _ in info]
+            q = 'SELECT w.word_id FROM "{name}_words" AS w'.format(name=vocabname)
+            if len(conditions) > 0:
+                q += " WHERE " + " AND ".join(conditions)
+            params = [p for input_word, judge in info for p in (input_word, np.array([int(judge)], dtype=dtype).tobytes())]
+        else:
+            if schema_version >= 2:
+                queries = ['SELECT answer_id FROM "{name}_judges" WHERE input_id = (SELECT word_id FROM "{name}_words" WHERE word = ?) AND judge = ?'.format(
+                    name=vocabname) for _ in info]
+                allwords = 'SELECT word_id FROM "{name}_words"'.format(name=vocabname)
+            else:
+                queries = ['SELECT answer_word FROM "{name}_judges" WHERE input_word = ? AND judge = ?'.format(name=vocabname) for _ in info]
+                allwords = 'SELECT word FROM "{name}_words"'.format(name=vocabname)
+            q = " INTERSECT ".join(queries) if len(queries) > 0 else allwords
+            params = [p for input_word, judge in info for p in (input_word, int(judge))]
+        if schema_version >= 2:
+            excluded = 'SELECT w.word_id FROM temp."_wordleai_nonanswer" AS t INNER JOIN "{name}_words" AS w ON t.word = w.word'.format(
+                name=vocabname)
+        else:
+            excluded = 'SELECT word FROM temp."_wordleai_nonanswer"'
+        if len(nonanswer_words) > 0:
+            _fill_temp_words(conn, "_wordleai_nonanswer", nonanswer_words)
+            q += " EXCEPT " + excluded
+        _create_candidate_table(conn, schema_version)
+        c.execute('INSERT INTO temp."{name}" {query}'.format(name=tablename, query=q), params)
+        conn.commit()
+
+def _evaluate_packed(conn: sqlite3.Connection, vocabname: str, candidate_table: str=None, input_range: tuple=None,
+                     n_words: int=None, wordlen: int=None, block_size: int=2**24)-> list:
+    # evaluation of schema version 3, reading the packed judges sequentially and counting them in numpy
+    # candidates are the word IDs in the temporary table `candidate_table`, or all words if None
+    c = conn.cursor()
+    n_words, wordlen = _vocab_size(conn, vocabname, n_words, wordlen)
+    dtype = _packed_dtype(wordlen)
+    columns = None
+    if candidate_table is not None:
+        c.execute('SELECT word_id FROM temp."{name}" ORDER BY word_id'.format(name=candidate_table))
+        columns = np.array([row[0] for row in c], dtype=np.int64)
+        if len(columns) == 0:
+            return []
+        candidate_ids = set(columns.tolist())
+    condition, params = "", ()
+    if input_range is not None:
+        condition, params = "WHERE j.input_id BETWEEN ? AND ?", tuple(input_range)
+    c.execute("""
+    SELECT j.input_id, w.word, j.judges FROM "{name}_judges" AS j INNER JOIN "{name}_words" AS w ON j.input_id = w.word_id
+    {condition} ORDER BY j.input_id
+    """.format(name=vocabname, condition=condition), params)
+    out = []
+    rows = max(1, block_size // max(1, n_words))  # input words read at once
+    while True:
+        block = c.fetchmany(rows)
+        if len(block) == 0:
+            break
+        # row width is taken from the data, rather than trusting the given number of words
+        judges = np.frombuffer(b"".join(row[2] for row in block), dtype=dtype).reshape(len(block), -1)
+        max_n, mean_n, mean_entropy = judge_stats(judges, 3**wordlen, columns=columns)
+        out += [WordEvaluation(row[1], int(a), float(b), float(e), 1 if columns is None else int(row[0] in candidate_ids))
+                for row, a, b, e in zip(block, max_n, mean_n, mean_entropy)]
+    out.sort(key=lambda row: row.input_word)  # same order as the SQL evaluation
+    return out
+
+def _evaluate(db: str or sqlite3.Connection, vocabname: str, top_k: int=20, criterion: str="mean_entropy", candidates: list=None,
+              schema_version: int=None, candidates_in_table: bool=False, input_range: tuple=None,
+              n_words: int=None, wordlen: int=None)-> list:
+    # if candidates_in_table, candidates are already in the temporary table filled by `_fill_candidates`
+    # if input_range is given, only input words in the range (first, last) of word IDs (words in schema version 1) are evaluated
+    # n_words and wordlen are queried if not given
+    if schema_version is None:
+        schema_version = _schema_version(db, vocabname)
+    tablename, _ = _candidate_table(schema_version)
+    with _connect(db) as conn:
         c = conn.cursor()
         # find the number of all words and compare with the number of candidates
         # if they are the same, then we do not need to filter answer_word
-        c.execute('SELECT count(*) FROM "{name}_words"'.format(name=vocabname))
-        n_words = c.fetchone()[0]
-
-        if candidates is None or len(candidates) >= n_words:  # all words are in the candidates
-            params = None
-            answer_filter = ""
+        n_words, wordlen = _vocab_size(conn, vocabname, n_words, wordlen)
+
+        if not candidates_in_table and candidates is not None and len(candidates) < n_words:
+            _fill_temp_words(conn, "_wordleai_candidates", candidates)
+            if schema_version >= 2:
+                _create_candidate_table(conn, schema_version)
+                c.execute("""
+                INSERT INTO temp."{table}"
+                SELECT w.word_id FROM temp."_wordleai_candidates" AS t INNER JOIN "{name}_words" AS w ON t.word = w.word
+                """.format(table=tablename, name=vocabname))
+                conn.commit()
+            candidates_in_table = True
+        if candidates_in_table:
+            c.execute('SELECT count(*) FROM temp."{name}"'.format(name=tablename))
+            candidates_in_table = (c.fetchone()[0] < n_words)  # no need to filter if all words are in the candidates
+
+        if schema_version >= 3:
+            out = _evaluate_packed(conn, vocabname, candidate_table=(tablename if candidates_in_table else None), input_range=input_range,
+                                   n_words=n_words, wordlen=wordlen)
+            out.sort(key=lambda row: (getattr(row, criterion), -row.is_candidate))
+            return out[:top_k]
+
+        conditions = []
+        if candidates_in_table and schema_version >= 2:
+            conditions.append('answer_id IN (SELECT word_id FROM temp."{name}")'.format(name=tablename))
+            is_candidate = 's.input_id IN (SELECT word_id FROM temp."{name}")'.format(name=tablename)
+        elif candidates_in_table:
+            conditions.append('answer_word IN (SELECT word FROM temp."{name}")'.format(name=tablename))
+            is_candidate = 'input_word IN (SELECT word FROM temp."{name}")'.format(name=tablename)
         else:
-            candidate_set = set(candidates)
-            params = tuple(candidate_set)
-            answer_filter = "WHERE answer_word IN (%s)" % ",".join("?" * len(params))
-
-        q = """
-        with tmp AS (
-          SELECT
-            input_word,
-            judge,
-            count(*) AS n,
-            log2(count(*)) AS entropy
-          FROM
-            "{name}_judges"
-          {answerfilter}
-          GROUP BY
-            input_word, judge
-        )
-        SELECT
-          input_word,
-          max(n) AS max_n,
-          1.0 * sum(n*n) / sum(n) AS mean_n,
-          sum(n*entropy) / sum(n) AS mean_entropy
-        FROM
-          tmp
-        GROUP BY
-          input_word
-        """.format(answerfilter=answer_filter, name=vocabname)
-        #print(q)
-        if params is None:
-            c.execute(q)
+            is_candidate = "1"
+        params = ()
+        if input_range is not None:
+            conditions.append("input_id BETWEEN ? AND ?" if schema_version >= 2 else "input_word BETWEEN ? AND ?")
+            params = tuple(input_range)
+        answer_filter = "" if len(conditions) == 0 else "WHERE " + " AND ".join(conditions)
+
+        if schema_version >= 2:
+            q = """
+            with tmp AS (
+              SELECT
+                input_id,
+                judge,
+                count(*) AS n,
+                log2(count(*)) AS entropy
+              FROM
+                "{name}_judges"
+              {answerfilter}
+              GROUP BY
+                input_id, judge
+            ),
+            stats AS (
+              SELECT
+                input_id,
+                max(n) AS max_n,
+                1.0 * sum(n*n) / sum(n) AS mean_n,
+                sum(n*entropy) / sum(n) AS mean_entropy
+              FROM
+                tmp
+              GROUP BY
+                input_id
+            )
+            SELECT
+              w.word AS input_word,
+              s.max_n,
+              s.mean_n,
+              s.mean_entropy,
+              {is_candidate} AS is_candidate
+            FROM
+              stats AS s
+              INNER JOIN "{name}_words" AS w ON s.input_id = w.word_id
+            ORDER BY
+              input_word
+            """.format(answerfilter=answer_filter, is_candidate=is_candidate, name=vocabname)
         else:
-            c.execute(q, params)
+            q = """
+            with tmp AS (
+              SELECT
+                input_word,
+                judge,
+                count(*) AS n,
+                log2(count(*)) AS entropy
+              FROM
+                "{name}_judges"
+              {answerfilter}
+              GROUP BY
+                input_word, judge
+            )
+            SELECT
+              input_word,
+              max(n) AS max_n,
+              1.0 * sum(n*n) / sum(n) AS mean_n,
+              sum(n*entropy) / sum(n) AS mean_entropy,
+              {is_candidate} AS is_candidate
+            FROM
+              tmp
+            GROUP BY
+              input_word
+            """.format(answerfilter=answer_filter, is_candidate=is_candidate, name=vocabname)
+        #print(q)
+        c.execute(q, params)
+        out = [WordEvaluation(*row) for row in c]
+    out.sort(key=lambda row: (getattr(row, criterion), -row.is_candidate))
+    return out[:top_k]
 
-        candidate_set = None if candidates is None else set(candidates)
-        out = [row + (1 if candidate_set is None else int(row[0] in candidate_set),) for row in c]
-    out = [WordEvaluation(*row) for row in out]
+def _input_ranges(db: str or sqlite3.Connection, vocabname: str, n_shards: int, schema_version: int)-> list:
+    # split input words into contiguous ranges of word IDs (words in schema version 1) of about the same size
+    column = "word_id" if schema_version >= 2 else "word"
+    with _connect(db) as conn:
+        c = conn.cursor()
+        c.execute('SELECT {col} FROM "{name}_words" ORDER BY {col}'.format(col=column, name=vocabname))
+        keys = [row[0] for row in c]
+    size = -(-len(keys) // max(1, n_shards))  # ceiling
+    return [(keys[i], keys[min(i+size, len(keys))-1]) for i in range(0, len(keys), size)]
+
+def _merge_evaluations(shards: list, top_k: int=20, criterion: str="mean_entropy")-> list:
+    # same order as the serial evaluation: sorted by input word, then stable sorted by the criterion
+    out = [row for shard in shards for row in shard]
+    out.sort(key=lambda row: row.input_word)
     out.sort(key=lambda row: (getattr(row, criterion), -row.is_candidate))
     return out[:top_k]
 
-def _vocabnames(dbfile: str)-> list:
-    with sqlite3.connect(dbfile) as conn:
+def _vocabnames(db: str or sqlite3.Connection)-> list:
+    with _connect(db) as conn:
         c = conn.cursor()
         c.execute("SELECT name FROM sqlite_master")
         tables = [row[0] for row in c]
@@ -128,48 +619,22 @@ def _vocabnames(dbfile: str)-> list:
         out = list(set(t1) & set(t2))  # we need both _words and _judges tables
     return out
 
-def _words(dbfile: str, vocabname: str)-> list:
-    with sqlite3.connect(dbfile) as conn:
+def _words(db: str or sqlite3.Connection, vocabname: str)-> list:
+    with _connect(db) as conn:
         c = conn.cursor()
-        c.execute('SELECT * FROM "{name}_words"'.format(name=vocabname))
+        c.execute('SELECT word FROM "{name}_words"'.format(name=vocabname))
         words = [row[0] for row in c]
     return words
 
-def _choose_word_with_weight(dbfile: str, vocabname: str)-> str:
-    with sqlite3.connect(dbfile) as conn:
-        sqlite3.enable_callback_tracebacks(True)
-        conn.create_function("log", 1, math.log)
+def _word_weights(db: str or sqlite3.Connection, vocabname: str)-> dict:
+    with _connect(db) as conn:
         c = conn.cursor()
-        # The query below uses the fact that
-        # Prob{ u_i^(1/w_i) > u_j^(1/w_j) } = w_i / (w_i + w_j),
-        #   where u_i, u_j ~ uniform(0, 1).
-        #
-        # References: 
-        #   https://utopia.duth.gr/~pefraimi/research/data/2007EncOfAlg.pdf
-        #   https://stackoverflow.com/questions/1398113/how-to-select-one-row-randomly-taking-into-account-a-weight
-        # 
-        # On SQLite, random() generate an integer from [-9223372036854775808, +9223372036854775808]
-        # Remove sign and take mod n to make them roughly uniform on [0, n-1]
-        # Then plus 0.5 to avoid zero, i.e. uniform on [0.5, ..., n-0.5]
-        # Dividing by n, uniform on [0.5/n, ... 1-0.5/n]
-        # With n large enough, the retult is roughly uniform on (0, 1)
-        q = """
-        SELECT
-          word,
-          -log((abs(random()) % 1000000 + 0.5) / 1000000.0) / weight  AS priority
-        FROM
-          "{name}_words"
-        WHERE
-          weight > 0
-        ORDER BY priority
-        LIMIT 1
-        """.format(name=vocabname)
-        c.execute(q)
-        ans = c.fetchall()
-    return ans[0][0]
-
-def _weight_defined(dbfile: str, vocabname: str)-> bool:
-    with sqlite3.connect(dbfile) as conn:
+        c.execute('SELECT word, weight FROM "{name}_words" ORDER BY rowid'.format(name=vocabname))
+        weights = dict(c.fetchall())
+    return weights
+
+def _weight_defined(db: str or sqlite3.Connection, vocabname: str)-> bool:
+    with _connect(db) as conn:
         c = conn.cursor()
         # check the existing column
         c.execute('SELECT * FROM "{name}_words" LIMIT 1'.format(name=vocabname))
@@ -179,12 +644,18 @@ def _weight_defined(dbfile: str, vocabname: str)-> bool:
     return False
 
 
-class WordleAISQLite(WordleAI):
+class WordleAISQLite(_NoisyDecisionMixin, WordleAI):
     """
     Wordle AI with SQLite backend
 
     Vocab information is stored in {vocabname}_words and {vocabname}_judges
 
+    The AI object keeps one database connection per thread, which is reused by all the methods.
+    Call `close` when finished, or use the object as a context manager.
+
+    Evaluation at the first turn depends only on the vocab, the nonanswer words and the criterion,
+    so it is stored in the opening book table {vocabname}_opening on first use and looked up afterwards.
+
     Args:
         vocabname (str):
             Name of vocaburary
@@ -197,6 +668,9 @@ class WordleAISQLite(WordleAI):
             SQLite database file
             If not supplied, use environment variable `WORDLEAISQL_DBFILE` if exists,
             otherwise './wordleai.db' in the current directory is used
+        sqlite_pragmas (dict):
+            Pragmas applied to the database connections, e.g. {"cache_size": -65536, "mmap_size": 268435456}
+            Given values are added to or override `DEFAULT_PRAGMAS`
 
         decision_metric (str):
             The criteria to pick a word
@@ -212,29 +686,60 @@ class WordleAISQLite(WordleAI):
             Compile the C++ code again if the source code has no change
         cpp_compiler (str):
             Command name of the C++ compiler. If None, 'g++' and 'clang++' are searched
+        cpp_threads (int):
+            Number of threads for the C++ precomputation. If None, all hardware threads are used
 
         resetup (bool):
-            Setup again if the vocabname already exists
+            Setup again if the vocabname already exists and `words` differ from the vocab in the database
+            Words and weights are compared by the hashes recorded at the setup,
+            and only the weights are updated if the word list is unchanged
+        use_opening_book (bool):
+            Look up the first turn evaluation from the opening book, building it if not available
+        evaluation_cache (EvaluationCache):
+            Cache of evaluation results, which can be shared by AI objects
+            If None, evaluation results are not cached
+        sql_candidates (bool):
+            Compute the answer candidates in SQL and keep them in a temporary table joined by the evaluation query
+            If False, candidates are computed in python
+        workers (int):
+            Number of threads to evaluate input words in parallel, each with its own database connection
+            Input words are split into ranges, and the result is the same as the serial evaluation
+            Only effective for the databases of schema version 1 and 2, where SQLite computes the evaluation
+            without the GIL. Schema version 3 (the default) is evaluated serially, since the packed judges
+            are counted in numpy under the GIL. Not applicable to the in-memory database
+        read_only (bool):
+            Open the database as an immutable file, so that many processes can share a prebuilt database without locks
+            The vocab must already exist, `words` is ignored and the opening book is not stored
+            The file must not be modified while the AI object is alive
+        wal (bool):
+            Use the write-ahead log, so that readers are not blocked while another connection writes to the database
     """
-    def __init__(self, vocabname: str, words: str or list or dict=None, dbfile: str=None,
+    sql_candidates = False  # subclasses without the judges table compute candidates in python
+    workers = 1
+    read_only = False
+    _meta_backend = "sqlite"  # backend name in the metadata table
+
+    def __init__(self, vocabname: str, words: str or list or dict=None, dbfile: str=None, sqlite_pragmas: dict=None,
                  decision_metric: str="mean_entropy", candidate_weight: float=0.3, strength: float=6,
-                 use_cpp: bool=True, cpp_recompile: bool=False, cpp_compiler: str=None, resetup: bool=False, **kwargs):
+                 use_cpp: bool=True, cpp_recompile: bool=False, cpp_compiler: str=None, cpp_threads: int=None,
+                 resetup: bool=False, use_opening_book: bool=True,
+                 evaluation_cache: EvaluationCache=None, sql_candidates: bool=True, workers: int=1,
+                 read_only: bool=False, wal: bool=False, **kwargs):
         if dbfile is None:
             dbfile = os.environ.get("WORDLEAISQL_DBFILE")
             if dbfile is None:
                 dbfile = "./wordleai.db"
         os.makedirs(os.path.dirname(os.path.abspath(dbfile)), exist_ok=True)
-        self.dbfile = dbfile
+        self._init_db(dbfile, sqlite_pragmas, read_only=read_only, wal=wal)
         logger.info("SQLite database: '%s'", self.dbfile)
         self.vocabname = vocabname
-        self.decision_metric = decision_metric
-        self.candidate_weight = candidate_weight
-        self.strength = min(max(strength, 0), 10)  # clip to [0, 10]
-        # strength is linearly converted to the power of noise: 0 -> +5, 10 -> -5
-        # larger noise, close to random decision
-        self.decision_noise = math.pow(10, 5-self.strength)
-
-        if resetup or (vocabname not in self.vocabnames):
+        self._set_decision_params(decision_metric, candidate_weight, strength)
+
+        if read_only:
+            assert not resetup, "read-only database cannot be setup"
+        self._meta = self._load_meta()
+        if self._meta is None or resetup:
+            assert not read_only, "vocab '{}' is not found".format(vocabname)
             assert words is not None, "`words` must be supplied to setup the vocab '{}'".format(vocabname)
             _words = (
                 words if isinstance(words, dict) else
@@ -244,15 +749,133 @@ class WordleAISQLite(WordleAI):
             )
             if _words is None:
                 raise TypeError("Unsupported type 'words': '{}'".format(type(words)))
-            with _timereport("Setup tables for vocabname '%s'" % vocabname):
-                _setup(dbfile=dbfile, vocabname=vocabname, words=_words, use_cpp=use_cpp, recompile=cpp_recompile, compiler=cpp_compiler)
+            change = "words" if self._meta is None else _vocab_change(self._meta, _words, SCHEMA_VERSION)
+            if change == "words":
+                with _timereport("Setup tables for vocabname '%s'" % vocabname):
+                    _setup(db=self.db, vocabname=vocabname, words=_words, use_cpp=use_cpp, recompile=cpp_recompile, compiler=cpp_compiler,
+                           threads=cpp_threads)
+            elif change == "weights":
+                logger.info("Word list of vocabname '%s' is unchanged, only the weights are updated", vocabname)
+                _update_weights(self.db, "{}_words".format(vocabname), self._meta, _words)
+            else:
+                logger.info("Vocabname '%s' is unchanged, setup is skipped", vocabname)
+            self._meta = self._load_meta()
         # else:
         #     _ensure_word_weight_column(dbfile, vocabname)  # make sure previously created words table has the weight column
+        self.schema_version = self._meta["schema_version"]
+        self.use_opening_book = use_opening_book
+        self.evaluation_cache = evaluation_cache
+        self.sql_candidates = sql_candidates
+        assert workers >= 1, "workers must be positive"
+        self.workers = workers
+        if workers > 1 and self.schema_version >= 3:
+            logger.info("workers=%d has no effect for the schema version %d, evaluated serially", workers, self.schema_version)
 
         self._info = []                  # infomation of the judge results
         self._nonanswer_words = set([])  # words that cannot become an answer
         #self.set_candidates()
 
+    def _init_db(self, dbfile: str, sqlite_pragmas: dict=None, read_only: bool=False, wal: bool=False):
+        assert not (read_only and wal), "read-only database does not use the write-ahead log"
+        if read_only:
+            assert os.path.isfile(dbfile), "database file '{}' is not found".format(dbfile)
+        self.dbfile = dbfile
+        self.read_only = read_only
+        self.sqlite_pragmas = DEFAULT_PRAGMAS.copy()
+        if wal:
+            self.sqlite_pragmas.update(WAL_PRAGMAS)
+        if sqlite_pragmas is not None:
+            self.sqlite_pragmas.update(sqlite_pragmas)
+        self._local = threading.local()  # connection for each thread
+        self._connections = []           # all connections opened, to be closed at once
+        self._connections_lock = threading.Lock()
+        self._candidate_keys = {}        # state of the candidate table of each connection
+        self._executor = None            # thread pool for the parallel evaluation
+
+    def _init_connection(self, conn: sqlite3.Connection)-> sqlite3.Connection:
+        return _init_connection(conn, self.sqlite_pragmas)
+
+    def _legacy_meta(self)-> dict:
+        return _legacy_meta(self.db, self.vocabname)
+
+    def _load_meta(self)-> dict:
+        # metadata of the vocab, read once and kept in the object
+        # vocabs created before the metadata table are registered on first use
+        # returns None if the vocab does not exist
+        meta = _read_meta(self.db, self._meta_backend, self.vocabname)
+        if meta is None:
+            meta = self._legacy_meta()
+            if meta is not None and not self.read_only:
+                _write_meta(self.db, meta)
+                self.db.commit()
+        return meta
+
+    def _refresh_meta(self)-> dict:
+        # the vocab may be set up again by another AI object or process after this object is created,
+        # so the metadata is read again on use, and the states derived from the old vocab are discarded if changed
+        if self.read_only:
+            return self._meta  # immutable database
+        meta = _read_meta(self.db, self._meta_backend, self.vocabname)
+        if meta is not None and meta != self._meta:
+            logger.info("Vocab '%s' has been changed in the database, metadata is reloaded", self.vocabname)
+            self._meta = meta
+            self.schema_version = meta["schema_version"]
+            self._candidate_keys.clear()  # candidate tables keep the word IDs of the old vocab
+            self._vocab_hash = None       # namespace of the evaluation cache
+            self._sampler = None          # answer sampler by the old weights
+        return self._meta
+
+    @property
+    def db(self)-> sqlite3.Connection:
+        """Database connection for the current thread"""
+        # in-memory database is only visible to a single connection, so it is shared by all threads
+        local = None if self.dbfile == ":memory:" else self._local
+        with self._connections_lock:
+            conn = getattr(local, "conn", None) if local is not None else (self._connections[0] if self._connections else None)
+            if conn is None:
+                conn = self._init_connection(_open(self.dbfile, read_only=self.read_only))
+                self._connections.append(conn)
+                if local is not None:
+                    local.conn = conn
+        return conn
+
+    def _map_workers(self, func, items: list)-> list:
+        # threads are kept alive, so that each of them reuses its own connection
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self.workers)
+        return list(self._executor.map(func, items))
+
+    @property
+    def _parallel(self)-> bool:
+        # in-memory database is shared by one connection, so it cannot be read in parallel
+        return self.workers > 1 and self.dbfile != ":memory:"
+
+    def close(self):
+        """Close all database connections"""
+        if getattr(self, "_executor", None) is not None:
+            self._executor.shutdown()
+            self._executor = None
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+            self._local = threading.local()
+            self._candidate_keys.clear()
+        logger.debug("Database connections closed")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __del__(self):
+        try:
+            if hasattr(self, "_connections"):
+                self.close()
+        except Exception as e:
+            logger.warning("Failed to close the database connections: '%s'", e)
+
     @property
     def name(self)-> str:
         return "Wordle AI (SQLite backend)"
@@ -260,55 +883,95 @@ class WordleAISQLite(WordleAI):
     @property
     def vocabnames(self)-> list:
         """Available vocab names"""
-        return _vocabnames(self.dbfile)
+        return _vocabnames(self.db)
 
     @property
     def words(self)-> list:
         """All words that can be inputted"""
-        return _words(self.dbfile, self.vocabname)
+        return _words(self.db, self.vocabname)
 
-    def evaluate(self, top_k: int=20, criterion: str="mean_entropy")-> list:
-        """
-        Evaluate input words and return the top ones in accordance with the given criterion
-        """
-        return _evaluate(self.dbfile, self.vocabname, top_k=top_k, criterion=criterion, candidates=self.candidates)
+    @property
+    def _opening_table(self)-> str:
+        return _opening_table(self.vocabname)
+
+    def opening_book(self, criterion: str="mean_entropy")-> list:
+        """Evaluation of all words at the first turn, built on first use"""
+        key = _opening_book_key(self.nonanswer_words, *self._evaluation_params())
+        out = _read_opening_book(self.db, self._opening_table, key, criterion)
+        if out is None:
+            with _timereport("Building opening book for vocabname '%s' (criterion: '%s')" % (self.vocabname, criterion)):
+                info = self._info
+                self._info = []  # evaluate with no information regardless of the current state
+                try:
+                    out = self._run_evaluation(top_k=None, criterion=criterion)
+                finally:
+                    self._info = info
+                if not self.read_only and self._evaluation_complete():
+                    _write_opening_book(self.db, self._opening_table, key, criterion, out)
+        return out
+
+    def _sync_candidate_table(self)-> bool:
+        # fill the candidate table of the current connection if the game state has changed since the last time
+        # returns False if candidates cannot be computed in SQL
+        if not self.sql_candidates:
+            return False
+        meta = self._refresh_meta()
+        conn = self.db
+        key = (tuple(self.info), frozenset(self.nonanswer_words))
+        if self._candidate_keys.get(id(conn)) == key:
+            return True
+        input_words = set(w for w, _ in self.info)
+        if len(input_words) > 0:
+            c = conn.execute('SELECT count(*) FROM "{name}_words" WHERE word IN ({placeholder})'.format(
+                name=self.vocabname, placeholder=",".join("?" * len(input_words))), tuple(input_words))
+            if c.fetchone()[0] < len(input_words):
+                return False  # judges are only available for the words in the vocab
+        _fill_candidates(conn, self.vocabname, self.info, self.nonanswer_words, self.schema_version,
+                         n_words=meta["n_words"], wordlen=meta["wordlen"])
+        self._candidate_keys[id(conn)] = key
+        return True
+
+    @property
+    def candidates(self)-> list:
+        """Subset of answer words filtered by given information"""
+        if not self._sync_candidate_table():
+            return WordleAI.candidates.fget(self)
+        tablename, column = _candidate_table(self.schema_version)
+        c = self.db.execute("""
+        SELECT w.word FROM temp."{table}" AS t INNER JOIN "{name}_words" AS w ON t.{col} = w.{col} ORDER BY w.rowid
+        """.format(table=tablename, name=self.vocabname, col=column))
+        return [row[0] for row in c]
+
+    def _run_evaluation(self, top_k: int=20, criterion: str="mean_entropy")-> list:
+        # evaluate without the opening book, top_k=None means all words
+        meta = self._refresh_meta()
+        sql_candidates = self._sync_candidate_table()
+        candidates = None if sql_candidates else self.candidates  # python candidates are computed only once
+
+        def _evaluate_range(input_range):
+            if sql_candidates and self._sync_candidate_table():  # candidate table of the connection of this thread
+                return _evaluate(self.db, self.vocabname, top_k=(top_k if input_range is None else None), criterion=criterion,
+                                 schema_version=self.schema_version, candidates_in_table=True, input_range=input_range,
+                                 n_words=meta["n_words"], wordlen=meta["wordlen"])
+            self._candidate_keys.pop(id(self.db), None)  # candidate table is overwritten below
+            return _evaluate(self.db, self.vocabname, top_k=(top_k if input_range is None else None), criterion=criterion,
+                             candidates=(self.candidates if candidates is None else candidates),
+                             schema_version=self.schema_version, input_range=input_range,
+                             n_words=meta["n_words"], wordlen=meta["wordlen"])
+
+        if not self._parallel or self.schema_version >= 3:
+            # packed judges are counted in numpy holding the GIL, so threads only add overhead
+            return _evaluate_range(None)
+        ranges = _input_ranges(self.db, self.vocabname, self.workers, self.schema_version)
+        return _merge_evaluations(self._map_workers(_evaluate_range, ranges), top_k=top_k, criterion=criterion)
+
+    def _compute_evaluation(self, top_k: int=20, criterion: str="mean_entropy")-> list:
+        if self.use_opening_book and len(self.info) == 0:
+            return self.opening_book(criterion)[:top_k]
+        return self._run_evaluation(top_k=top_k, criterion=criterion)
     
-    def pick_word(self):
-        num_remain = len(self.candidates)
-        #print(count, candidates)
-        if num_remain == 1:
-            return self.candidates[0]
-        elif num_remain == 0:
-            print("Warning: No candidates left. This is a random choice")
-            return random.choice(self.words)
-
-        results = self.evaluate(top_k=10000, criterion=self.decision_metric)
-        #print(results[:10], len(results))        
-        words = [row.input_word for row in results]
-        scores = [getattr(row, self.decision_metric) for row in results]  # score of eadch word, the smaller the better
-        if self.decision_metric in ("mean_n", "max_n"):
-            # we take log of the score to adjust for the scale
-            # add 1p just in case to avoid the zero error
-            scores = [math.log1p(s) for s in scores]
-        
-        # Flip the sign and adjust for the candidates
-        for i, row in enumerate(results):
-            scores[i] = row.is_candidate * self.candidate_weight - scores[i]
-        # Subtract the maximum to avoid overflow
-        maxscore = max(scores)
-        scores = [s - maxscore for s in scores]
-        # Add randomness
-        weights = [math.exp(s / self.decision_noise) for s in scores]
-        
-        out = random.choices(words, weights=weights, k=1)
-        return out[0]
-
-    def choose_answer_word(self, weighted: bool=True)-> str:
-        """Randomly choose an answer word in accordance with the given weight"""
-        if not weighted:
-            return random.choice(self.words)
-
-        if not _weight_defined(self.dbfile, self.vocabname):
+    def _answer_weights(self)-> dict:
+        if not self._refresh_meta()["weight_defined"]:
             print("Word weight is not defined. Please call `WordleAISQLite` with `resetup=True` next time", file=sys.stderr)
-            return random.choice(self.words)
-        return _choose_word_with_weight(self.dbfile, self.vocabname)
\ No newline at end of file
+            return {w: 1.0 for w in self.words}
+        return _word_weights(self.db, self.vocabname)
\ No newline at end of file
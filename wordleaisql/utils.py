@@ -3,16 +3,18 @@
 import os
 import gzip
 import sys
-import itertools
+import random
 import hashlib
+import ctypes
 import subprocess
 from collections import Counter, namedtuple
 from contextlib import contextmanager
-from datetime import datetime
+from datetime import datetime, timedelta
 from tempfile import TemporaryDirectory
 from logging import getLogger
 logger = getLogger(__name__)
 
+import numpy as np
 from tqdm import tqdm
 
 def _dedup(x: list)-> list: 
@@ -49,6 +51,188 @@ def wordle_judge(input_word: str, answer_word: str)-> int:
         power *= 3
     return out
 
+def encode_words(words: list)-> np.ndarray:
+    """
+    Encode words into a 2-D integer array of unicode code points
+
+    All words must be of the same length.
+    Row i of the output corresponds to words[i], and each column to a letter position.
+    """
+    words = list(words)
+    wordlens = set(len(w) for w in words)
+    assert len(wordlens) <= 1, "word length must be equal, but '{}'".format(wordlens)
+    wordlen = wordlens.pop() if len(wordlens) > 0 else 0
+    if len(words) == 0 or wordlen == 0:
+        return np.zeros((len(words), wordlen), dtype=np.int32)
+    # fixed-width unicode array is stored as UCS4, so it can be viewed as int32 code points directly
+    return np.array(words, dtype="<U{}".format(wordlen)).view(np.int32).reshape(len(words), wordlen)
+
+def _judge_dtype(wordlen: int):
+    # smallest unsigned integer type that can hold 3^wordlen - 1
+    if wordlen <= 5:
+        return np.uint8
+    elif wordlen <= 10:
+        return np.uint16
+    elif wordlen <= 20:
+        return np.uint32
+    assert wordlen <= 40, "Words longer than 40 letters are not supported, but {}".format(wordlen)
+    return np.uint64
+
+def _wordle_judge_numpy(input_codes: np.ndarray, answer_codes: np.ndarray)-> np.ndarray:
+    # Vectorized version of `wordle_judge`
+    # input_codes and answer_codes are integer arrays of shape (..., wordlen) that are broadcastable to each other
+    # e.g. (n_inputs, 1, wordlen) and (1, n_answers, wordlen) gives the judges for all pairs
+    wordlen = input_codes.shape[-1]
+    exact = (input_codes == answer_codes)
+    unmatched = ~exact
+    out = np.zeros(exact.shape[:-1], dtype=_judge_dtype(wordlen))
+    for i in range(wordlen):
+        letter = input_codes[..., i]
+        # number of the letter in the answer word, except for the exact matches
+        available = np.zeros(out.shape, dtype=np.int8)
+        for k in range(wordlen):
+            available += (answer_codes[..., k] == letter) & unmatched[..., k]
+        # number of the letter already consumed by the partial matches on the left
+        used = np.zeros(out.shape, dtype=np.int8)
+        for j in range(i):
+            used += (input_codes[..., j] == letter) & unmatched[..., j]
+        partial = unmatched[..., i] & (available > used)
+        out *= 3
+        out += exact[..., i].astype(out.dtype) * 2
+        out += partial
+    return out
+
+def wordle_judge_batch(input_codes: np.ndarray, answer_codes: np.ndarray, max_block_size: int=2**22, use_cpp: bool=None,
+                       threads: int=None)-> np.ndarray:
+    """
+    Judge all pairs of input and answer words at once
+
+    Args:
+        input_codes (2-D integer array):
+            Input words encoded by `encode_words`, shape (n_inputs, wordlen)
+        answer_codes (2-D integer array):
+            Answer words encoded by `encode_words`, shape (n_answers, wordlen)
+        max_block_size (int):
+            Maximum number of word pairs computed at once, to limit the memory usage
+            Only relevant to the numpy implementation
+        use_cpp (bool):
+            If True, use the C++ library, which is compiled if not yet available
+            If None, use the C++ library only if it is already loaded in the process, e.g. by the setup of the SQLite backend
+            If False or the library is not available, numpy implementation is used
+        threads (int):
+            Number of threads used by the C++ library. If None, all hardware threads are used
+
+    Returns:
+        2-D unsigned integer array of shape (n_inputs, n_answers),
+        where [i, j] equals `wordle_judge(input_words[i], answer_words[j])`
+    """
+    input_codes = np.asarray(input_codes)
+    answer_codes = np.asarray(answer_codes)
+    assert input_codes.ndim == 2 and answer_codes.ndim == 2, "Words must be encoded as 2-D arrays"
+    assert input_codes.shape[1] == answer_codes.shape[1], \
+        "word length must be equal, but {} and {}".format(input_codes.shape[1], answer_codes.shape[1])
+    n_inputs, n_answers = input_codes.shape[0], answer_codes.shape[0]
+    out = np.empty((n_inputs, n_answers), dtype=_judge_dtype(input_codes.shape[1]))
+    lib = _load_cpp_lib() if use_cpp else (_cpp_lib if use_cpp is None else None)  # never compiles unless requested
+    if lib is not None:
+        _wordle_judge_cpp(lib, input_codes, answer_codes, out, threads=threads)
+        return out
+    rows = max(1, max_block_size // max(1, n_answers))
+    for start in range(0, n_inputs, rows):
+        end = min(start + rows, n_inputs)
+        out[start:end] = _wordle_judge_numpy(input_codes[start:end, None, :], answer_codes[None, :, :])
+    return out
+
+def judge_stats(judges: np.ndarray, n_codes: int, columns: np.ndarray=None, block_size: int=2**24)-> tuple:
+    """
+    Compute evaluation metrics of input words from a judge matrix
+
+    Args:
+        judges (2-D integer array):
+            Judge matrix of shape (n_inputs, n_answers), e.g. output of `wordle_judge_batch`
+            May be a memory-mapped array, which is read block by block
+        n_codes (int):
+            Number of possible judge codes, i.e. 3^wordlen
+        columns (1-D integer array):
+            Indices of answer words to use. If None, all columns are used
+
+    Returns:
+        Tuple of three 1-D arrays, max_n, mean_n and mean_entropy of each input word
+    """
+    n_inputs = judges.shape[0]
+    n_answers = judges.shape[1] if columns is None else len(columns)
+    max_n = np.zeros(n_inputs, dtype=np.int64)
+    mean_n = np.zeros(n_inputs, dtype=np.float64)
+    mean_entropy = np.zeros(n_inputs, dtype=np.float64)
+    if n_inputs == 0 or n_answers == 0:
+        return max_n, mean_n, mean_entropy
+    # histogram by bincount for short words, otherwise by sort (np.unique) to avoid huge histograms
+    use_bincount = (n_codes <= 6561)
+    rows = max(1, block_size // max(n_answers, n_codes if use_bincount else 1))
+    for start in range(0, n_inputs, rows):
+        block = judges[start:(start+rows)]
+        if columns is not None:
+            block = block[:, columns]
+        block = np.asarray(block, dtype=np.int64)
+        r = block.shape[0]
+        keys = (block + (np.arange(r, dtype=np.int64) * n_codes)[:, None]).ravel()
+        if use_bincount:
+            counts = np.bincount(keys, minlength=r*n_codes).reshape(r, n_codes)
+            max_n[start:(start+r)] = counts.max(axis=1)
+            counts = counts.astype(np.float64)
+            mean_n[start:(start+r)] = (counts * counts).sum(axis=1) / n_answers
+            mean_entropy[start:(start+r)] = (counts * np.log2(np.maximum(counts, 1))).sum(axis=1) / n_answers
+        else:
+            keys, counts = np.unique(keys, return_counts=True)
+            rowids = keys // n_codes
+            np.maximum.at(max_n[start:(start+r)], rowids, counts)
+            counts = counts.astype(np.float64)
+            mean_n[start:(start+r)] = np.bincount(rowids, weights=counts*counts, minlength=r) / n_answers
+            mean_entropy[start:(start+r)] = np.bincount(rowids, weights=counts*np.log2(counts), minlength=r) / n_answers
+    return max_n, mean_n, mean_entropy
+
+class _AliasSampler:
+    """
+    Weighted random sampling of words by Walker's alias method
+
+    The table is built once in O(n), and each draw takes O(1).
+    Words with non-positive weights are never drawn.
+
+    Args:
+        weights (dict):
+            Mapping from word to the weight
+    """
+    def __init__(self, weights: dict):
+        items = [(w, p) for w, p in weights.items() if p > 0]
+        assert len(items) > 0, "There is no word with positive weight"
+        self.words = [w for w, _ in items]
+        n = len(items)
+        total = sum(p for _, p in items)
+        prob = [p * n / total for _, p in items]  # scaled so that the average is one
+        alias = list(range(n))
+        small = [i for i, q in enumerate(prob) if q < 1]
+        large = [i for i, q in enumerate(prob) if q >= 1]
+        while len(small) > 0 and len(large) > 0:
+            i, j = small.pop(), large.pop()
+            alias[i] = j  # the rest of the slot i is filled by j
+            prob[j] -= 1 - prob[i]
+            (small if prob[j] < 1 else large).append(j)
+        for i in small + large:
+            prob[i] = 1.0  # remaining slots are full, up to the rounding error
+        self.prob = prob
+        self.alias = alias
+
+    def sample(self, k: int=1, rng: random.Random=None)-> list:
+        """Draw k words with replacement, using `rng` if given instead of the global random module"""
+        rng = random if rng is None else rng
+        n = len(self.words)
+        out = []
+        for _ in range(k):
+            u = rng.random() * n  # integer part chooses the slot, and the fraction chooses the word in it
+            i = min(int(u), n - 1)
+            out.append(self.words[i] if u - i < self.prob[i] else self.words[self.alias[i]])
+        return out
+
 def decode_judgement(number: int or str)-> int:
     # convert to human-friendly integer
     number = int(number)
@@ -141,23 +325,79 @@ def default_wordle_vocab()-> dict:
     words = _read_vocabfile(vocabfile)
     return words
 
+class _ProgressReport:
+    """Logs the throughput and ETA of a task, at most once per `interval` seconds"""
+    def __init__(self, taskname: str, total: int=None, unit: str="rows", interval: float=10.0):
+        self.taskname = taskname
+        self.total = total
+        self.unit = unit
+        self.interval = interval
+        self.done = 0
+        self.start_time = datetime.now()
+        self._last_report = self.start_time
+
+    @property
+    def rate(self)-> float:
+        """Units processed per second"""
+        elapsed = (datetime.now() - self.start_time).total_seconds()
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+    def update(self, n: int):
+        self.done += n
+        now = datetime.now()
+        if (now - self._last_report).total_seconds() < self.interval:
+            return
+        self._last_report = now
+        rate = self.rate
+        if self.total is None or rate <= 0:
+            logger.info("%s: %d %s (%.0f %s/s)", self.taskname, self.done, self.unit, rate, self.unit)
+        else:
+            eta = timedelta(seconds=int(max(0, self.total - self.done) / rate))
+            logger.info("%s: %d / %d %s (%.0f %s/s, ETA: %s)",
+                        self.taskname, self.done, self.total, self.unit, rate, self.unit, eta)
+
 @contextmanager
-def _timereport(taskname: str="task", datetimefmt: str="%Y-%m-%d %H:%M:%S"):
+def _timereport(taskname: str="task", datetimefmt: str="%Y-%m-%d %H:%M:%S", total: int=None, unit: str="rows"):
+    # yields a progress report, whose `update` can be called to log the throughput and ETA
     t1 = datetime.now()
     logger.info("Start %s (%s)", taskname, t1.strftime(datetimefmt))
-    yield
+    report = _ProgressReport(taskname, total=total, unit=unit)
+    yield report
     t2 = datetime.now()
-    logger.info("End %s (%s, elapsed: %s)", taskname, t2.strftime(datetimefmt), t2-t1)
+    if report.done > 0:
+        logger.info("End %s (%s, elapsed: %s, %d %s, %.0f %s/s)", taskname, t2.strftime(datetimefmt), t2-t1,
+                    report.done, unit, report.rate, unit)
+    else:
+        logger.info("End %s (%s, elapsed: %s)", taskname, t2.strftime(datetimefmt), t2-t1)
 
 
-def _all_wordle_judges(words: list):
-    total = len(words)**2
-    nchar = len(str(total))
-    for input_word, answer_word in tqdm(itertools.product(words, words), total=total):
-        response = wordle_judge(input_word, answer_word)
-        yield (input_word, answer_word, response)
+def _wordle_judge_blocks(words: list, block_size: int=2**22, use_cpp: bool=False, threads: int=None):
+    # yields (first row index, judge matrix of the row block) for all input words
+    words = list(words)
+    codes = encode_words(words)
+    rows = max(1, block_size // max(1, len(words)))
+    for start in range(0, len(words), rows):
+        yield start, wordle_judge_batch(codes[start:(start+rows)], codes, max_block_size=block_size, use_cpp=use_cpp, threads=threads)
 
-def _compile_cpp(scriptfile: str, execfile: str, md5file: str, compiler: str=None, recompile: bool=False)-> bool:
+def _judge_blocks_progress(blocks, total: int):
+    with tqdm(total=total) as pbar:
+        for start, judges in blocks:
+            yield start, judges
+            pbar.update(judges.size)
+
+def _judge_blocks_to_triples(words: list, blocks):
+    # convert row blocks to (input_word, answer_word, judge)
+    for start, judges in blocks:
+        for input_word, row in zip(words[start:(start+judges.shape[0])], judges.tolist()):
+            for answer_word, response in zip(words, row):
+                yield (input_word, answer_word, response)
+
+def _all_wordle_judges(words: list, block_size: int=2**22, use_cpp: bool=False, threads: int=None):
+    words = list(words)
+    blocks = _wordle_judge_blocks(words, block_size=block_size, use_cpp=use_cpp, threads=threads)
+    return _judge_blocks_to_triples(words, _judge_blocks_progress(blocks, len(words)**2))
+
+def _compile_cpp(scriptfile: str, execfile: str, md5file: str, compiler: str=None, recompile: bool=False, options: list=None)-> bool:
     # Returns true is successful
 
     # we keep the md5 info of the source file to detect any changes
@@ -198,7 +438,8 @@ def _compile_cpp(scriptfile: str, execfile: str, md5file: str, compiler: str=Non
 
         logger.info("Compiling C++ script (%s)", scriptfile)
         try:
-            subprocess.run([compiler, "-Wall", "-Werror", "-O3", "-o", execfile, scriptfile])
+            options = [] if options is None else list(options)
+            subprocess.run([compiler, "-Wall", "-Werror", "-O3"] + options + ["-o", execfile, scriptfile], check=True)
             with open(md5file, "w") as f:
                 f.write(hash_this)
         except Exception as e:
@@ -227,38 +468,160 @@ def _prep_cpp(words: list, recompile: bool=False, compiler: str=None)-> str:
     execfile = os.path.expanduser("~/.worldaisql/wordle-judge-all.o")
     md5file = os.path.expanduser("~/.worldaisql/wordle-all-pairs.cpp.md5sum")
 
-    if not _compile_cpp(scriptfile, execfile, md5file, compiler=compiler, recompile=recompile):
+    if not _compile_cpp(scriptfile, execfile, md5file, compiler=compiler, recompile=recompile, options=["-pthread"]):
         logger.info("C++ compile failed")
         return None
     return execfile
 
-def _all_wordle_judges_cpp(words: list, execfile: str):
+def _prep_cpp_lib(recompile: bool=False, compiler: str=None)-> str:
+    # Returns:
+    #   compiled shared library path if cpp enhancement is available
+    #   none otherwise
+    scriptfile = _package_data_file("wordle-judge-all.cpp")
+    libfile = os.path.expanduser("~/.worldaisql/wordle-judge-all.so")
+    md5file = os.path.expanduser("~/.worldaisql/wordle-judge-all.so.md5sum")
+    options = ["-pthread", "-shared", "-fPIC", "-DWORDLE_JUDGE_LIB"]
+    if not _compile_cpp(scriptfile, libfile, md5file, compiler=compiler, recompile=recompile, options=options):
+        logger.info("C++ library compile failed")
+        return None
+    return libfile
+
+_cpp_lib = None          # loaded C++ library (ctypes.CDLL)
+_cpp_lib_failed = False  # true if we failed to prepare the library, so as not to try again
+
+def _load_cpp_lib(recompile: bool=False, compiler: str=None)-> ctypes.CDLL:
+    # Returns:
+    #   loaded C++ judge library if available
+    #   none otherwise
+    global _cpp_lib, _cpp_lib_failed
+    if not recompile:
+        if _cpp_lib is not None:
+            return _cpp_lib
+        if _cpp_lib_failed:
+            return None
+    libfile = _prep_cpp_lib(recompile=recompile, compiler=compiler)
+    if libfile is None:
+        _cpp_lib_failed = True
+        return None
+    try:
+        lib = ctypes.CDLL(libfile)
+        lib.wordle_judge_batch.argtypes = [ctypes.c_void_p, ctypes.c_long, ctypes.c_void_p, ctypes.c_long,
+                                           ctypes.c_int, ctypes.c_void_p, ctypes.c_int, ctypes.c_int]
+        lib.wordle_judge_batch.restype = ctypes.c_int
+    except (OSError, AttributeError) as e:
+        logger.warning("Failed to load C++ library '%s': '%s'", libfile, e)
+        _cpp_lib_failed = True
+        return None
+    _cpp_lib = lib
+    return _cpp_lib
+
+def _wordle_judge_cpp(lib: ctypes.CDLL, input_codes: np.ndarray, answer_codes: np.ndarray, out: np.ndarray, threads: int=None):
+    # fill `out` with the judges of all pairs by the C++ library
+    input_codes = np.ascontiguousarray(input_codes, dtype=np.int32)
+    answer_codes = np.ascontiguousarray(answer_codes, dtype=np.int32)
+    assert out.flags["C_CONTIGUOUS"] and out.shape == (input_codes.shape[0], answer_codes.shape[0])
+    ret = lib.wordle_judge_batch(input_codes.ctypes.data, input_codes.shape[0], answer_codes.ctypes.data, answer_codes.shape[0],
+                                 input_codes.shape[1], out.ctypes.data, out.dtype.itemsize, 0 if threads is None else threads)
+    if ret != 0:
+        raise RuntimeError("C++ judge failed with code {}".format(ret))
+
+def _run_cpp(words: list, execfile: str, tmpdir: str, binary: bool=True, threads: int=None)-> str:
+    # run the c++ executable and returns the output file
+    # create input file for the c++ script
+    # words are limited to one-byte letters by `_prep_cpp`, so latin-1 keeps one byte per letter
+    infile = os.path.join(tmpdir, "infile.txt")
+    with open(infile, "w", encoding="latin-1") as f:
+        f.write(str(len(words)))
+        f.write("\n")
+        f.write(" ".join(words))
+
+    # run c++ script to save the results
+    outfile = os.path.join(tmpdir, "outfile.bin" if binary else "outfile.txt")
+    #outfile = "responses.txt"  # for temporary check for the output table
+    dtype = np.dtype(_judge_dtype(len(words[0])))
+    command = [execfile, "--binary", str(dtype.itemsize)] if binary else [execfile]
+    if threads is not None:
+        command += ["--threads", str(threads)]
+    # stderr is kept in the file to be reported on failures, see `_cpp_stderr`
+    with open(infile) as f, open(outfile, "wb") as g, open(os.path.join(tmpdir, "stderr.txt"), "wb") as h:
+        with _timereport("Computing all wordle results"):
+            proc = subprocess.run(command, stdin=f, stdout=g, stderr=h)
+    if proc.returncode != 0:
+        raise RuntimeError("C++ script failed with exit code {}: {}".format(proc.returncode, _cpp_stderr(tmpdir)))
+    return outfile
+
+def _cpp_stderr(tmpdir: str)-> str:
+    with open(os.path.join(tmpdir, "stderr.txt"), "rb") as f:
+        return f.read().decode("utf-8", errors="replace").strip()
+
+def _readinto_full(f, buf: memoryview)-> int:
+    # read until the buffer is full or EOF is reached, since a read may return fewer bytes than asked
+    size = 0
+    while size < len(buf):
+        r = f.readinto(buf[size:])
+        if not r:
+            break
+        size += r
+    return size
+
+def _wordle_judge_blocks_cpp(words: list, execfile: str, chunk_size: int=2**24, threads: int=None):
+    # yields (first row index, judge matrix of the row block) computed by the c++ executable
+    # note that the judge matrix is a view of a buffer reused for the next block
+    words = list(words)
     with TemporaryDirectory() as tmpdir:
-        # create input file for the c++ script
-        infile = os.path.join(tmpdir, "infile.txt")
-        with open(infile, "w") as f:
-            f.write(str(len(words)))
-            f.write(" ".join(words))
-
-        # run c++ script to save the results as a csv file
-        outfile = os.path.join(tmpdir, "outfile.txt")
-        #outfile = "responses.txt"  # for temporary check for the output table
-        with open(infile) as f, open(outfile, "w") as g:
-            with _timereport("Computing all wordle results"):
-                subprocess.run([execfile], stdin=f, stdout=g)
-        
-        # generate the outcomes
-        with open(outfile) as f:
-            total = len(words)**2
-            for line in tqdm(f, total=total):
-                yield line.strip().split(" ")
-    
-def all_wordle_judges(words: list, use_cpp: bool=True, recompile: bool=False, compiler: str=None):
+        outfile = _run_cpp(words, execfile, tmpdir, binary=True, threads=threads)
+        # read row blocks into a reusable buffer and view it as an array without copy
+        dtype = np.dtype(_judge_dtype(len(words[0])))
+        n = len(words)
+        rows = max(1, chunk_size // n)
+        buf = bytearray(rows * n * dtype.itemsize)
+        with open(outfile, "rb") as f:
+            i = 0
+            while i < n:
+                expected = min(rows, n - i) * n * dtype.itemsize
+                size = _readinto_full(f, memoryview(buf)[:expected])
+                if size < expected:
+                    raise RuntimeError("Output of the C++ script ended at {} of {} rows: {}".format(
+                        i + size // (n * dtype.itemsize), n, _cpp_stderr(tmpdir)))
+                judges = np.frombuffer(buf, dtype=dtype, count=expected // dtype.itemsize).reshape(-1, n)
+                yield i, judges
+                i += judges.shape[0]
+
+def _all_wordle_judges_cpp(words: list, execfile: str, binary: bool=True, chunk_size: int=2**24, threads: int=None):
+    words = list(words)
+    total = len(words)**2
+    if binary:
+        blocks = _wordle_judge_blocks_cpp(words, execfile, chunk_size=chunk_size, threads=threads)
+        yield from _judge_blocks_to_triples(words, _judge_blocks_progress(blocks, total))
+    else:
+        with TemporaryDirectory() as tmpdir:
+            outfile = _run_cpp(words, execfile, tmpdir, binary=False, threads=threads)
+            with open(outfile) as f:
+                for line in tqdm(f, total=total):
+                    yield line.strip().split(" ")
+
+def all_wordle_judge_blocks(words: list, use_cpp: bool=True, recompile: bool=False, compiler: str=None, threads: int=None):
+    """
+    Judge results of all word pairs by row blocks
+
+    Yields (start, judges), where judges[i, j] is the judge of input word words[start+i] and answer word words[j].
+    The judges array may be reused for the next block, so it must be consumed before proceeding.
+    """
+    words = list(words)
+    total = len(words)**2
     if use_cpp:
+        # in-process library first, then the standalone executable
+        if _load_cpp_lib(recompile=recompile, compiler=compiler) is not None:
+            return _judge_blocks_progress(_wordle_judge_blocks(words, use_cpp=True, threads=threads), total)
         execfile = _prep_cpp(words, recompile, compiler)
         if execfile is not None:
-            return _all_wordle_judges_cpp(words, execfile)
+            return _judge_blocks_progress(_wordle_judge_blocks_cpp(words, execfile, threads=threads), total)
         else:
-            logger.warning("C++ enhancement is not available, pure python implementation is used instead")
+            logger.warning("C++ enhancement is not available, numpy implementation is used instead")
+
+    return _judge_blocks_progress(_wordle_judge_blocks(words, use_cpp=False), total)
 
-    return _all_wordle_judges(words)
\ No newline at end of file
+def all_wordle_judges(words: list, use_cpp: bool=True, recompile: bool=False, compiler: str=None, threads: int=None):
+    words = list(words)
+    blocks = all_wordle_judge_blocks(words, use_cpp=use_cpp, recompile=recompile, compiler=compiler, threads=threads)
+    return _judge_blocks_to_triples(words, blocks)
@@ -1,13 +1,16 @@
 #include <iostream>
 #include <string>
 #include <vector>
-#include <cassert>
-#include <map>
+#include <thread>
+#include <algorithm>
+#include <cstdio>
+#include <cstdint>
+#include <cstdlib>
 
 /*
 Calculate wordle responses of all word pairs
 
-Input (standard input): 
+Input (standard input):
   N WORD_1 WORD_2 WORD_3 .... WORD_N
 
 Output (standard output):
@@ -17,84 +20,181 @@ Output (standard output):
   ....
   WORD_N WORD_N RESULT_{N,N}
 
+Binary output (with option `--binary BYTES`):
+  RESULT_{1,1} RESULT_{1,2} ... RESULT_{1,N} RESULT_{2,1} ... RESULT_{N,N}
+  Results are written in row-major order as raw unsigned integers of BYTES bytes (1, 2, 4 or 8)
+  in the native byte order, with no separator.
+
+Option `--threads THREADS` sets the number of threads to use (default: all hardware threads).
+Input words are split across the threads by rows, and the rows are written in order,
+so the output does not depend on the number of threads.
+
 Compile command example
-  g++ -Wall -Werr -O3 wordle-all-pairs.cpp
+  g++ -Wall -Werr -O3 -pthread wordle-all-pairs.cpp
+
+Shared library (without main, loaded by ctypes):
+  g++ -Wall -Werr -O3 -pthread -shared -fPIC -DWORDLE_JUDGE_LIB -o wordle-judge-all.so wordle-judge-all.cpp
 */
 
-int wordle_response(std::string input_word, std::string answer_word) {
-  size_t n1 = input_word.size();
-  size_t n2 = answer_word.size();
-  assert (n1==n2);
+// Wordle response for words encoded as integer arrays (e.g. unicode code points)
+// Letters of the answer word are matched by a small fixed-size buffer, with no heap allocation
+const int MAX_WORDLEN = 40;
 
-  //std::cerr << "Checking for exact match\n";
-  // check for the exact match
-  std::vector<bool> exact_match(n1, false);
-  for (size_t i=0; i<n1; i++) {
-    if (input_word[i]==answer_word[i]) exact_match[i] = true;
-  }
-  
-  //std::cerr << "Counting letters in answer word\n";
-  // count letters if not exact match
-  std::map<char, size_t> letter_count;
-  for (size_t i=0; i<n1; i++) {
-    if (exact_match[i]) continue;
-    if (letter_count.find(answer_word[i])==letter_count.end()) {
-      // key not in the map
-      letter_count.insert(std::make_pair(answer_word[i], 1));
-    } else {
-      letter_count[answer_word[i]]++;  
-    }    
+uint64_t wordle_response_codes(const int32_t *input_word, const int32_t *answer_word, int n1) {
+  bool exact_match[MAX_WORDLEN];
+  bool consumed[MAX_WORDLEN];  // answer letters already matched
+  for (int i=0; i<n1; i++) {
+    exact_match[i] = (input_word[i]==answer_word[i]);
+    consumed[i] = exact_match[i];
   }
-  
-  //std::cerr << "Checking for the partial match\n";
-  // check for the partial match
-  std::vector<bool> partial_match(n1, false);
-  for (size_t i=0; i<n1; i++) {
-    if (exact_match[i]) continue;
-    if (letter_count.find(input_word[i])==letter_count.end()) continue;
-    if (letter_count[input_word[i]]>0) {
-      partial_match[i] = true;
-      letter_count[input_word[i]]--;
+
+  uint64_t out = 0;
+  for (int i=0; i<n1; i++) {
+    out *= 3;
+    if (exact_match[i]) {
+      out += 2;
+      continue;
+    }
+    // partial match if the same letter remains unmatched in the answer word
+    for (int k=0; k<n1; k++) {
+      if (!consumed[k] && answer_word[k]==input_word[i]) {
+        consumed[k] = true;
+        out += 1;
+        break;
+      }
     }
   }
-  /*
-  for (int i=0; i<n1; i++) std::cout << exact_match[i] << " "; 
-  std::cout << "\n";
-  for (int i=0; i<n1; i++) std::cout << partial_match[i] << " "; 
-  std::cout << "\n";
-  */
-
-  //std::cerr << "Compiling output\n";
-  // compile output
-  int power = 1;
-  int out = 0;
-  for (size_t i=0; i<n1; i++) {
-    //std::cerr << i << " ";
-    size_t k = n1-1-i;
-    if (exact_match[k]) {
-      out += (power*2);
-    } else if (partial_match[k]) {
-      out += power ;
+  return out;
+}
+
+template <typename T>
+void judge_rows(const int32_t *inputs, long row_begin, long row_end, const int32_t *answers, long n_answers, int wordlen, T *out) {
+  for (long i=row_begin; i<row_end; i++) {
+    const int32_t *input_word = inputs + i*wordlen;
+    T *row = out + i*n_answers;
+    for (long j=0; j<n_answers; j++) {
+      row[j] = (T)wordle_response_codes(input_word, answers + j*wordlen, wordlen);
     }
-    power *= 3;
   }
+}
 
-  return out;
+int resolve_threads(int n_threads) {
+  if (n_threads > 0) return n_threads;
+  int n = (int)std::thread::hardware_concurrency();
+  return (n > 0) ? n : 1;
 }
 
+template <typename T>
+void judge_batch(const int32_t *inputs, long n_inputs, const int32_t *answers, long n_answers, int wordlen, T *out, int n_threads) {
+  n_threads = (int)std::min<long>(resolve_threads(n_threads), std::max<long>(n_inputs, 1));
+  if (n_threads <= 1) {
+    judge_rows<T>(inputs, 0, n_inputs, answers, n_answers, wordlen, out);
+    return;
+  }
+  // split rows into contiguous ranges, one for each thread
+  std::vector<std::thread> threads;
+  long chunk = (n_inputs + n_threads - 1) / n_threads;
+  for (int t=0; t<n_threads; t++) {
+    long row_begin = t * chunk;
+    long row_end = std::min(n_inputs, row_begin + chunk);
+    if (row_begin >= row_end) break;
+    threads.emplace_back(judge_rows<T>, inputs, row_begin, row_end, answers, n_answers, wordlen, out);
+  }
+  for (size_t t=0; t<threads.size(); t++) threads[t].join();
+}
+
+extern "C" {
+/*
+Judge all pairs of input and answer words.
+
+inputs and answers are row-major arrays of shape (n_inputs, wordlen) and (n_answers, wordlen).
+Results are written to out, a caller-provided row-major buffer of shape (n_inputs, n_answers)
+whose elements are unsigned integers of nbytes bytes.
+n_threads is the number of threads to use, where zero or negative means all hardware threads.
+Returns 0 if successful, nonzero otherwise.
+*/
+int wordle_judge_batch(const int32_t *inputs, long n_inputs, const int32_t *answers, long n_answers,
+                       int wordlen, void *out, int nbytes, int n_threads) {
+  if (wordlen > MAX_WORDLEN) return 2;
+  switch (nbytes) {
+    case 1: judge_batch<uint8_t>(inputs, n_inputs, answers, n_answers, wordlen, (uint8_t*)out, n_threads); return 0;
+    case 2: judge_batch<uint16_t>(inputs, n_inputs, answers, n_answers, wordlen, (uint16_t*)out, n_threads); return 0;
+    case 4: judge_batch<uint32_t>(inputs, n_inputs, answers, n_answers, wordlen, (uint32_t*)out, n_threads); return 0;
+    case 8: judge_batch<uint64_t>(inputs, n_inputs, answers, n_answers, wordlen, (uint64_t*)out, n_threads); return 0;
+  }
+  return 1;
+}
+}
+
+#ifndef WORDLE_JUDGE_LIB
+template <typename T>
+void write_all(const std::vector<std::string> &words, const std::vector<int32_t> &codes, int wordlen,
+               bool binary, int n_threads) {
+  long n = (long)words.size();
+  // compute a block of rows in parallel, then write it before moving on to the next block
+  long block_rows = std::max<long>(1, std::min<long>(n, (1L << 24) / std::max<long>(n, 1)));
+  block_rows = std::max<long>(block_rows, resolve_threads(n_threads));
+  std::vector<T> buf(block_rows * n);
+  for (long start=0; start<n; start+=block_rows) {
+    long rows = std::min(block_rows, n - start);
+    judge_batch<T>(codes.data() + start*wordlen, rows, codes.data(), n, wordlen, buf.data(), n_threads);
+    if (binary) {
+      std::fwrite(buf.data(), sizeof(T), rows * n, stdout);
+    } else {
+      for (long i=0; i<rows; i++) {
+        for (long j=0; j<n; j++) {
+          std::cout << words[start+i] << ' ' << words[j] << ' ' << (uint64_t)buf[i*n + j] << '\n';
+        }
+      }
+    }
+  }
+  std::cout.flush();
+  std::fflush(stdout);
+}
+
+
+int main(int argc, char *argv[]) {
+  int nbytes = 0;  // zero means text output
+  int n_threads = 0;  // zero means all hardware threads
+  for (int k=1; k<argc; k++) {
+    std::string arg(argv[k]);
+    if (arg=="--binary" && k+1<argc) {
+      nbytes = std::atoi(argv[++k]);
+    } else if (arg=="--threads" && k+1<argc) {
+      n_threads = std::atoi(argv[++k]);
+    } else {
+      std::cerr << "Unknown argument: " << arg << "\n";
+      return 1;
+    }
+  }
 
-int main() {
   int n;
   std::cin >> n;
   std::vector<std::string> words(n);
   for (int i=0; i<n; i++) std::cin >> words[i];
-  
+  int wordlen = (n > 0) ? (int)words[0].size() : 0;
+  if (wordlen > MAX_WORDLEN) {
+    std::cerr << "Words longer than " << MAX_WORDLEN << " letters are not supported\n";
+    return 1;
+  }
+  // encode words as byte codes, one row per word
+  std::vector<int32_t> codes((size_t)n * wordlen);
   for (int i=0; i<n; i++) {
-    for (int j=0; j<n; j++) {
-      //k++;
-      int res = wordle_response(words[i], words[j]);
-      std::cout << words[i] << ' ' << words[j] << ' ' << res << '\n';
+    if ((int)words[i].size() != wordlen) {
+      std::cerr << "Word length must be equal\n";
+      return 1;
     }
+    for (int k=0; k<wordlen; k++) codes[(size_t)i*wordlen + k] = (unsigned char)words[i][k];
   }
 
-}
\ No newline at end of file
+  switch (nbytes) {
+    case 0: write_all<uint64_t>(words, codes, wordlen, false, n_threads); return 0;
+    case 1: write_all<uint8_t>(words, codes, wordlen, true, n_threads); return 0;
+    case 2: write_all<uint16_t>(words, codes, wordlen, true, n_threads); return 0;
+    case 4: write_all<uint32_t>(words, codes, wordlen, true, n_threads); return 0;
+    case 8: write_all<uint64_t>(words, codes, wordlen, true, n_threads); return 0;
+  }
+  std::cerr << "Unsupported number of bytes: " << nbytes << "\n";
+  return 1;
+}
+#endif